@@ -359,13 +359,34 @@ def _add_functionality():
 
         return property(result)
 
+    def make_cached_context_getinfo(info_method, info_attr):
+        # Each query returns a new Context wrapper. Keeping one per object
+        # lets caches keyed on the context (see
+        # pyopencl.tools.first_arg_dependent_memoize) hold on to their
+        # entries for as long as the object is alive.
+        def result(self):
+            try:
+                return self._pyopencl_context
+            except AttributeError:
+                context = self._pyopencl_context = info_method(self, info_attr)
+                return context
+
+        return property(result)
+
     for cls, (info_method, info_class) in cls_to_info_cls.iteritems():
         for info_name, info_value in info_class.__dict__.iteritems():
             if info_name == "to_string" or info_name.startswith("_"):
                 continue
 
-            setattr(cls, info_name.lower(), make_getinfo(
-                    info_method, getattr(info_class, info_name)))
+            if (info_name == "CONTEXT"
+                    and cls in [_cl.CommandQueue, _cl.MemoryObjectHolder]):
+                getinfo = make_cached_context_getinfo(
+                        info_method, getattr(info_class, info_name))
+            else:
+                getinfo = make_getinfo(
+                        info_method, getattr(info_class, info_name))
+
+            setattr(cls, info_name.lower(), getinfo)
 
     # }}}
 
@@ -528,7 +549,22 @@ def _add_functionality():
 
         self._arg_type_chars = arg_type_chars
 
+        # The compiled argument setter handles all types but a few
+        # rare ones, which need the argument-by-argument path below.
+        self._fast_set_args = self._set_arg_type_chars(arg_type_chars)
+
     def kernel_set_args(self, *args):
+        if self.__dict__.get("_fast_set_args", True):
+            try:
+                # One call to set all arguments, which also skips those
+                # whose values did not change since they were last set.
+                self._set_args(args)
+                return
+            except (LogicError, TypeError, OverflowError):
+                # Invalid arguments: fall through to the slow path, which
+                # reports the error with the offending argument.
+                pass
+
         assert len(args) == self.num_args, (
                 "length of argument list (%d) and "
                 "CL-generated number of arguments (%d) do not agree"
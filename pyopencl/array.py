@@ -30,6 +30,7 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 
 
+import threading
 import numpy as np
 import pyopencl.elementwise as elementwise
 import pyopencl as cl
@@ -112,16 +113,70 @@ _create_vector_types()
 
 # {{{ helper functionality
 
+# {{{ launch geometry caching
+
+# Launch geometry is computed for every kernel invocation. The queue,
+# device and kernel info queries it needs are cached here, so that
+# launches do not call into the driver for them. The geometry itself
+# is cheap to compute and depends on the exact size, so it is not cached.
+
+def _get_queue_device(queue):
+    try:
+        return queue._pyopencl_device
+    except AttributeError:
+        dev = queue._pyopencl_device = queue.device
+        return dev
+
+_device_launch_limits = {}
+_DEVICE_LAUNCH_LIMITS_MAX_SIZE = 64
+
+def _get_device_launch_limits(dev):
+    try:
+        return _device_launch_limits[dev]
+    except KeyError:
+        result = (dev.max_work_group_size, dev.max_compute_units)
+
+        if len(_device_launch_limits) >= _DEVICE_LAUNCH_LIMITS_MAX_SIZE:
+            _device_launch_limits.clear()
+        _device_launch_limits[dev] = result
+
+        return result
+
+def _get_kernel_work_group_size(kernel, queue):
+    """Return the maximum work group size of *kernel* on the device
+    of *queue*, querying it only once per kernel and device.
+    """
+    dev = _get_queue_device(queue)
+
+    try:
+        wg_sizes = kernel._pyopencl_work_group_sizes
+    except AttributeError:
+        wg_sizes = kernel._pyopencl_work_group_sizes = {}
+
+    try:
+        return wg_sizes[dev]
+    except KeyError:
+        result = wg_sizes[dev] = kernel.get_work_group_info(
+                cl.kernel_work_group_info.WORK_GROUP_SIZE, dev)
+        return result
+
+# }}}
+
 def splay(queue, n, kernel_specific_max_wg_size=None):
-    dev = queue.device
-    max_work_items = _builtin_min(128, dev.max_work_group_size)
+    return _splay(_get_device_launch_limits(_get_queue_device(queue)),
+            n, kernel_specific_max_wg_size)
+
+def _splay(launch_limits, n, kernel_specific_max_wg_size):
+    dev_max_work_group_size, dev_max_compute_units = launch_limits
+
+    max_work_items = _builtin_min(128, dev_max_work_group_size)
 
     if kernel_specific_max_wg_size is not None:
         from __builtin__ import min
         max_work_items = min(max_work_items, kernel_specific_max_wg_size)
 
     min_work_items = _builtin_min(32, max_work_items)
-    max_groups = dev.max_compute_units * 4 * 8
+    max_groups = dev_max_compute_units * 4 * 8
     # 4 to overfill the device
     # 8 is an Nvidia constant--that's how many
     # groups fit onto one compute device
@@ -151,34 +206,62 @@ def elwise_kernel_runner(kernel_getter):
     and return a function that invokes that kernel.
 
     Assumes that the zeroth entry in *args* is an :class:`Array`.
+
+    The function returns the :class:`pyopencl.Event` of the launch, or
+    *None* if the launch was added to a :class:`KernelLaunchBatch`.
     """
     #(Note that the 'return a function' bit is done by @decorator.)
 
     def kernel_runner(*args, **kwargs):
         repr_ary = args[0]
-        queue = kwargs.pop("queue", None) or repr_ary.queue
+        batch = kwargs.pop("batch", None)
+        queue = (kwargs.pop("queue", None)
+                or (batch is not None and batch.queue)
+                or repr_ary.queue)
+        wait_for = kwargs.pop("wait_for", None)
 
-        knl = kernel_getter(*args)
+        if batch is None:
+            batch = _get_active_launch_batch(queue)
+        elif batch.queue != queue:
+            raise ValueError("batch does not enqueue to the given queue")
 
-        gs, ls = repr_ary.get_sizes(queue,
-                knl.get_work_group_info(
-                    cl.kernel_work_group_info.WORK_GROUP_SIZE,
-                    queue.device))
+        knl = kernel_getter(*args)
 
         assert isinstance(repr_ary, Array)
 
+        from pyopencl.elementwise import _get_vectorized_kernel
+        vectorized = _get_vectorized_kernel(knl,
+                [arg for arg in args if isinstance(arg, Array)],
+                repr_ary.size)
+        if vectorized is not None:
+            knl, vector_width = vectorized
+            gs, ls = splay(queue, repr_ary.size // vector_width,
+                    _get_kernel_work_group_size(knl, queue))
+        else:
+            gs, ls = repr_ary.get_sizes(queue,
+                    _get_kernel_work_group_size(knl, queue))
+
         actual_args = []
         for arg in args:
             if isinstance(arg, Array):
                 if not arg.flags.forc:
                     raise RuntimeError("only contiguous arrays may "
                             "be used as arguments to this operation")
-                actual_args.append(arg.data)
+                actual_args.append(arg.base_data)
+                actual_args.append(arg.offset)
             else:
                 actual_args.append(arg)
         actual_args.append(repr_ary.size)
 
-        return knl(queue, gs, ls, *actual_args)
+        if batch is not None:
+            batch.add(knl, gs, ls, actual_args, wait_for=wait_for,
+                    arrays=args)
+            return None
+
+        evt = knl(queue, gs, ls, *actual_args,
+                **dict(wait_for=_get_array_events(args, wait_for)))
+        _add_array_event(args, evt)
+        return evt
 
     try:
        from functools import update_wrapper
@@ -190,6 +273,235 @@ def elwise_kernel_runner(kernel_getter):
 
 
 
+def _get_array_events(args, wait_for=None, batch=None):
+    """Return *wait_for* extended by the :attr:`Array.events` of
+    all :class:`Array` instances among *args*.
+
+    Launches on these arrays that are still pending in a
+    :class:`KernelLaunchBatch` other than *batch* are enqueued first.
+    """
+    if _pending_launch_batches:
+        _flush_pending_launches(args, exclude=batch)
+
+    result = []
+    if wait_for is not None:
+        result.extend(wait_for)
+
+    seen = set()
+    for arg in args:
+        if isinstance(arg, Array) and id(arg.events) not in seen:
+            seen.add(id(arg.events))
+            result.extend(arg.events)
+
+    return result or None
+
+
+def _get_kernel_args(arrays):
+    """Return the buffer and offset arguments for passing *arrays* to
+    kernels whose vector arguments are declared *with_offset*.
+    """
+    result = []
+    for ary in arrays:
+        result.append(ary.base_data)
+        result.append(ary.offset)
+    return result
+
+
+def _add_array_event(args, evt):
+    """Record *evt* with all :class:`Array` instances among *args*."""
+    seen = set()
+    for arg in args:
+        if isinstance(arg, Array) and id(arg.events) not in seen:
+            seen.add(id(arg.events))
+            arg.add_event(evt)
+
+# {{{ batched kernel launches
+
+# maps id(ary.events) to the KernelLaunchBatch holding launches on ary
+# that have not been enqueued yet
+_pending_launch_batches = {}
+
+_launch_batch_state = threading.local()
+
+
+def _get_active_launch_batch(queue):
+    """Return the innermost :class:`KernelLaunchBatch` activated by a
+    *with* statement in the current thread, if it enqueues to *queue*.
+    """
+    stack = getattr(_launch_batch_state, "stack", None)
+    if stack and stack[-1].queue == queue:
+        return stack[-1]
+    else:
+        return None
+
+
+def _flush_pending_launches(args, exclude=None):
+    for arg in args:
+        if isinstance(arg, Array):
+            batch = _pending_launch_batches.get(id(arg.events))
+            if batch is not None and batch is not exclude:
+                batch.flush()
+
+
+class KernelLaunchBatch(object):
+    """Collects kernel launches and enqueues them on *queue* with a single
+    call to :func:`pyopencl.enqueue_nd_range_kernels`, saving the Python
+    overhead of one enqueue call per launch.
+
+    Launches are added by :meth:`add`, by passing *batch=* to
+    :class:`pyopencl.elementwise.ElementwiseKernel` and the functions
+    in this module that accept it, or implicitly by using the batch
+    in a *with* statement, which collects all elementwise launches
+    on *queue* in the current thread (including those of the arithmetic
+    operators of :class:`Array`) and enqueues them upon exit::
+
+        with KernelLaunchBatch(queue):
+            c = 2*a + b
+            d = c*c
+
+    Launches are enqueued in the order they were added, so *queue* must
+    be an in-order queue. Operations that consult :attr:`Array.events`
+    (transfers, reductions, scans, :meth:`Array.finish`, ...) enqueue the
+    pending launches on the arrays involved first. Buffers accessed in
+    any other way require a call to :meth:`flush` first.
+
+    Since batched launches are not enqueued right away, calls that
+    otherwise return the :class:`pyopencl.Event` of a launch (such as
+    those of :class:`pyopencl.elementwise.ElementwiseKernel`) return
+    *None* instead. The events are returned by :meth:`flush` and recorded
+    in :attr:`Array.events` of the arrays involved.
+
+    .. versionadded:: 2013.1
+
+    .. attribute:: queue
+
+    .. method:: __len__()
+
+        Return the number of launches that have not been enqueued yet.
+    """
+
+    def __init__(self, queue):
+        if (queue.properties
+                & cl.command_queue_properties.OUT_OF_ORDER_EXEC_MODE_ENABLE):
+            raise ValueError("KernelLaunchBatch requires an in-order queue")
+
+        self.queue = queue
+        self._launches = []
+        self._launch_arrays = []
+
+    def __len__(self):
+        return len(self._launches)
+
+    def add(self, kernel, global_size, local_size, args=None,
+            wait_for=None, arrays=()):
+        """Add a launch of *kernel*. If *args* is not *None*, it is a
+        sequence of kernel arguments that is set right before the launch,
+        in the same way as by :meth:`pyopencl.Kernel.set_args`.
+
+        *arrays* is a sequence of the :class:`Array` instances the launch
+        accesses. The launch waits for their :attr:`Array.events` in
+        addition to *wait_for* and is recorded with them once enqueued.
+        """
+        arrays = [ary for ary in arrays if isinstance(ary, Array)]
+        wait_for = _get_array_events(arrays, wait_for, batch=self)
+
+        if args is not None:
+            args = tuple(args)
+            if not kernel.__dict__.get("_fast_set_args", True):
+                # set_args in C++ only converts the types it supports
+                # by itself, so pack all others here.
+                from pyopencl._pvt_struct import pack
+                args = tuple(
+                        pack(arg_type_char, arg)
+                        if arg_type_char and arg_type_char != "V"
+                        else arg
+                        for arg, arg_type_char in zip(
+                            args, kernel._arg_type_chars))
+
+        self._launches.append((kernel, global_size, local_size, args, wait_for))
+        self._launch_arrays.append(arrays)
+
+        for ary in arrays:
+            _pending_launch_batches[id(ary.events)] = self
+
+    def flush(self):
+        """Enqueue all pending launches and return a list of their
+        :class:`pyopencl.Event` instances.
+
+        If a launch fails, the launches before it are still recorded with
+        their arrays, and their events are available as the attribute
+        *events* of the exception. The launches after it are discarded.
+        """
+        if not self._launches:
+            return []
+
+        launches = self._launches
+        launch_arrays = self._launch_arrays
+        self._launches = []
+        self._launch_arrays = []
+
+        for arrays in launch_arrays:
+            for ary in arrays:
+                if _pending_launch_batches.get(id(ary.events)) is self:
+                    del _pending_launch_batches[id(ary.events)]
+
+        events = []
+        try:
+            cl.enqueue_nd_range_kernels(self.queue, launches, events)
+        except Exception, e:
+            e.events = events
+            raise
+        finally:
+            # also after a failure, so that later operations wait for
+            # the launches that did get enqueued
+            for arrays, evt in zip(launch_arrays, events):
+                _add_array_event(arrays, evt)
+
+        return events
+
+    def __enter__(self):
+        try:
+            stack = _launch_batch_state.stack
+        except AttributeError:
+            stack = _launch_batch_state.stack = []
+
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        stack = _launch_batch_state.stack
+        assert stack[-1] is self
+        stack.pop()
+
+        self.flush()
+
+# }}}
+
+
+
+
+class _DeferredArrayBase(object):
+    """Base class of :class:`pyopencl.deferred.DeferredArray`. Binary
+    operators of :class:`Array` yield to operands of this type, so that
+    mixed expressions stay deferred.
+    """
+
+
+
+
+class ArrayHasOffsetError(ValueError):
+    """Raised by :attr:`Array.data` if the array does not start at the
+    beginning of its buffer.
+    """
+
+    def __init__(self, val="The operation you are attempting does not yet "
+                "support arrays that start at an offset from the beginning "
+                "of their buffer."):
+        ValueError.__init__(self, val)
+
+
+
+
 class DefaultAllocator(cl.tools.DeferredAllocator):
     def __init__(self, *args, **kwargs):
         from warnings import warn
@@ -212,7 +524,7 @@ class Array(object):
     """
 
     def __init__(self, cqa, shape, dtype, order="C", allocator=None,
-            data=None, queue=None, strides=None):
+            data=None, offset=0, queue=None, strides=None, events=None):
         # {{{ backward compatibility
 
         from warnings import warn
@@ -326,15 +638,29 @@ class Array(object):
                 if queue is not None:
                     context = queue.context
 
-                self.data = cl.Buffer(context, cl.mem_flags.READ_WRITE, alloc_nbytes)
+                self.base_data = cl.Buffer(
+                        context, cl.mem_flags.READ_WRITE, alloc_nbytes)
             else:
-                self.data = self.allocator(alloc_nbytes)
+                self.base_data = self.allocator(alloc_nbytes)
         else:
-            self.data = data
+            self.base_data = data
+
+        self.offset = offset
+
+        if events is None:
+            events = []
+        self.events = events
 
     @property
     def context(self):
-        return self.data.context
+        return self.base_data.context
+
+    @property
+    def data(self):
+        if self.offset:
+            raise ArrayHasOffsetError()
+        else:
+            return self.base_data
 
     @property
     @memoize_method
@@ -347,7 +673,11 @@ class Array(object):
         warn("Array.mem_size is deprecated. Use Array.size",
                 DeprecationWarning, stacklevel=2)
 
-    def _new_with_changes(self, data, shape=None, dtype=None, strides=None, queue=None):
+    def _new_with_changes(self, data, offset, shape=None, dtype=None,
+            strides=None, queue=None):
+        """
+        :arg data: *None* means allocate a new array.
+        """
         if shape is None:
             shape = self.shape
         if dtype is None:
@@ -357,14 +687,45 @@ class Array(object):
         if queue is None:
             queue = self.queue
 
+        # Views of the same buffer share their list of events.
+        if data is not None and data is self.base_data:
+            events = self.events
+        else:
+            events = None
+
         if queue is not None:
             return Array(queue, shape, dtype,
-                    allocator=self.allocator, strides=strides, data=data)
+                    allocator=self.allocator, strides=strides, data=data,
+                    offset=offset, events=events)
         elif self.allocator is not None:
             return Array(self.allocator, shape, dtype, queue=queue,
-                    strides=strides, data=data)
+                    strides=strides, data=data, offset=offset, events=events)
         else:
-            return Array(self.context, shape, dtype, strides=strides, data=data)
+            return Array(self.context, shape, dtype, strides=strides,
+                    data=data, offset=offset, events=events)
+
+    def add_event(self, evt):
+        """Add *evt* to :attr:`events`. If :attr:`events` is too long, this
+        method may implicitly wait for a subset of :attr:`events` and clear
+        them from the list.
+        """
+        n_wait = 4
+
+        self.events.append(evt)
+
+        if len(self.events) > 3*n_wait:
+            wait_events = self.events[:n_wait]
+            cl.wait_for_events(wait_events)
+            del self.events[:n_wait]
+
+    def finish(self):
+        """Wait for the entire contents of :attr:`events`, clear it."""
+        if _pending_launch_batches:
+            _flush_pending_launches([self])
+
+        if self.events:
+            cl.wait_for_events(self.events)
+            del self.events[:]
 
     #@memoize_method FIXME: reenable
     def get_sizes(self, queue, kernel_specific_max_wg_size=None):
@@ -373,10 +734,20 @@ class Array(object):
         return splay(queue, self.size,
                 kernel_specific_max_wg_size=kernel_specific_max_wg_size)
 
-    def set(self, ary, queue=None, async=False):
+    def set(self, ary, queue=None, async=False, wait_for=None,
+            staging_pool=None):
         assert ary.size == self.size
         assert ary.dtype == self.dtype
 
+        if not self.flags.forc:
+            # transfer into a contiguous array, then scatter on the device
+            contig = self._new_like_me(queue=queue)
+            contig.set(ary, queue=queue, async=async, wait_for=wait_for,
+                    staging_pool=staging_pool)
+            elementwise.get_strided_copy_kernel(self.context, self.dtype)(
+                    self, contig, queue=queue or self.queue)
+            return
+
         if not ary.flags.forc:
             raise RuntimeError("cannot set from non-contiguous array")
 
@@ -388,13 +759,42 @@ class Array(object):
                     "This will cease to work in 2013.x.",
                     stacklevel=2)
 
+        if staging_pool is not None and self.size:
+            if ary.flags.f_contiguous and not ary.flags.c_contiguous:
+                order = "F"
+            else:
+                order = "C"
+
+            # After this copy, the transfer no longer refers to *ary*,
+            # which the caller may thus modify even if async.
+            staged_ary = staging_pool.empty(ary.shape, ary.dtype, order=order)
+            staged_ary[...] = ary
+            ary = staged_ary
+
         if self.size:
-            cl.enqueue_copy(queue or self.queue, self.data, ary,
-                    is_blocking=not async)
+            evt = cl.enqueue_copy(queue or self.queue, self.base_data, ary,
+                    device_offset=self.offset,
+                    is_blocking=not async,
+                    wait_for=_get_array_events([self], wait_for))
+            if async:
+                self.add_event(evt)
+            else:
+                # the blocking copy waited for all pending events
+                del self.events[:]
+
+    def get(self, queue=None, ary=None, async=False, wait_for=None,
+            staging_pool=None):
+        if not self.flags.forc:
+            # gather the elements into a contiguous array on the device
+            return self.copy(queue=queue, wait_for=wait_for).get(
+                    queue=queue, ary=ary, async=async,
+                    staging_pool=staging_pool)
 
-    def get(self, queue=None, ary=None, async=False):
         if ary is None:
-            ary = np.empty(self.shape, self.dtype)
+            if staging_pool is not None:
+                ary = staging_pool.empty(self.shape, self.dtype)
+            else:
+                ary = np.empty(self.shape, self.dtype)
 
             ary = _as_strided(ary, strides=self.strides)
         else:
@@ -403,18 +803,30 @@ class Array(object):
             if ary.dtype != self.dtype:
                 raise TypeError("'ary' has non-matching size")
 
-        assert self.flags.forc, "Array in get() must be contiguous"
-
         if self.size:
-            cl.enqueue_copy(queue or self.queue, ary, self.data,
-                    is_blocking=not async)
+            evt = cl.enqueue_copy(queue or self.queue, ary, self.base_data,
+                    device_offset=self.offset,
+                    is_blocking=not async,
+                    wait_for=_get_array_events([self], wait_for))
+            if async:
+                self.add_event(evt)
+            else:
+                # the blocking copy waited for all pending events
+                del self.events[:]
 
         return ary
 
-    def copy(self, queue=None):
+    def copy(self, queue=None, wait_for=None):
         queue = queue or self.queue
         result = self._new_like_me()
-        cl.enqueue_copy(queue, result.data, self.data, byte_count=self.nbytes)
+        if not self.flags.forc:
+            elementwise.get_strided_copy_kernel(self.context, self.dtype)(
+                    result, self, queue=queue, wait_for=wait_for)
+        elif self.nbytes:
+            evt = cl.enqueue_copy(queue, result.data, self.base_data,
+                    src_offset=self.offset, byte_count=self.nbytes,
+                    wait_for=_get_array_events([self], wait_for))
+            _add_array_event([self, result], evt)
         return result
 
     def __str__(self):
@@ -552,9 +964,9 @@ class Array(object):
         strides = None
         if dtype is None:
             dtype = self.dtype
-        else:
-            if dtype == self.dtype:
-                strides = self.strides
+
+        if dtype == self.dtype and self.flags.forc:
+            strides = self.strides
 
         queue = queue or self.queue
         if queue is not None:
@@ -579,6 +991,9 @@ class Array(object):
     def __add__(self, other):
         """Add an array with an array or an array with a scalar."""
 
+        if isinstance(other, _DeferredArrayBase):
+            return NotImplemented
+
         if isinstance(other, Array):
             # add another vector
             result = self._new_like_me(_get_common_dtype(self, other, self.queue))
@@ -601,6 +1016,9 @@ class Array(object):
     def __sub__(self, other):
         """Substract an array from an array or a scalar from an array."""
 
+        if isinstance(other, _DeferredArrayBase):
+            return NotImplemented
+
         if isinstance(other, Array):
             result = self._new_like_me(_get_common_dtype(self, other, self.queue))
             self._axpbyz(result,
@@ -628,6 +1046,9 @@ class Array(object):
         return result
 
     def __iadd__(self, other):
+        if isinstance(other, _DeferredArrayBase):
+            other = other.force()
+
         if isinstance(other, Array):
             self._axpbyz(self,
                     self.dtype.type(1), self,
@@ -638,6 +1059,9 @@ class Array(object):
             return self
 
     def __isub__(self, other):
+        if isinstance(other, _DeferredArrayBase):
+            other = other.force()
+
         if isinstance(other, Array):
             self._axpbyz(self, self.dtype.type(1), self, other.dtype.type(-1), other)
             return self
@@ -651,6 +1075,9 @@ class Array(object):
         return result
 
     def __mul__(self, other):
+        if isinstance(other, _DeferredArrayBase):
+            return NotImplemented
+
         if isinstance(other, Array):
             result = self._new_like_me(_get_common_dtype(self, other, self.queue))
             self._elwise_multiply(result, self, other)
@@ -668,6 +1095,9 @@ class Array(object):
         return result
 
     def __imul__(self, other):
+        if isinstance(other, _DeferredArrayBase):
+            other = other.force()
+
         if isinstance(other, Array):
             self._elwise_multiply(self, self, other)
         else:
@@ -681,6 +1111,9 @@ class Array(object):
 
            x = self / n
         """
+        if isinstance(other, _DeferredArrayBase):
+            return NotImplemented
+
         if isinstance(other, Array):
             result = self._new_like_me(_get_common_dtype(self, other, self.queue))
             self._div(result, self, other)
@@ -717,9 +1150,9 @@ class Array(object):
 
     __rtruediv__ = __rdiv__
 
-    def fill(self, value, queue=None):
+    def fill(self, value, queue=None, wait_for=None):
         """fills the array with the specified value"""
-        self._fill(self, value, queue=queue)
+        self._fill(self, value, queue=queue, wait_for=wait_for)
         return self
 
     def __len__(self):
@@ -743,6 +1176,9 @@ class Array(object):
         :class:`Array`.
         """
 
+        if isinstance(other, _DeferredArrayBase):
+            return NotImplemented
+
         if isinstance(other, Array):
             assert self.shape == other.shape
 
@@ -837,7 +1273,15 @@ class Array(object):
         if size != self.size:
             raise ValueError("total size of new array must be unchanged")
 
-        return self._new_with_changes(data=self.data, shape=shape)
+        if self.flags.c_contiguous:
+            strides = _c_contiguous_strides(self.dtype.itemsize, shape)
+        elif self.flags.f_contiguous:
+            strides = _f_contiguous_strides(self.dtype.itemsize, shape)
+        else:
+            raise NotImplementedError("cannot reshape non-contiguous array")
+
+        return self._new_with_changes(self.base_data, self.offset,
+                shape=shape, strides=strides)
 
     def ravel(self):
         return self.reshape(self.size)
@@ -857,8 +1301,89 @@ class Array(object):
                 s * itemsize // old_itemsize
                 for s in self.strides)
 
-        return self._new_with_changes(data=self.data, shape=shape, dtype=dtype,
-                strides=strides)
+        return self._new_with_changes(self.base_data, self.offset,
+                shape=shape, dtype=dtype, strides=strides)
+
+    def __getitem__(self, index):
+        """Return a view of part of this array, sharing its buffer.
+        *index* may be made up of integers, slices with positive steps
+        and at most one ellipsis.
+        """
+        if not isinstance(index, tuple):
+            index = (index,)
+
+        new_shape = []
+        new_offset = self.offset
+        new_strides = []
+
+        seen_ellipsis = False
+
+        index_axis = 0
+        array_axis = 0
+        while index_axis < len(index):
+            index_entry = index[index_axis]
+
+            if array_axis >= len(self.shape) and index_entry is not Ellipsis:
+                raise IndexError("too many axes in index")
+
+            if isinstance(index_entry, slice):
+                start, stop, idx_stride = index_entry.indices(
+                        self.shape[array_axis])
+                if idx_stride < 0:
+                    raise NotImplementedError(
+                            "slices with negative steps are not supported")
+
+                array_stride = self.strides[array_axis]
+
+                new_shape.append(len(xrange(start, stop, idx_stride)))
+                new_strides.append(idx_stride*array_stride)
+                new_offset += array_stride*start
+
+                index_axis += 1
+                array_axis += 1
+
+            elif isinstance(index_entry, (int, long, np.integer)):
+                array_shape = self.shape[array_axis]
+                if index_entry < 0:
+                    index_entry += array_shape
+
+                if not (0 <= index_entry < array_shape):
+                    raise IndexError(
+                            "subindex in axis %d out of range" % index_axis)
+
+                new_offset += self.strides[array_axis]*index_entry
+
+                index_axis += 1
+                array_axis += 1
+
+            elif index_entry is Ellipsis:
+                if seen_ellipsis:
+                    raise IndexError(
+                            "more than one ellipsis not allowed in index")
+                seen_ellipsis = True
+
+                index_axis += 1
+
+                remaining_index_count = len(index) - index_axis
+                new_array_axis = len(self.shape) - remaining_index_count
+                if new_array_axis < array_axis:
+                    raise IndexError("invalid use of ellipsis in index")
+                while array_axis < new_array_axis:
+                    new_shape.append(self.shape[array_axis])
+                    new_strides.append(self.strides[array_axis])
+                    array_axis += 1
+
+            else:
+                raise IndexError("invalid subindex in axis %d" % index_axis)
+
+        while array_axis < len(self.shape):
+            new_shape.append(self.shape[array_axis])
+            new_strides.append(self.strides[array_axis])
+
+            array_axis += 1
+
+        return self._new_with_changes(self.base_data, new_offset,
+                shape=tuple(new_shape), strides=tuple(new_strides))
 
     # }}
 
@@ -875,13 +1400,14 @@ def as_strided(ary, shape=None, strides=None):
     strides = strides or ary.strides
 
     return Array(ary.queue, shape, ary.dtype, allocator=ary.allocator,
-            data=ary.data, strides=strides)
+            data=ary.base_data, offset=ary.offset, strides=strides,
+            events=ary.events)
 
 # }}}
 
 # {{{ creation helpers
 
-def to_device(queue, ary, allocator=None, async=False):
+def to_device(queue, ary, allocator=None, async=False, staging_pool=None):
     """Converts a numpy array to a :class:`Array`."""
 
     if ary.dtype == object:
@@ -889,7 +1415,7 @@ def to_device(queue, ary, allocator=None, async=False):
 
     result = Array(queue, ary.shape, ary.dtype,
                     allocator=allocator, strides=ary.strides)
-    result.set(ary, async=async)
+    result.set(ary, async=async, staging_pool=staging_pool)
     return result
 
 
@@ -907,7 +1433,7 @@ def zeros(queue, shape, dtype, order="C", allocator=None):
     return result
 
 def empty_like(ary):
-    return ary._new_with_changes(data=None)
+    return ary._new_with_changes(data=None, offset=0)
 
 def zeros_like(ary):
     result = empty_like(ary)
@@ -1065,15 +1591,17 @@ def multi_take(arrays, indices, out=None, queue=None):
             knl = make_func_for_chunk_size(vec_count-start_i)
 
         gs, ls = indices.get_sizes(queue,
-                knl.get_work_group_info(
-                    cl.kernel_work_group_info.WORK_GROUP_SIZE,
-                    queue.device))
-
-        knl(queue, gs, ls,
-                indices.data,
-                *([o.data for o in out[chunk_slice]]
-                    + [i.data for i in arrays[chunk_slice]]
-                    + [indices.size]))
+                _get_kernel_work_group_size(knl, queue))
+
+        chunk_arrays = ([indices]
+                + list(out[chunk_slice]) + list(arrays[chunk_slice]))
+        evt = knl(queue, gs, ls,
+                *(_get_kernel_args(out[chunk_slice])
+                    + _get_kernel_args(arrays[chunk_slice])
+                    + _get_kernel_args([indices])
+                    + [indices.size]),
+                **dict(wait_for=_get_array_events(chunk_arrays)))
+        _add_array_event(chunk_arrays, evt)
 
     return out
 
@@ -1137,16 +1665,18 @@ def multi_take_put(arrays, dest_indices, src_indices, dest_shape=None,
             knl = make_func_for_chunk_size(vec_count-start_i)
 
         gs, ls = src_indices.get_sizes(queue,
-                knl.get_work_group_info(
-                    cl.kernel_work_group_info.WORK_GROUP_SIZE,
-                    queue.device))
-
-        knl(queue, gs, ls,
-                *([o.data for o in out[chunk_slice]]
-                    + [dest_indices.data, src_indices.data]
-                    + [i.data for i in arrays[chunk_slice]]
+                _get_kernel_work_group_size(knl, queue))
+
+        chunk_arrays = ([dest_indices, src_indices]
+                + list(out[chunk_slice]) + list(arrays[chunk_slice]))
+        evt = knl(queue, gs, ls,
+                *(_get_kernel_args(out[chunk_slice])
+                    + _get_kernel_args([dest_indices, src_indices])
+                    + _get_kernel_args(arrays[chunk_slice])
                     + src_offsets_list[chunk_slice]
-                    + [src_indices.size]))
+                    + [src_indices.size]),
+                **dict(wait_for=_get_array_events(chunk_arrays)))
+        _add_array_event(chunk_arrays, evt)
 
     return out
 
@@ -1194,15 +1724,17 @@ def multi_put(arrays, dest_indices, dest_shape=None, out=None, queue=None):
             knl = make_func_for_chunk_size(vec_count-start_i)
 
         gs, ls = dest_indices.get_sizes(queue,
-                knl.get_work_group_info(
-                    cl.kernel_work_group_info.WORK_GROUP_SIZE,
-                    queue.device))
-
-        knl(queue, gs, ls,
-                *([o.data for o in out[chunk_slice]]
-                    + [dest_indices.data]
-                    + [i.data for i in arrays[chunk_slice]]
-                    + [dest_indices.size]))
+                _get_kernel_work_group_size(knl, queue))
+
+        chunk_arrays = ([dest_indices]
+                + list(out[chunk_slice]) + list(arrays[chunk_slice]))
+        evt = knl(queue, gs, ls,
+                *(_get_kernel_args(out[chunk_slice])
+                    + _get_kernel_args([dest_indices])
+                    + _get_kernel_args(arrays[chunk_slice])
+                    + [dest_indices.size]),
+                **dict(wait_for=_get_array_events(chunk_arrays)))
+        _add_array_event(chunk_arrays, evt)
 
     return out
 
@@ -1256,15 +1788,15 @@ def minimum(a, b, out=None, queue=None):
 _builtin_min = min
 _builtin_max = max
 
-def sum(a, dtype=None, queue=None):
+def sum(a, dtype=None, queue=None, axis=None):
     from pyopencl.reduction import get_sum_kernel
     krnl = get_sum_kernel(a.context, dtype, a.dtype)
-    return krnl(a, queue=queue)
+    return krnl(a, queue=queue, axis=axis)
 
-def dot(a, b, dtype=None, queue=None):
+def dot(a, b, dtype=None, queue=None, axis=None):
     from pyopencl.reduction import get_dot_kernel
     krnl = get_dot_kernel(a.context, dtype, a.dtype, b.dtype)
-    return krnl(a, b, queue=queue)
+    return krnl(a, b, queue=queue, axis=axis)
 
 def subset_dot(subset, a, b, dtype=None, queue=None):
     from pyopencl.reduction import get_subset_dot_kernel
@@ -1272,10 +1804,10 @@ def subset_dot(subset, a, b, dtype=None, queue=None):
     return krnl(subset, a, b, queue=queue)
 
 def _make_minmax_kernel(what):
-    def f(a, queue=None):
+    def f(a, queue=None, axis=None):
         from pyopencl.reduction import get_minmax_kernel
         krnl = get_minmax_kernel(a.context, what, a.dtype)
-        return krnl(a,  queue=queue)
+        return krnl(a,  queue=queue, axis=axis)
 
     return f
 
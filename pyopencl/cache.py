@@ -41,13 +41,6 @@ except ImportError:
 
 
 
-def _erase_dir(dir):
-    from os import listdir, unlink, rmdir
-    from os.path import join
-    for name in listdir(dir):
-        unlink(join(dir, name))
-    rmdir(dir)
-
 def update_checksum(checksum, obj):
     if isinstance(obj, unicode):
         checksum.update(obj.encode("utf8"))
@@ -58,86 +51,249 @@ def update_checksum(checksum, obj):
 
 
 
-# {{{ cleanup
+# {{{ atomic entry handling
 
-class CleanupBase(object):
-    pass
+# Cache entries are single files that are written to a temporary file in
+# the cache directory and then renamed into place. Since the rename is
+# atomic, readers see either no entry or a complete one and never need a
+# lock. Concurrent writers of the same entry simply race to the rename,
+# and each of them writes equivalent contents.
 
-class CleanupManager(CleanupBase):
-    def __init__(self):
-        self.cleanups = []
+def _write_atomically(path, data):
+    from tempfile import mkstemp
+    from os.path import dirname, exists
 
-    def register(self, c):
-        self.cleanups.insert(0, c)
+    fd, tmp_path = mkstemp(dir=dirname(path), prefix=".tmp-")
+    try:
+        outf = os.fdopen(fd, "wb")
+        try:
+            outf.write(data)
+        finally:
+            outf.close()
 
-    def clean_up(self):
-        for c in self.cleanups:
-            c.clean_up()
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows refuses to rename onto an existing file. If that
+            # file is there, another writer won the race.
+            if not exists(path):
+                raise
+            os.unlink(tmp_path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
-    def error_clean_up(self):
-        for c in self.cleanups:
-            c.error_clean_up()
 
-class CacheLockManager(CleanupBase):
-    def __init__(self, cleanup_m, cache_dir):
-        if cache_dir is not None:
-            self.lock_file = os.path.join(cache_dir, "lock")
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        # another process got there first
+        pass
 
-            attempts = 0
-            while True:
-                try:
-                    self.fd = os.open(self.lock_file,
-                            os.O_CREAT | os.O_WRONLY | os.O_EXCL)
-                    break
-                except OSError:
-                    pass
 
-                from time import sleep
-                sleep(1)
+def _remove_entry(cache_dir, cache_key):
+    from os.path import join
+    _unlink_quietly(join(cache_dir, cache_key))
+    _record_access(cache_dir, cache_key, -1)
 
-                attempts += 1
+# }}}
 
-                if attempts > 10:
-                    from warnings import warn
-                    warn("could not obtain cache lock--delete '%s' if necessary"
-                            % self.lock_file)
+# {{{ index and size bound
+
+# The index is an append-only log of lines "key size atime" in the cache
+# directory. Each lookup and each write appends one line, and the last
+# line for a key wins. A negative size records the removal of an entry.
+# Appends of a single short line are atomic, so no lock is needed. The
+# log is compacted whenever entries are evicted, and whenever another
+# INDEX_COMPACTION_INTERVAL bytes have been appended to it and it holds
+# mostly stale lines, so that cache hits alone cannot grow it without
+# bound. Appends racing with a compaction may be lost, which at worst
+# leaves an entry unknown to the index until the next
+# "python -m pyopencl.cache prune".
+
+INDEX_NAME = "index"
+INDEX_COMPACTION_INTERVAL = 1 << 18
+CACHE_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+DEFAULT_MAX_CACHE_SIZE = 1 << 30
+
+
+def get_max_cache_size():
+    """Return the size bound of the on-disk cache in bytes, or *None* for
+    no bound. It is read from :envvar:`PYOPENCL_CACHE_MAX_SIZE`, where
+    a value of 0 disables the bound, and otherwise defaults to
+    :data:`DEFAULT_MAX_CACHE_SIZE`.
+    """
+    max_size = os.environ.get("PYOPENCL_CACHE_MAX_SIZE")
+    if not max_size:
+        return DEFAULT_MAX_CACHE_SIZE
+
+    max_size = int(max_size)
+    if max_size == 0:
+        return None
+    return max_size
 
-            cleanup_m.register(self)
 
-    def clean_up(self):
-        import os
-        os.close(self.fd)
-        os.unlink(self.lock_file)
+def _record_access(cache_dir, cache_key, size):
+    from os.path import join
+    from time import time
 
-    def error_clean_up(self):
-        pass
+    line = ("%s %d %.3f\n" % (cache_key, size, time())).encode("ascii")
+    try:
+        fd = os.open(join(cache_dir, INDEX_NAME),
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+        try:
+            os.write(fd, line)
+            index_size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+    except OSError:
+        # The index only serves eviction, so a failure to update it
+        # must not fail the lookup.
+        return
 
-class ModuleCacheDirManager(CleanupBase):
-    def __init__(self, cleanup_m, path):
-        from os import mkdir
+    if (index_size // INDEX_COMPACTION_INTERVAL
+            != (index_size - len(line)) // INDEX_COMPACTION_INTERVAL):
+        _compact_index(cache_dir)
 
-        self.path = path
+
+def _index_needs_compaction(index, line_count):
+    return line_count > 2*len(index) + 100
+
+
+def _compact_index(cache_dir):
+    index, line_count = read_index(cache_dir)
+    if _index_needs_compaction(index, line_count):
         try:
-            mkdir(self.path)
-            cleanup_m.register(self)
-            self.existed = False
-        except OSError:
-            self.existed = True
+            _write_index(cache_dir, index)
+        except (IOError, OSError):
+            pass
 
-    def sub(self, n):
-        from os.path import join
-        return join(self.path, n)
 
-    def reset(self):
-        import os
-        _erase_dir(self.path)
-        os.mkdir(self.path)
+def read_index(cache_dir):
+    """Return a tuple *(index, line_count)*, where *index* maps each
+    cache key to a tuple *(size, atime)*.
+    """
+    from os.path import join
+
+    index = {}
+    line_count = 0
 
-    def clean_up(self):
-        pass
+    try:
+        inf = open(join(cache_dir, INDEX_NAME), "rb")
+    except IOError:
+        return index, line_count
+
+    try:
+        for line in inf:
+            line_count += 1
+
+            try:
+                line = line.decode("ascii")
+            except UnicodeDecodeError:
+                # torn write
+                continue
+
+            fields = line.split()
+            if len(fields) != 3 or not CACHE_KEY_RE.match(fields[0]):
+                # torn write
+                continue
+
+            try:
+                size = int(fields[1])
+                atime = float(fields[2])
+            except ValueError:
+                continue
+
+            if size < 0:
+                index.pop(fields[0], None)
+            else:
+                index[fields[0]] = (size, atime)
+    finally:
+        inf.close()
+
+    return index, line_count
+
+
+def _write_index(cache_dir, index):
+    from os.path import join
+    _write_atomically(join(cache_dir, INDEX_NAME), "".join(
+        "%s %d %.3f\n" % (key, size, atime)
+        for key, (size, atime) in index.iteritems()).encode("ascii"))
 
-    def error_clean_up(self):
-        _erase_dir(self.path)
+
+def evict(cache_dir, max_size, max_age=None, index=None):
+    """Remove the least recently used entries from the cache in
+    *cache_dir* until it holds at most *max_size* bytes, as well as
+    all entries not used for *max_age* seconds. Either bound may be
+    *None*. Return a tuple *(removed_count, removed_bytes)*.
+    """
+    from os.path import join
+
+    line_count = None
+    if index is None:
+        index, line_count = read_index(cache_dir)
+
+    total_size = sum(size for size, atime in index.itervalues())
+
+    if max_age is not None:
+        from time import time
+        min_atime = time() - max_age
+    else:
+        min_atime = None
+
+    removed_count = 0
+    removed_bytes = 0
+
+    by_atime = sorted(index.iteritems(), key=lambda item: item[1][1])
+    for key, (size, atime) in by_atime:
+        if ((max_size is None or total_size <= max_size)
+                and (min_atime is None or atime >= min_atime)):
+            break
+
+        _unlink_quietly(join(cache_dir, key))
+        del index[key]
+
+        total_size -= size
+        removed_count += 1
+        removed_bytes += size
+
+    if (removed_count or line_count is None
+            or _index_needs_compaction(index, line_count)):
+        _write_index(cache_dir, index)
+
+    return removed_count, removed_bytes
+
+
+def scan_entries(cache_dir):
+    """Return an index like :func:`read_index` built by scanning
+    *cache_dir*, using access times from the index where available.
+    """
+    from os.path import join
+
+    logged_index, _ = read_index(cache_dir)
+
+    index = {}
+    for name in os.listdir(cache_dir):
+        if not CACHE_KEY_RE.match(name):
+            continue
+
+        try:
+            stat_result = os.stat(join(cache_dir, name))
+        except OSError:
+            continue
+
+        atime = stat_result.st_mtime
+        if name in logged_index:
+            atime = max(atime, logged_index[name][1])
+
+        index[name] = (stat_result.st_size, atime)
+
+    return index
 
 # }}}
 
@@ -146,49 +302,80 @@ class ModuleCacheDirManager(CleanupBase):
 C_INCLUDE_RE = re.compile(r'^\s*\#\s*include\s+[<"](.+)[">]\s*$',
         re.MULTILINE)
 
+# Maps file names to tuples *(stat_key, (mtime, digest, includes))*.
+# Entries are revalidated against the file's modification time and size,
+# so that each header is only read, hashed and scanned once per process
+# as long as it does not change.
+_file_info_cache = {}
+
+def _get_file_info(fname):
+    """Return a tuple *(mtime, digest, includes)* for the file *fname*,
+    where *includes* lists the names it ``#include``\ s, or *None* if
+    the file cannot be read.
+    """
+    try:
+        stat_result = os.stat(fname)
+    except OSError:
+        return None
+
+    stat_key = (stat_result.st_mtime, stat_result.st_size)
+
+    try:
+        cached_stat_key, info = _file_info_cache[fname]
+    except KeyError:
+        pass
+    else:
+        if cached_stat_key == stat_key:
+            return info
+
+    try:
+        inf = open(fname, "rt")
+    except IOError:
+        return None
+
+    try:
+        contents = inf.read()
+    finally:
+        inf.close()
+
+    checksum = new_hash()
+    update_checksum(checksum, contents)
+
+    info = (stat_result.st_mtime, checksum.hexdigest(),
+            [match.group(1) for match in C_INCLUDE_RE.finditer(contents)])
+    _file_info_cache[fname] = (stat_key, info)
+    return info
+
 def get_dependencies(src, include_path):
+    if "include" not in src:
+        return []
+
     result = {}
 
     from os.path import realpath, join
 
-    def _inner(src):
-        for match in C_INCLUDE_RE.finditer(src):
-            included = match.group(1)
-
-            found = False
+    def _inner(includes):
+        for included in includes:
             for ipath in include_path:
                 included_file_name = realpath(join(ipath, included))
 
                 if included_file_name not in result:
-                    try:
-                        src_file = open(included_file_name, "rt")
-                    except IOError:
+                    file_info = _get_file_info(included_file_name)
+                    if file_info is None:
                         continue
 
-                    try:
-                        included_src = src_file.read()
-                    finally:
-                        src_file.close()
+                    mtime, digest, sub_includes = file_info
 
                     # prevent infinite recursion if some header file appears to include itself
                     result[included_file_name] = None
 
-                    checksum = new_hash()
-                    update_checksum(checksum, included_src)
-                    _inner(included_src)
+                    _inner(sub_includes)
 
-                    result[included_file_name] = (
-                            os.stat(included_file_name).st_mtime,
-                            checksum.hexdigest(),
-                            )
+                    result[included_file_name] = (mtime, digest)
 
-                    found = True
                     break # stop searching the include path
 
-            if not found:
-                pass
-
-    _inner(src)
+    _inner([match.group(1) for match in C_INCLUDE_RE.finditer(src)])
 
     result = list((name,) + vals for name, vals in result.iteritems())
     result.sort()
@@ -199,14 +386,12 @@ def get_dependencies(src, include_path):
 
 
 def get_file_md5sum(fname):
-    checksum = new_hash()
-    inf = open(fname)
-    try:
-        contents = inf.read()
-    finally:
-        inf.close()
-    update_checksum(checksum, contents)
-    return checksum.hexdigest()
+    file_info = _get_file_info(fname)
+    if file_info is None:
+        return None
+
+    mtime, digest, includes = file_info
+    return digest
 
 
 
@@ -227,12 +412,20 @@ def check_dependencies(deps):
 
 # {{{ key generation
 
+_device_cache_ids = {}
+
 def get_device_cache_id(device):
+    try:
+        return _device_cache_ids[device]
+    except KeyError:
+        pass
+
     from pyopencl.version import VERSION
     platform = device.platform
-    return (VERSION,
+    result = _device_cache_ids[device] = (VERSION,
             platform.vendor, platform.name, platform.version,
             device.vendor, device.name, device.version, device.driver_version)
+    return result
 
 
 
@@ -251,76 +444,192 @@ def get_cache_key(device, options, src):
 
 
 def retrieve_from_cache(cache_dir, cache_key):
-    class _InvalidInfoFile(RuntimeError):
-        pass
+    from os.path import join
+    entry_path = join(cache_dir, cache_key)
 
-    from os.path import join, isdir
-    module_cache_dir = join(cache_dir, cache_key)
-    if not isdir(module_cache_dir):
+    try:
+        entry_file = open(entry_path, "rb")
+    except IOError:
         return None
 
-    cleanup_m = CleanupManager()
     try:
+        entry_size = os.fstat(entry_file.fileno()).st_size
+
+        from cPickle import load
         try:
-            CacheLockManager(cleanup_m, cache_dir)
+            info = load(entry_file)
+            binary = info.binary
+        except Exception:
+            info = None
+    finally:
+        entry_file.close()
 
-            mod_cache_dir_m = ModuleCacheDirManager(cleanup_m, module_cache_dir)
-            info_path = mod_cache_dir_m.sub("info")
-            binary_path = mod_cache_dir_m.sub("binary")
+    if info is None:
+        _remove_entry(cache_dir, cache_key)
+        from warnings import warn
+        warn("PyOpenCL encountered an invalid cache entry for cache key %s"
+                % cache_key)
+        return None
 
-            # {{{ load info file
+    if check_dependencies(info.dependencies):
+        _record_access(cache_dir, cache_key, entry_size)
+        return binary, info.log
+    else:
+        _remove_entry(cache_dir, cache_key)
+        return None
 
-            try:
-                from cPickle import load
+# {{{ in-memory program cache
 
-                try:
-                    info_file = open(info_path, "rb")
-                except IOError:
-                    raise _InvalidInfoFile()
+class InMemoryProgramCache(object):
+    """An in-process cache of built programs that sits in front of the
+    on-disk binary cache, keyed on the context, the source, the build
+    options and the devices. A hit returns the previously built
+    :class:`pyopencl._cl._Program` without touching the file system.
 
-                try:
-                    try:
-                        info = load(info_file)
-                    except EOFError:
-                        raise _InvalidInfoFile()
-                finally:
-                    info_file.close()
-
-            except _InvalidInfoFile:
-                mod_cache_dir_m.reset()
-                from warnings import warn
-                warn("PyOpenCL encountered an invalid info file for cache key %s"
-                        % cache_key)
-                return None
+    Changes to included header files are not noticed for programs that
+    are already in this cache. Call :meth:`clear` after changing them.
+
+    Contexts are identified by the OpenCL object they wrap, so that all
+    wrappers of a context (such as :attr:`pyopencl.CommandQueue.context`)
+    share entries, and are held weakly. Entries for a context are dropped
+    at the next lookup or insertion after all wrappers of it that were
+    used with the cache have died.
+    """
+
+    def __init__(self, max_size=128):
+        import threading
+        self._lock = threading.Lock()
+
+        self._max_size = max_size
+        self._entries = {}
+        self._use_count = 0
+
+        # maps the obj_ptr of each context in the cache to a
+        # WeakValueDictionary of its wrappers that were used with it
+        self._context_wrappers = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _get_max_size(self):
+        return self._max_size
+
+    def _set_max_size(self, max_size):
+        self._lock.acquire()
+        try:
+            self._max_size = max_size
+            self._trim()
+        finally:
+            self._lock.release()
+
+    max_size = property(_get_max_size, _set_max_size)
+
+    def __len__(self):
+        return len(self._entries)
 
-            # }}}
+    def _get_context_key(self, ctx):
+        """Return the cache key of *ctx*, and remember *ctx* as a live
+        wrapper of it.
+        """
+        context_ptr = ctx.obj_ptr
 
-            # {{{ load binary
+        try:
+            wrappers = self._context_wrappers[context_ptr]
+        except KeyError:
+            from weakref import WeakValueDictionary
+            wrappers = self._context_wrappers[context_ptr] = \
+                    WeakValueDictionary()
+
+        wrappers[id(ctx)] = ctx
+        return context_ptr
+
+    def _remove_dead_entries(self):
+        # Cached programs keep their context alive, so that its obj_ptr
+        # cannot be reused by another context while there are entries.
+        dead_ptrs = set(context_ptr
+                for context_ptr, wrappers in self._context_wrappers.items()
+                if not len(wrappers))
+        if not dead_ptrs:
+            return
+
+        for context_ptr in dead_ptrs:
+            del self._context_wrappers[context_ptr]
+        for key in [key for key in self._entries if key[0] in dead_ptrs]:
+            del self._entries[key]
+
+    def _trim(self):
+        while len(self._entries) > self._max_size:
+            lru_key = min(self._entries,
+                    key=lambda key: self._entries[key][0])
+            del self._entries[lru_key]
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            self._remove_dead_entries()
+            key = (self._get_context_key(key[0]),) + key[1:]
 
-            binary_file = open(binary_path, "rb")
             try:
-                binary = binary_file.read()
-            finally:
-                binary_file.close()
+                entry = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
 
-            # }}}
+            self.hits += 1
+            self._use_count += 1
+            entry[0] = self._use_count
+            return entry[1]
+        finally:
+            self._lock.release()
 
-            if check_dependencies(info.dependencies):
-                return binary, info.log
-            else:
-                mod_cache_dir_m.reset()
+    def add(self, key, prg):
+        self._lock.acquire()
+        try:
+            self._remove_dead_entries()
+            key = (self._get_context_key(key[0]),) + key[1:]
 
-        except:
-            cleanup_m.error_clean_up()
-            raise
-    finally:
-        cleanup_m.clean_up()
+            self._use_count += 1
+            self._entries[key] = [self._use_count, prg]
+            self._trim()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Drop all cached programs. Hit and miss counts are kept."""
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._context_wrappers.clear()
+        finally:
+            self._lock.release()
+
+program_cache = InMemoryProgramCache()
+
+
+def get_program_cache_key(ctx, src, options, devices):
+    checksum = new_hash()
+    update_checksum(checksum, src)
+
+    if devices is not None:
+        devices = tuple(devices)
+
+    return (ctx, checksum.hexdigest(), tuple(options), devices)
+
+# }}}
 
 # {{{ top-level driver
 
 class _SourceInfo(Record):
     pass
 
+def get_default_cache_dir():
+    from os.path import join
+    from tempfile import gettempdir
+    import getpass
+    return join(gettempdir(),
+            "pyopencl-compiler-cache-v3-uid%s-py%s" % (
+                getpass.getuser(), ".".join(str(i) for i in sys.version_info)))
+
 def _create_built_program_from_source_cached(ctx, src, options, devices, cache_dir):
     from os.path import join # required in multiple places below
 
@@ -341,11 +650,7 @@ def _create_built_program_from_source_cached(ctx, src, options, devices, cache_d
             option_idx += 1
 
     if cache_dir is None:
-        from tempfile import gettempdir
-        import getpass
-        cache_dir = join(gettempdir(),
-                "pyopencl-compiler-cache-v2-uid%s-py%s" % (
-                    getpass.getuser(), ".".join(str(i) for i in sys.version_info)))
+        cache_dir = get_default_cache_dir()
 
     # {{{ ensure cache directory exists
 
@@ -429,42 +734,23 @@ def _create_built_program_from_source_cached(ctx, src, options, devices, cache_d
     # {{{ save binaries to cache
 
     if to_be_built_indices:
-        cleanup_m = CleanupManager()
-        try:
-            try:
-                CacheLockManager(cleanup_m, cache_dir)
-
-                for i in to_be_built_indices:
-                    cache_key = cache_keys[i]
-                    device = devices[i]
-                    binary = binaries[i]
-
-                    mod_cache_dir_m = ModuleCacheDirManager(cleanup_m,
-                            join(cache_dir, cache_key))
-                    info_path = mod_cache_dir_m.sub("info")
-                    binary_path = mod_cache_dir_m.sub("binary")
-                    source_path = mod_cache_dir_m.sub("source.cl")
-
-                    outf = open(source_path, "wt")
-                    outf.write(src)
-                    outf.close()
-
-                    outf = open(binary_path, "wb")
-                    outf.write(binary)
-                    outf.close()
-
-                    from cPickle import dump
-                    info_file = open(info_path, "wb")
-                    dump(_SourceInfo(
-                        dependencies=get_dependencies(src, include_path),
-                        log=logs[i]), info_file)
-                    info_file.close()
-
-            except:
-                cleanup_m.error_clean_up()
-                raise
-        finally:
-            cleanup_m.clean_up()
+        from cPickle import dumps
+        dependencies = get_dependencies(src, include_path)
+
+        for i in to_be_built_indices:
+            entry = dumps(
+                _SourceInfo(
+                    dependencies=dependencies,
+                    log=logs[i],
+                    binary=binaries[i],
+                    source=src),
+                protocol=2)
+            _write_atomically(join(cache_dir, cache_keys[i]), entry)
+            _record_access(cache_dir, cache_keys[i], len(entry))
+
+        max_size = get_max_cache_size()
+        if max_size is not None:
+            evict(cache_dir, max_size)
 
     # }}}
 
@@ -475,6 +761,12 @@ def _create_built_program_from_source_cached(ctx, src, options, devices, cache_d
 
 def create_built_program_from_source_cached(ctx, src, options=[], devices=None,
         cache_dir=None):
+    if cache_dir != False:
+        mem_cache_key = get_program_cache_key(ctx, src, options, devices)
+        prg = program_cache.get(mem_cache_key)
+        if prg is not None:
+            return prg
+
     try:
         if cache_dir != False:
             prg, already_built = _create_built_program_from_source_cached(
@@ -503,8 +795,148 @@ def create_built_program_from_source_cached(ctx, src, options=[], devices=None,
     if not already_built:
         prg.build(options, devices)
 
+    if cache_dir != False:
+        program_cache.add(mem_cache_key, prg)
+
     return prg
 
 # }}}
 
+# {{{ maintenance command line
+
+def _format_size(size):
+    for unit in ["bytes", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            break
+        size /= 1024
+
+    if unit == "bytes":
+        return "%d %s" % (size, unit)
+    else:
+        return "%.1f %s" % (size, unit)
+
+
+def verify(cache_dir):
+    """Load each entry in *cache_dir* and remove those that cannot be read
+    or whose include dependencies have changed. Return a tuple
+    *(valid_count, removed_count)*.
+    """
+    from os.path import join
+    from cPickle import load
+
+    valid_count = 0
+    removed_count = 0
+
+    for cache_key in scan_entries(cache_dir):
+        try:
+            entry_file = open(join(cache_dir, cache_key), "rb")
+        except IOError:
+            continue
+
+        try:
+            try:
+                info = load(entry_file)
+                is_valid = (info.binary is not None
+                        and check_dependencies(info.dependencies))
+            except Exception:
+                is_valid = False
+        finally:
+            entry_file.close()
+
+        if is_valid:
+            valid_count += 1
+        else:
+            _remove_entry(cache_dir, cache_key)
+            removed_count += 1
+
+    return valid_count, removed_count
+
+
+def main(args=None):
+    from optparse import OptionParser
+    parser = OptionParser(
+            usage="%prog [options] stats|prune|verify",
+            description="Maintain the PyOpenCL compiler cache.")
+    parser.add_option("--cache-dir", metavar="DIR",
+            help="Cache directory (default: %s)" % get_default_cache_dir())
+    parser.add_option("--max-size", metavar="BYTES", type="int",
+            help="For 'prune': size bound (default: from "
+            "PYOPENCL_CACHE_MAX_SIZE, or %d)" % DEFAULT_MAX_CACHE_SIZE)
+    parser.add_option("--max-age", metavar="DAYS", type="float",
+            help="For 'prune': also remove entries unused for this long")
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1 or args[0] not in ["stats", "prune", "verify"]:
+        parser.print_help()
+        sys.exit(1)
+
+    cache_dir = options.cache_dir
+    if cache_dir is None:
+        cache_dir = get_default_cache_dir()
+
+    from os.path import isdir
+    if not isdir(cache_dir):
+        print "cache directory '%s' does not exist" % cache_dir
+        return
+
+    command, = args
+
+    if command == "stats":
+        index = scan_entries(cache_dir)
+        max_size = get_max_cache_size()
+
+        print "cache directory: %s" % cache_dir
+        print "entries: %d" % len(index)
+        print "total size: %s" % _format_size(
+                sum(size for size, atime in index.itervalues()))
+        if max_size is None:
+            print "size bound: none"
+        else:
+            print "size bound: %s" % _format_size(max_size)
+
+        if index:
+            from time import ctime
+            atimes = [atime for size, atime in index.itervalues()]
+            print "least recently used: %s" % ctime(min(atimes))
+            print "most recently used: %s" % ctime(max(atimes))
+
+    elif command == "prune":
+        max_size = options.max_size
+        if max_size is None:
+            max_size = get_max_cache_size()
+
+        max_age = options.max_age
+        if max_age is not None:
+            max_age = max_age*24*3600
+
+        # Rebuild the index from the directory, to also pick up entries
+        # whose index lines were lost.
+        removed_count, removed_bytes = evict(cache_dir, max_size,
+                max_age=max_age, index=scan_entries(cache_dir))
+
+        # remove temporary files left behind by killed writers
+        from time import time
+        from os.path import join
+        for name in os.listdir(cache_dir):
+            if name.startswith(".tmp-"):
+                path = join(cache_dir, name)
+                try:
+                    if os.stat(path).st_mtime < time() - 3600:
+                        _unlink_quietly(path)
+                except OSError:
+                    pass
+
+        print "removed %d entries (%s)" % (
+                removed_count, _format_size(removed_bytes))
+
+    elif command == "verify":
+        valid_count, removed_count = verify(cache_dir)
+        print "%d valid entries, removed %d invalid ones" % (
+                valid_count, removed_count)
+
+# }}}
+
+if __name__ == "__main__":
+    main()
+
 # vim: foldmethod=marker
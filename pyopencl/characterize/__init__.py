@@ -39,6 +39,16 @@ def has_double_support(dev):
 
 
 
+@memoize
+def has_global_int32_atomics(dev):
+    """Return whether *dev* supports the ``atom_*`` functions on 32-bit
+    integers in global memory.
+    """
+    return "cl_khr_global_int32_base_atomics" in dev.extensions.split(" ")
+
+
+
+
 def has_amd_double_support(dev):
     """"Fix to allow incomplete amd double support in low end boards"""
 
@@ -36,6 +36,9 @@ def _make_unary_array_func(name):
                 result.context, fname, arg.dtype)
 
     def f(array, queue=None):
+        if isinstance(array, cl_array._DeferredArrayBase):
+            return array._apply_function(name)
+
         result = array._new_like_me(queue=queue)
         knl_runner(result, array, queue=queue)
         return result
@@ -95,8 +95,10 @@ class RanluxGenerator(object):
         self.state = cl_array.empty(queue, (num_work_items, 112), dtype=np.uint8)
         self.state.fill(17)
 
-        prg.init_ranlux(queue, (num_work_items,), self.wg_size, np.uint32(seed),
-                self.state.data)
+        self.state.add_event(
+                prg.init_ranlux(queue, (num_work_items,), self.wg_size,
+                    np.uint32(seed), self.state.data,
+                    wait_for=self.state.events))
 
     def generate_settings_defines(self, include_double_pragma=True):
         lines = []
@@ -219,10 +221,14 @@ class RanluxGenerator(object):
             queue = ary.queue
 
         knl, size_multiplier = self.get_gen_kernel(ary.dtype, "")
-        knl(queue,
+        evt = knl(queue,
                 (self.num_work_items,), None,
                 self.state.data, ary.data, ary.size*size_multiplier,
-                b-a, a)
+                b-a, a,
+                wait_for=cl_array._get_array_events([ary], self.state.events))
+        self.state.add_event(evt)
+        ary.add_event(evt)
+        return evt
 
     def uniform(self, *args, **kwargs):
         a = kwargs.pop("a", 0)
@@ -238,9 +244,13 @@ class RanluxGenerator(object):
             queue = ary.queue
 
         knl, size_multiplier = self.get_gen_kernel(ary.dtype, "norm")
-        knl(queue,
+        evt = knl(queue,
                 (self.num_work_items,), self.wg_size,
-                self.state.data, ary.data, ary.size*size_multiplier, sigma, mu)
+                self.state.data, ary.data, ary.size*size_multiplier, sigma, mu,
+                wait_for=cl_array._get_array_events([ary], self.state.events))
+        self.state.add_event(evt)
+        ary.add_event(evt)
+        return evt
 
     def normal(self, *args, **kwargs):
         mu = kwargs.pop("mu", 0)
@@ -273,7 +283,9 @@ class RanluxGenerator(object):
         return prg.sync
 
     def synchronize(self, queue):
-        self.get_sync_kernel()(queue, (self.num_work_items,), self.wg_size, self.state.data)
+        self.state.add_event(
+                self.get_sync_kernel()(queue, (self.num_work_items,),
+                    self.wg_size, self.state.data, wait_for=self.state.events))
 
 
 
@@ -0,0 +1,460 @@
+"""Deferred, fused evaluation of array expressions."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2013 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+
+
+import numpy as np
+import pyopencl.array as cl_array
+from pyopencl.array import _get_common_dtype, _DeferredArrayBase
+from pyopencl.tools import (
+        context_dependent_memoize, dtype_to_ctype,
+        VectorArg, ScalarArg)
+
+
+
+
+# {{{ expression nodes
+
+class _Node(object):
+    def __init__(self, dtype, children=()):
+        self.dtype = np.dtype(dtype)
+        self.children = children
+
+
+class _ArrayLeaf(_Node):
+    def __init__(self, ary):
+        _Node.__init__(self, ary.dtype)
+        self.ary = ary
+
+
+class _ScalarLeaf(_Node):
+    def __init__(self, value, dtype):
+        _Node.__init__(self, dtype)
+        self.value = self.dtype.type(value)
+
+
+class _BinaryOp(_Node):
+    def __init__(self, op, left, right, dtype):
+        _Node.__init__(self, dtype, (left, right))
+        self.op = op
+
+
+class _Negation(_Node):
+    def __init__(self, child):
+        _Node.__init__(self, child.dtype, (child,))
+
+
+class _Power(_Node):
+    def __init__(self, base, exponent, dtype):
+        _Node.__init__(self, dtype, (base, exponent))
+
+
+class _FunctionCall(_Node):
+    def __init__(self, func_name, child, dtype=None):
+        if dtype is None:
+            dtype = child.dtype
+        _Node.__init__(self, dtype, (child,))
+        self.func_name = func_name
+
+# }}}
+
+# {{{ code generation
+
+class _CodeGenerator(object):
+    """Turns an expression DAG into the statement list of an elementwise
+    kernel. Every subexpression is evaluated once into a temporary, so
+    subexpressions shared within the DAG are computed only once per entry.
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.array_names = {}
+        self.scalars = []
+        self.statements = []
+        self.node_to_var = {}
+
+    def cast(self, node, dtype):
+        var = self(node)
+        if node.dtype == dtype:
+            return var
+        else:
+            return "(%s) (%s)" % (dtype_to_ctype(dtype), var)
+
+    def __call__(self, node):
+        try:
+            return self.node_to_var[id(node)]
+        except KeyError:
+            pass
+
+        if isinstance(node, _ScalarLeaf):
+            var = "s%d" % len(self.scalars)
+            self.scalars.append(node)
+            self.node_to_var[id(node)] = var
+            return var
+
+        if isinstance(node, _ArrayLeaf):
+            try:
+                ary_name = self.array_names[id(node.ary)]
+            except KeyError:
+                ary_name = self.array_names[id(node.ary)] = \
+                        "x%d" % len(self.arrays)
+                self.arrays.append(node.ary)
+
+            value = "%s[i]" % ary_name
+
+        elif isinstance(node, _BinaryOp):
+            left, right = node.children
+            value = "%s %s %s" % (
+                    self.cast(left, node.dtype), node.op,
+                    self.cast(right, node.dtype))
+
+        elif isinstance(node, _Negation):
+            child, = node.children
+            value = "-%s" % self(child)
+
+        elif isinstance(node, _Power):
+            base, exponent = node.children
+            value = "pow(%s, %s)" % (
+                    self.cast(base, node.dtype),
+                    self.cast(exponent, node.dtype))
+
+        elif isinstance(node, _FunctionCall):
+            child, = node.children
+            value = "%s(%s)" % (node.func_name, self(child))
+
+        else:
+            raise TypeError("unknown expression node type '%s'"
+                    % type(node).__name__)
+
+        var = "t%d" % len(self.node_to_var)
+        self.statements.append("%s %s = %s" % (
+            dtype_to_ctype(node.dtype), var, value))
+        self.node_to_var[id(node)] = var
+        return var
+
+
+@context_dependent_memoize
+def get_fused_kernel(context, arg_dtypes, operation):
+    """*arg_dtypes* is a tuple of tuples *(is_vector, dtype)*, the first
+    of which describes the output array ``out``. Vector arguments after the
+    output are named ``x0``, ``x1``, ...; scalar arguments ``s0``, ``s1``, ...
+    """
+
+    arguments = []
+    vec_count = 0
+    scalar_count = 0
+    for i, (is_vector, dtype) in enumerate(arg_dtypes):
+        if i == 0:
+            arguments.append(VectorArg(dtype, "out", with_offset=True))
+        elif is_vector:
+            arguments.append(
+                    VectorArg(dtype, "x%d" % vec_count, with_offset=True))
+            vec_count += 1
+        else:
+            arguments.append(ScalarArg(dtype, "s%d" % scalar_count))
+            scalar_count += 1
+
+    from pyopencl.elementwise import ElementwiseKernel
+    return ElementwiseKernel(context, arguments, operation, name="fused")
+
+# }}}
+
+# {{{ deferred array
+
+class DeferredArray(_DeferredArrayBase):
+    """An :class:`pyopencl.array.Array` whose value has not been computed
+    yet. Arithmetic on instances of this class records an expression instead
+    of launching kernels. The whole expression is compiled into a single
+    elementwise kernel (cached by expression structure and types) and
+    evaluated once the value is needed, i.e. when :meth:`get` is called, when
+    :attr:`data` is accessed, or when :meth:`force` is called explicitly.
+
+    Use :func:`defer` to obtain instances of this class.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, queue, shape, node, allocator=None, order="C"):
+        self.queue = queue
+        self.shape = shape
+        self.dtype = node.dtype
+        self.allocator = allocator
+        self.order = order
+
+        self._node = node
+        self._value = None
+
+    # {{{ array-like attributes
+
+    @property
+    def size(self):
+        from pytools import product
+        return product(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def context(self):
+        return self.queue.context
+
+    def __len__(self):
+        if len(self.shape):
+            return self.shape[0]
+        else:
+            return 1
+
+    def __hash__(self):
+        raise TypeError("pyopencl arrays are not hashable.")
+
+    # }}}
+
+    # {{{ evaluation
+
+    def force(self, queue=None, out=None):
+        """Evaluate the recorded expression and return the resulting
+        :class:`pyopencl.array.Array`. The result is remembered, so forcing
+        a second time does not recompute it. If *out* is given, the result
+        is written into it (and always recomputed).
+        """
+
+        if self._value is not None and out is None:
+            return self._value
+
+        queue = queue or self.queue
+
+        gen = _CodeGenerator()
+        result_var = gen(self._node)
+
+        for ary in gen.arrays:
+            if ary.shape != self.shape:
+                raise ValueError("shapes of arrays in deferred expression "
+                        "do not match")
+
+        if out is None:
+            out = cl_array.empty(queue, self.shape, self.dtype,
+                    order=self.order, allocator=self.allocator)
+        else:
+            if out.shape != self.shape or out.dtype != self.dtype:
+                raise TypeError("'out' has non-matching shape or dtype")
+
+        for ary in gen.arrays:
+            if not ary.flags.forc or (
+                    self.size > 1 and ary.strides != out.strides):
+                raise ValueError("arrays in deferred expression must be "
+                        "contiguous and share the memory layout of the result")
+
+        arg_dtypes = (
+                ((True, self.dtype),)
+                + tuple((True, ary.dtype) for ary in gen.arrays)
+                + tuple((False, scalar.dtype) for scalar in gen.scalars))
+        operation = "; ".join(gen.statements + ["out[i] = %s" % result_var])
+
+        knl = get_fused_kernel(queue.context, arg_dtypes, operation)
+        knl(out, *(gen.arrays + [scalar.value for scalar in gen.scalars]),
+                queue=queue)
+
+        if self._value is None:
+            self._value = out
+        return out
+
+    @property
+    def data(self):
+        return self.force().data
+
+    def get(self, queue=None, ary=None, async=False):
+        return self.force(queue=queue).get(queue=queue, ary=ary, async=async)
+
+    def __str__(self):
+        return str(self.get())
+
+    def __repr__(self):
+        return repr(self.get())
+
+    def _get_node(self):
+        if self._value is not None:
+            return _ArrayLeaf(self._value)
+        else:
+            return self._node
+
+    # }}}
+
+    # {{{ expression building
+
+    def _new_from_node(self, node):
+        return DeferredArray(self.queue, self.shape, node,
+                allocator=self.allocator, order=self.order)
+
+    def _operand_node(self, other):
+        if isinstance(other, DeferredArray):
+            if other.shape != self.shape:
+                raise ValueError("shapes of operands do not match")
+            return other._get_node()
+        elif isinstance(other, cl_array.Array):
+            if other.shape != self.shape:
+                raise ValueError("shapes of operands do not match")
+            return _ArrayLeaf(other)
+        else:
+            return _ScalarLeaf(other,
+                    _get_common_dtype(self, other, self.queue))
+
+    def _check_dtype(self, dtype):
+        if dtype.kind == "c":
+            raise TypeError("deferred evaluation does not support "
+                    "complex-valued expressions")
+        return dtype
+
+    def _binary_op(self, op, other, reverse=False):
+        other_node = self._operand_node(other)
+        dtype = self._check_dtype(
+                _get_common_dtype(self, other_node, self.queue))
+
+        if reverse:
+            node = _BinaryOp(op, other_node, self._get_node(), dtype)
+        else:
+            node = _BinaryOp(op, self._get_node(), other_node, dtype)
+
+        return self._new_from_node(node)
+
+    def __add__(self, other):
+        return self._binary_op("+", other)
+
+    def __radd__(self, other):
+        return self._binary_op("+", other, reverse=True)
+
+    def __sub__(self, other):
+        return self._binary_op("-", other)
+
+    def __rsub__(self, other):
+        return self._binary_op("-", other, reverse=True)
+
+    def __mul__(self, other):
+        return self._binary_op("*", other)
+
+    def __rmul__(self, other):
+        return self._binary_op("*", other, reverse=True)
+
+    def __div__(self, other):
+        return self._binary_op("/", other)
+
+    __truediv__ = __div__
+
+    def __rdiv__(self, other):
+        return self._binary_op("/", other, reverse=True)
+
+    __rtruediv__ = __rdiv__
+
+    def __neg__(self):
+        return self._new_from_node(_Negation(self._get_node()))
+
+    def __pow__(self, other):
+        other_node = self._operand_node(other)
+        dtype = self._check_dtype(
+                _get_common_dtype(self, other_node, self.queue))
+        return self._new_from_node(
+                _Power(self._get_node(), other_node, dtype))
+
+    def __rpow__(self, other):
+        other_node = self._operand_node(other)
+        dtype = self._check_dtype(
+                _get_common_dtype(self, other_node, self.queue))
+        return self._new_from_node(
+                _Power(other_node, self._get_node(), dtype))
+
+    def __abs__(self):
+        if self.dtype.kind == "f":
+            fname = "fabs"
+        else:
+            fname = "abs"
+        return self._apply_function(fname)
+
+    def mul_add(self, selffac, other, otherfac, queue=None):
+        """Return `selffac * self + otherfac*other`."""
+        return selffac*self + otherfac*other
+
+    def _apply_function(self, func_name):
+        return self._new_from_node(
+                _FunctionCall(func_name, self._get_node()))
+
+    def astype(self, dtype, queue=None):
+        dtype = self._check_dtype(np.dtype(dtype))
+        if dtype == self.dtype:
+            return self
+
+        return self._new_from_node(
+                _BinaryOp("+", self._get_node(), _ScalarLeaf(0, dtype), dtype))
+
+    # }}}
+
+# }}}
+
+
+
+
+def defer(ary):
+    """Return a :class:`DeferredArray` standing for the
+    :class:`pyopencl.array.Array` *ary*. Arithmetic on the result (and
+    the functions in :mod:`pyopencl.clmath`) is recorded and fused into
+    a single kernel launch.
+
+    Note that the data in *ary* is read only when the expression is
+    evaluated, so *ary* should not be modified until then.
+
+    .. versionadded:: 2013.1
+    """
+    if isinstance(ary, DeferredArray):
+        return ary
+
+    if ary.dtype.kind == "c":
+        raise TypeError("deferred evaluation does not support "
+                "complex-valued arrays")
+
+    if not ary.flags.forc:
+        raise RuntimeError("only contiguous arrays may be deferred")
+
+    if ary.flags.f_contiguous and not ary.flags.c_contiguous:
+        order = "F"
+    else:
+        order = "C"
+
+    return DeferredArray(ary.queue, ary.shape, _ArrayLeaf(ary),
+            allocator=ary.allocator, order=order)
+
+
+
+
+def force(*deferred_arrays):
+    """Evaluate each of *deferred_arrays* and return a tuple of the
+    resulting :class:`pyopencl.array.Array` instances. Entries that are
+    not :class:`DeferredArray` instances are passed through unchanged.
+    """
+    return tuple(
+            ary.force() if isinstance(ary, DeferredArray) else ary
+            for ary in deferred_arrays)
+
+# vim: foldmethod=marker
@@ -29,11 +29,12 @@ OTHER DEALINGS IN THE SOFTWARE.
 
 
 from pyopencl.tools import context_dependent_memoize
+import re
 import numpy as np
 import pyopencl as cl
-from pytools import memoize_method
+from pytools import memoize_method, Record
 from pyopencl.tools import (dtype_to_ctype, VectorArg, ScalarArg,
-        KernelTemplateBase)
+        KernelTemplateBase, get_arg_offset_adjuster_code)
 
 
 # {{{ elementwise kernel code generator
@@ -41,7 +42,11 @@ from pyopencl.tools import (dtype_to_ctype, VectorArg, ScalarArg,
 def get_elwise_program(context, arguments, operation,
         name="elwise_kernel", options=[],
         preamble="", loop_prep="", after_loop="",
-        use_range=False):
+        use_range=False, vector_width=None, vector_operation=None):
+    """With *vector_width*, the kernel processes elements in groups of that
+    many by *vector_operation* (see :func:`_vectorize_operation`), followed
+    by a scalar loop over the remaining elements.
+    """
 
     if use_range:
         body = r"""//CL//
@@ -62,6 +67,22 @@ def get_elwise_program(context, arguments, operation,
             }
           }
           """
+    elif vector_width is not None:
+        body = """//CL//
+          long vector_count = n / %(vector_width)d;
+          for (long vi = work_group_start + lid; vi < vector_count;
+            vi += gsize)
+          {
+            i = vi*%(vector_width)d;
+            %(vector_operation)s;
+          }
+
+          for (i = vector_count*%(vector_width)d + work_group_start + lid;
+            i < n; i += gsize)
+          {
+            %(operation)s;
+          }
+          """
     else:
         body = """//CL//
           for (i = work_group_start + lid; i < n; i += gsize)
@@ -80,17 +101,22 @@ def get_elwise_program(context, arguments, operation,
           int work_group_start = get_local_size(0)*get_group_id(0);
           long i;
 
+          %(arg_offset_adjustment)s
           %(loop_prep)s;
           %(body)s
           %(after_loop)s;
         }
         """ % {
             "arguments": ", ".join(arg.declarator() for arg in arguments),
+            "arg_offset_adjustment": get_arg_offset_adjuster_code(arguments),
             "name": name,
             "preamble": preamble,
             "loop_prep": loop_prep,
             "after_loop": after_loop,
-            "body": body %  dict(operation=operation),
+            "body": body % dict(
+                operation=operation,
+                vector_width=vector_width,
+                vector_operation=vector_operation),
             })
 
     from pyopencl import Program
@@ -102,9 +128,10 @@ def get_elwise_kernel_and_types(context, arguments, operation,
         **kwargs):
 
     from pyopencl.tools import parse_arg_list
-    parsed_args = parse_arg_list(arguments)
+    parsed_args = parse_arg_list(arguments, with_offset=True)
 
     auto_preamble = kwargs.pop("auto_preamble", True)
+    vectorize = kwargs.pop("vectorize", True)
 
     pragmas = []
     includes = []
@@ -127,6 +154,11 @@ def get_elwise_kernel_and_types(context, arguments, operation,
     if pragmas or includes:
         preamble = "\n".join(pragmas+includes) + "\n" + preamble
 
+    vectorization = None
+    if (vectorize and not use_range
+            and not kwargs.get("loop_prep") and not kwargs.get("after_loop")):
+        vectorization = _vectorize_operation(operation, parsed_args)
+
     if use_range:
         parsed_args.extend([
             ScalarArg(np.intp, "start"),
@@ -146,6 +178,18 @@ def get_elwise_kernel_and_types(context, arguments, operation,
     kernel = getattr(prg, name)
     kernel.set_scalar_arg_dtypes(get_arg_list_scalar_arg_dtypes(parsed_args))
 
+    if vectorization is not None:
+        vector_width, vector_operation = vectorization
+        kernel._pyopencl_vectorization = _ElementwiseVectorization(
+                width=vector_width,
+                operation=operation,
+                vector_operation=vector_operation,
+                arguments=parsed_args,
+                name=name,
+                options=options,
+                preamble=preamble,
+                kernel=None)
+
     return kernel, parsed_args
 
 
@@ -165,6 +209,364 @@ def get_elwise_kernel(context, arguments, operation,
 
 # }}}
 
+# {{{ vectorized loads and stores
+
+# Elementwise and reduction kernels whose arrays all have the same scalar
+# type and are only indexed as ``x[i]`` get a variant that moves this many
+# bytes per vload/vstore. CPU implementations and many GPUs only reach
+# their full memory bandwidth with loads this wide.
+VECTOR_LOAD_BYTES = 16
+
+_VECTOR_INT_TYPE_NAMES = {1: "char", 2: "short", 4: "int", 8: "long"}
+
+_VECTORIZABLE_MATH_FUNCTIONS = frozenset([
+    "fabs", "sqrt", "rsqrt", "cbrt", "exp", "exp2", "exp10", "expm1",
+    "log", "log2", "log10", "log1p", "sin", "cos", "tan", "asin", "acos",
+    "atan", "sinh", "cosh", "tanh", "floor", "ceil", "trunc", "round",
+    "rint",
+    ])
+
+_SUBSCRIPT_RE = re.compile(r"\b([A-Za-z_]\w*)\s*\[\s*i\s*\]")
+_ASSIGNMENT_RE = re.compile(
+        r"^\s*([A-Za-z_]\w*)\s*\[\s*i\s*\]\s*=(?!=)(.*)$", re.DOTALL)
+_UNVECTORIZABLE_RE = re.compile(
+        r"[\[\]?:<>!=.{}\"'#,;\\]|&&|\|\||\+\+|--|//|/\*")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _get_vector_base_type(dtype):
+    """Return the name of the OpenCL scalar type underlying the vector
+    types of *dtype*, or *None* if *dtype* has none.
+    """
+    if dtype.kind == "f" and dtype.itemsize in [4, 8]:
+        return dtype_to_ctype(dtype)
+    elif dtype.kind in "iu" and dtype.itemsize in _VECTOR_INT_TYPE_NAMES:
+        result = _VECTOR_INT_TYPE_NAMES[dtype.itemsize]
+        if dtype.kind == "u":
+            result = "u" + result
+        return result
+    else:
+        return None
+
+
+def _get_vectorizable_dtype(parsed_args):
+    """Return the common *dtype* of the vector arguments among
+    *parsed_args* if it has vector types, otherwise *None*.
+    """
+    dtypes = set(arg.dtype for arg in parsed_args
+            if isinstance(arg, VectorArg))
+    if len(dtypes) != 1:
+        return None
+
+    dtype, = dtypes
+    if _get_vector_base_type(dtype) is None:
+        return None
+
+    return dtype
+
+
+def _vectorize_expression(expr, parsed_args, dtype, width):
+    """Return *expr* with each ``x[i]`` of a vector argument *x* replaced
+    by a load of *width* entries starting at ``x[i]``, or *None* if *expr*
+    may not evaluate componentwise on such vectors.
+
+    This is deliberately conservative: besides such subscripts, *expr* may
+    only contain scalar arguments of *dtype*, arithmetic operators,
+    parentheses and, for floating point types, calls of a few math
+    functions of one argument.
+    """
+    vector_names = set(arg.name for arg in parsed_args
+            if isinstance(arg, VectorArg))
+
+    allowed_names = set(arg.name for arg in parsed_args
+            if isinstance(arg, ScalarArg) and arg.dtype == dtype)
+    if dtype.kind == "f":
+        allowed_names.update(_VECTORIZABLE_MATH_FUNCTIONS)
+        forbidden_chars = "%&|^~"
+    elif dtype.itemsize < 4:
+        # Scalar code computes these in (promoted) int, vector code does
+        # not.
+        forbidden_chars = "/%"
+    else:
+        forbidden_chars = ""
+
+    rest = _SUBSCRIPT_RE.sub(" ", expr)
+    if _UNVECTORIZABLE_RE.search(rest):
+        return None
+    for c in forbidden_chars:
+        if c in rest:
+            return None
+
+    # rules out numeric literals as well, whose type might not convert to
+    # the vector type
+    for token in _TOKEN_RE.findall(rest):
+        if token not in allowed_names:
+            return None
+
+    result = []
+    pos = 0
+    for match in _SUBSCRIPT_RE.finditer(expr):
+        if match.group(1) not in vector_names:
+            return None
+
+        result.append(expr[pos:match.start()])
+        result.append("vload%d(0, %s + i)" % (width, match.group(1)))
+        pos = match.end()
+
+    result.append(expr[pos:])
+    return "".join(result)
+
+
+def _vectorize_operation(operation, parsed_args):
+    """Return a tuple *(vector_width, vector_operation)*, where
+    *vector_operation* carries out *operation* for the *vector_width*
+    elements starting at *i*, or *None* if that is not possible.
+
+    *operation* qualifies if it is a sequence of assignments ``x[i] =
+    expr`` to vector arguments, with *expr* as described in
+    :func:`_vectorize_expression`.
+    """
+    dtype = _get_vectorizable_dtype(parsed_args)
+    if dtype is None:
+        return None
+
+    width = VECTOR_LOAD_BYTES // dtype.itemsize
+    vector_type = "%s%d" % (_get_vector_base_type(dtype), width)
+    vector_names = set(arg.name for arg in parsed_args
+            if isinstance(arg, VectorArg))
+
+    statements = []
+    for statement in operation.split(";"):
+        if not statement.strip():
+            continue
+
+        match = _ASSIGNMENT_RE.match(statement)
+        if match is None or match.group(1) not in vector_names:
+            return None
+
+        rhs = _vectorize_expression(
+                match.group(2).strip(), parsed_args, dtype, width)
+        if rhs is None:
+            return None
+
+        statements.append("vstore%d((%s) (%s), 0, %s + i)"
+                % (width, vector_type, rhs, match.group(1)))
+
+    if not statements:
+        return None
+
+    return width, ";\n".join(statements)
+
+
+class _ElementwiseVectorization(Record):
+    pass
+
+
+def _can_load_vectors(vectors, n, width):
+    """Return whether the first *n* entries of each of the arrays *vectors*
+    can be read as vectors of *width* entries aligned to their size.
+    """
+    if n < width:
+        return False
+
+    for vec in vectors:
+        if vec.offset % (width*vec.dtype.itemsize):
+            return False
+
+    return True
+
+
+def _get_vectorized_kernel(kernel, vectors, n):
+    """Return a tuple *(vector_kernel, vector_width)* if *kernel*, as
+    returned by :func:`get_elwise_kernel_and_types`, has a vectorized
+    variant that may be applied to *n* elements of the arrays *vectors*,
+    otherwise *None*. The variant takes the same arguments as *kernel* and
+    must be launched for *n // vector_width* work items.
+    """
+    try:
+        vectorization = kernel._pyopencl_vectorization
+    except AttributeError:
+        return None
+
+    width = vectorization.width
+    if not _can_load_vectors(vectors, n, width):
+        return None
+
+    if vectorization.kernel is None:
+        prg = get_elwise_program(
+                kernel.context, vectorization.arguments,
+                vectorization.operation,
+                name=vectorization.name, options=vectorization.options,
+                preamble=vectorization.preamble,
+                vector_width=width,
+                vector_operation=vectorization.vector_operation)
+
+        from pyopencl.tools import get_arg_list_scalar_arg_dtypes
+        vector_kernel = getattr(prg, vectorization.name)
+        vector_kernel.set_scalar_arg_dtypes(
+                get_arg_list_scalar_arg_dtypes(vectorization.arguments))
+        vectorization.kernel = vector_kernel
+
+    return vectorization.kernel, width
+
+# }}}
+
+# {{{ stride-aware indexing
+
+def _get_stride_pattern(vectors):
+    """Return *None* if all arrays in *vectors* can be indexed by their
+    position in memory. Otherwise, return a tuple with an entry for each
+    array, which is *None* for C-contiguous arrays and the number of
+    dimensions for all others. Their shapes and strides are passed to the
+    kernel as arguments (see :func:`_get_stride_args`), so that one kernel
+    serves all arrays of the same pattern.
+    """
+    from pytools import all
+    if (all(vec.flags.c_contiguous for vec in vectors)
+            or all(vec.flags.f_contiguous for vec in vectors)):
+        return None
+
+    result = []
+    for vec in vectors:
+        if vec.flags.c_contiguous:
+            result.append(None)
+        else:
+            itemsize = vec.dtype.itemsize
+            for stride in vec.strides:
+                if stride % itemsize:
+                    raise ValueError("strides must be a multiple "
+                            "of the item size")
+
+            result.append(len(vec.shape))
+
+    return tuple(result)
+
+
+def _get_stride_args(vectors, stride_pattern):
+    """Return the shapes and strides (the latter in units of the item size)
+    of the arrays in *vectors* that are strided according to
+    *stride_pattern*, in the order of the arguments added by
+    :func:`_make_stride_aware`.
+    """
+    result = []
+    for vec, ndim in zip(vectors, stride_pattern):
+        if ndim is None:
+            continue
+
+        itemsize = vec.dtype.itemsize
+        result.extend(vec.shape)
+        result.extend(stride // itemsize for stride in vec.strides)
+
+    return result
+
+
+def _get_generic_strided_index_function(name, ndim):
+    """Return C source of a function mapping the C-order linear index
+    of an element of an array of *ndim* dimensions to its position in
+    memory. The shape and the strides of the array, in units of the item
+    size, are passed to the function after the index.
+    """
+    lines = [
+            "inline long %s(long j, %s)" % (name, ", ".join(
+                ["long n%d" % i for i in range(ndim)]
+                + ["long s%d" % i for i in range(ndim)])),
+            "{",
+            "  long result = 0;",
+            ]
+
+    for i in reversed(range(ndim)):
+        if i:
+            lines.append("  result += (j %% n%d) * s%d; j /= n%d;" % (i, i, i))
+        else:
+            lines.append("  result += j * s%d;" % i)
+
+    lines.extend(["  return result;", "}"])
+    return "\n".join(lines)
+
+
+def _find_closing_bracket(code, start):
+    depth = 0
+    for i in xrange(start, len(code)):
+        c = code[i]
+        if c == "[":
+            depth += 1
+        elif c == "]":
+            depth -= 1
+            if not depth:
+                return i
+
+    raise ValueError("unbalanced brackets in '%s'" % code)
+
+
+def _rewrite_indexing(code, arg_name, index_func_name):
+    """Replace each occurrence of ``arg_name[expr]`` in *code* by
+    ``arg_name[index_func_name(expr)]``.
+    """
+    import re
+    subscript_re = re.compile(r"\b%s\s*\[" % re.escape(arg_name))
+
+    result = []
+    pos = 0
+    while True:
+        match = subscript_re.search(code, pos)
+        if match is None:
+            break
+
+        open_idx = match.end() - 1
+        close_idx = _find_closing_bracket(code, open_idx)
+
+        result.append(code[pos:match.start()])
+        result.append("%s[%s(%s)]" % (
+            arg_name, index_func_name,
+            _rewrite_indexing(
+                code[open_idx+1:close_idx], arg_name, index_func_name)))
+        pos = close_idx + 1
+
+    result.append(code[pos:])
+    return "".join(result)
+
+
+def _make_stride_aware(operation, arg_names, stride_pattern):
+    """Return a tuple *(operation, preamble, arguments)* in which the
+    subscripts of the arrays named in *arg_names* use *stride_pattern* (see
+    :func:`_get_stride_pattern`). *arguments* lists the :class:`ScalarArg`
+    instances receiving the shapes and strides, which go after those of
+    the kernel.
+    """
+    preamble = []
+    arguments = []
+    index_funcs_done = set()
+
+    for arg_name, ndim in zip(arg_names, stride_pattern):
+        if ndim is None:
+            continue
+
+        generic_func_name = "pyopencl_strided_index_%d" % ndim
+        if ndim not in index_funcs_done:
+            preamble.append(
+                    _get_generic_strided_index_function(
+                        generic_func_name, ndim))
+            index_funcs_done.add(ndim)
+
+        layout_arg_names = (
+                ["pyopencl_%s__shape%d" % (arg_name, i) for i in range(ndim)]
+                + ["pyopencl_%s__stride%d" % (arg_name, i)
+                    for i in range(ndim)])
+        arguments.extend(
+                ScalarArg(np.int64, layout_arg_name)
+                for layout_arg_name in layout_arg_names)
+
+        # The index function needs the layout arguments, which are
+        # only in scope within the kernel, hence the macro.
+        index_func_name = "pyopencl_%s__index" % arg_name
+        preamble.append("#define %s(j) %s((j), %s)" % (
+            index_func_name, generic_func_name, ", ".join(layout_arg_names)))
+        operation = _rewrite_indexing(operation, arg_name, index_func_name)
+
+    return operation, "\n\n".join(preamble), arguments
+
+# }}}
+
 # {{{ ElementwiseKernel driver
 
 class ElementwiseKernel:
@@ -178,11 +580,35 @@ class ElementwiseKernel:
         self.kwargs = kwargs
 
     @memoize_method
-    def get_kernel(self, use_range):
+    def get_arg_descrs(self):
+        from pyopencl.tools import parse_arg_list
+        return parse_arg_list(self.arguments, with_offset=True)
+
+    @memoize_method
+    def get_kernel(self, use_range, stride_pattern=None):
+        """*stride_pattern*, as returned by :func:`_get_stride_pattern` for
+        the vector arguments, specializes the kernel for non-contiguous
+        arrays.
+        """
+        operation = self.operation
+        arguments = self.arguments
+        kwargs = self.kwargs
+
+        if stride_pattern is not None:
+            operation, index_preamble, layout_args = _make_stride_aware(
+                    operation,
+                    [arg.name for arg in self.get_arg_descrs()
+                        if isinstance(arg, VectorArg)],
+                    stride_pattern)
+            arguments = self.get_arg_descrs() + layout_args
+            kwargs = dict(kwargs,
+                    preamble=kwargs.get("preamble", "") + "\n\n"
+                    + index_preamble)
+
         knl, arg_descrs = get_elwise_kernel_and_types(
-            self.context, self.arguments, self.operation,
+            self.context, arguments, operation,
             name=self.name, options=self.options,
-            use_range=use_range, **self.kwargs)
+            use_range=use_range, **kwargs)
 
         if not [i for i, arg in enumerate(arg_descrs)
                 if isinstance(arg, VectorArg)]:
@@ -199,34 +625,51 @@ class ElementwiseKernel:
         slice_ = kwargs.pop("slice", None)
 
         use_range = range_ is not None or slice_ is not None
-        kernel, arg_descrs = self.get_kernel(use_range)
+
+        vectors = [arg for arg, arg_descr in zip(args, self.get_arg_descrs())
+                if isinstance(arg_descr, VectorArg)]
+        stride_pattern = _get_stride_pattern(vectors)
+        kernel, arg_descrs = self.get_kernel(use_range, stride_pattern)
 
         # {{{ assemble arg array
 
         invocation_args = []
         for arg, arg_descr in zip(args, arg_descrs):
             if isinstance(arg_descr, VectorArg):
-                if not arg.flags.forc:
-                    raise RuntimeError("ElementwiseKernel cannot "
-                            "deal with non-contiguous arrays")
-
                 if repr_vec is None:
                     repr_vec = arg
 
-                invocation_args.append(arg.data)
+                if arg_descr.with_offset:
+                    invocation_args.append(arg.base_data)
+                    invocation_args.append(arg.offset)
+                else:
+                    invocation_args.append(arg.data)
             else:
                 invocation_args.append(arg)
 
+        if stride_pattern is not None:
+            invocation_args.extend(_get_stride_args(vectors, stride_pattern))
+
         # }}}
 
         queue = kwargs.pop("queue", None)
         wait_for = kwargs.pop("wait_for", None)
+        batch = kwargs.pop("batch", None)
         if kwargs:
             raise TypeError("unknown keyword arguments: '%s'"
                     % ", ".join(kwargs))
 
         if queue is None:
-            queue = repr_vec.queue
+            if batch is not None:
+                queue = batch.queue
+            else:
+                queue = repr_vec.queue
+
+        from pyopencl.array import _get_active_launch_batch
+        if batch is None:
+            batch = _get_active_launch_batch(queue)
+        elif batch.queue != queue:
+            raise ValueError("batch does not enqueue to the given queue")
 
         if slice_ is not None:
             if range_ is not None:
@@ -235,9 +678,7 @@ class ElementwiseKernel:
 
             range_ = slice(*slice_.indices(repr_vec.size))
 
-        max_wg_size = kernel.get_work_group_info(
-                cl.kernel_work_group_info.WORK_GROUP_SIZE,
-                queue.device)
+        from pyopencl.array import _get_kernel_work_group_size
 
         if range_ is not None:
             start = range_.start
@@ -255,14 +696,33 @@ class ElementwiseKernel:
             from pyopencl.array import splay
             gs, ls = splay(queue,
                     abs(range_.stop - start)//step,
-                    max_wg_size)
+                    _get_kernel_work_group_size(kernel, queue))
         else:
             invocation_args.append(repr_vec.size)
-            gs, ls = repr_vec.get_sizes(queue, max_wg_size)
 
+            work_item_count = repr_vec.size
+            if stride_pattern is None:
+                vectorized = _get_vectorized_kernel(
+                        kernel, vectors, repr_vec.size)
+                if vectorized is not None:
+                    kernel, vector_width = vectorized
+                    work_item_count = repr_vec.size // vector_width
+
+            from pyopencl.array import splay
+            gs, ls = splay(queue, work_item_count,
+                    _get_kernel_work_group_size(kernel, queue))
+
+        if batch is not None:
+            batch.add(kernel, gs, ls, invocation_args, wait_for=wait_for,
+                    arrays=args)
+            return None
+
+        from pyopencl.array import _get_array_events, _add_array_event
         kernel.set_args(*invocation_args)
-        return cl.enqueue_nd_range_kernel(queue, kernel,
-                gs, ls, wait_for=wait_for)
+        evt = cl.enqueue_nd_range_kernel(queue, kernel,
+                gs, ls, wait_for=_get_array_events(args, wait_for))
+        _add_array_event(args, evt)
+        return evt
 
 # }}}
 
@@ -284,7 +744,8 @@ class ElementwiseTemplate(KernelTemplateBase):
             options=()):
         renderer = self.get_renderer(type_values, var_values, context, options)
 
-        arg_list = renderer.render_argument_list(self.arguments, more_arguments)
+        arg_list = renderer.render_argument_list(
+                self.arguments, more_arguments, with_offset=True)
         type_decl_preamble = renderer.get_type_decl_preamble(
                 context.devices[0], declare_types, arg_list)
 
@@ -307,11 +768,11 @@ def get_take_kernel(context, dtype, idx_dtype, vec_count=1):
             "tp": dtype_to_ctype(dtype),
             }
 
-    args = ([VectorArg(dtype, "dest" + str(i))
+    args = ([VectorArg(dtype, "dest" + str(i), with_offset=True)
              for i in range(vec_count)]
-            + [VectorArg(dtype, "src" + str(i))
+            + [VectorArg(dtype, "src" + str(i), with_offset=True)
                for i in range(vec_count)]
-            + [VectorArg(idx_dtype, "idx")])
+            + [VectorArg(idx_dtype, "idx", with_offset=True)])
     body = (
             ("%(idx_tp)s src_idx = idx[i];\n" % ctx)
             + "\n".join(
@@ -329,13 +790,13 @@ def get_take_put_kernel(context, dtype, idx_dtype, with_offsets, vec_count=1):
             }
 
     args = [
-            VectorArg(dtype, "dest%d" % i)
+            VectorArg(dtype, "dest%d" % i, with_offset=True)
                 for i in range(vec_count)
             ] + [
-            VectorArg(idx_dtype, "gmem_dest_idx"),
-            VectorArg(idx_dtype, "gmem_src_idx"),
+            VectorArg(idx_dtype, "gmem_dest_idx", with_offset=True),
+            VectorArg(idx_dtype, "gmem_src_idx", with_offset=True),
             ] + [
-            VectorArg(dtype, "src%d" % i)
+            VectorArg(dtype, "src%d" % i, with_offset=True)
                 for i in range(vec_count)
             ] + [
             ScalarArg(idx_dtype, "offset%d" % i)
@@ -367,12 +828,12 @@ def get_put_kernel(context, dtype, idx_dtype, vec_count=1):
             }
 
     args = [
-            VectorArg(dtype, "dest%d" % i)
+            VectorArg(dtype, "dest%d" % i, with_offset=True)
                 for i in range(vec_count)
             ] + [
-            VectorArg(idx_dtype, "gmem_dest_idx"),
+            VectorArg(idx_dtype, "gmem_dest_idx", with_offset=True),
             ] + [
-            VectorArg(dtype, "src%d" % i)
+            VectorArg(dtype, "src%d" % i, with_offset=True)
                 for i in range(vec_count)
             ]
 
@@ -399,6 +860,17 @@ def get_copy_kernel(context, dtype_dest, dtype_src):
             name="copy")
 
 
+@context_dependent_memoize
+def get_strided_copy_kernel(context, dtype):
+    """Return an :class:`ElementwiseKernel` copying between two arrays of
+    the same shape and *dtype* but possibly different strides.
+    """
+    return ElementwiseKernel(context,
+            "%(tp)s *dest, %(tp)s *src" % {"tp": dtype_to_ctype(dtype)},
+            "dest[i] = src[i]",
+            name="copy_strided")
+
+
 @context_dependent_memoize
 def get_linear_combination_kernel(summand_descriptors,
         dtype_z):
@@ -787,10 +1259,10 @@ def get_unary_func_kernel(context, func_name, in_dtype, out_dtype=None):
 @context_dependent_memoize
 def get_if_positive_kernel(context, crit_dtype, dtype):
     return get_elwise_kernel(context, [
-            VectorArg(dtype, "result"),
-            VectorArg(crit_dtype, "crit"),
-            VectorArg(dtype, "then_"),
-            VectorArg(dtype, "else_"),
+            VectorArg(dtype, "result", with_offset=True),
+            VectorArg(crit_dtype, "crit", with_offset=True),
+            VectorArg(dtype, "then_", with_offset=True),
+            VectorArg(dtype, "else_", with_offset=True),
             ],
             "result[i] = crit[i] > 0 ? then_[i] : else_[i]",
             name="if_positive")
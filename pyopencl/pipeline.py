@@ -0,0 +1,506 @@
+"""Overlapping transfers and computation."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2013 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+
+
+import pyopencl as cl
+import pyopencl.array as cl_array
+from pyopencl.tools import context_dependent_memoize, dtype_to_ctype
+
+_builtin_min = min
+_builtin_max = max
+
+
+
+
+# {{{ command scheduler
+
+class _AccessRecord(object):
+    """The outstanding accesses to one memory object: the event of the last
+    command writing it, and the events of the commands reading it since.
+    """
+
+    __slots__ = ["write_event", "read_events"]
+
+    def __init__(self):
+        self.write_event = None
+        self.read_events = []
+
+
+def _is_out_of_order(queue):
+    return bool(queue.properties
+            & cl.command_queue_properties.OUT_OF_ORDER_EXEC_MODE_ENABLE)
+
+
+class CommandScheduler(object):
+    """Distributes host-to-device copies, kernel launches and device-to-host
+    copies over one or several :class:`pyopencl.CommandQueue` instances and
+    orders them by the device memory they access, so that transfers may
+    overlap with computation wherever the data flow permits.
+
+    :arg queues: a single :class:`pyopencl.CommandQueue` or a list of them.
+        With one queue (ideally created with
+        :attr:`pyopencl.command_queue_properties.OUT_OF_ORDER_EXEC_MODE_ENABLE`),
+        all commands go into that queue. With two, kernels go into the first
+        and transfers into the second. With three or more, kernels go into
+        the first, host-to-device copies into the second and device-to-host
+        copies into the third.
+
+    Dependencies are tracked per memory object (a :class:`pyopencl.Buffer`
+    or the :attr:`pyopencl.array.Array.base_data` of an array, so that all
+    views of a buffer count as the same memory object): a command waits
+    for the last command writing any memory object it accesses, and a command
+    writing a memory object additionally waits for all commands reading it
+    since that write. Arrays passed in also take part in the
+    :attr:`pyopencl.array.Array.events` protocol.
+
+    Host memory is not tracked. Wait for the event returned by
+    :meth:`copy_to_device` before modifying the host array, and for the one
+    returned by :meth:`copy_to_host` before reading it.
+
+    Overlapping sub-buffers of a common buffer are treated as independent.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, queues):
+        if isinstance(queues, cl.CommandQueue):
+            queues = [queues]
+        else:
+            queues = list(queues)
+
+        if not queues:
+            raise ValueError("need at least one command queue")
+
+        self.queues = queues
+        self.compute_queue = queues[0]
+        if len(queues) == 1:
+            self.to_device_queue = self.to_host_queue = queues[0]
+        elif len(queues) == 2:
+            self.to_device_queue = self.to_host_queue = queues[1]
+        else:
+            self.to_device_queue = queues[1]
+            self.to_host_queue = queues[2]
+
+        if len(queues) == 1 and not _is_out_of_order(queues[0]):
+            from warnings import warn
+            warn("CommandScheduler was given a single in-order queue. "
+                    "Transfers will not overlap with computation.",
+                    stacklevel=2)
+
+        from weakref import WeakKeyDictionary
+        self._records = WeakKeyDictionary()
+
+    @property
+    def context(self):
+        return self.compute_queue.context
+
+    # {{{ dependency tracking
+
+    def _get_record(self, mem):
+        try:
+            return self._records[mem]
+        except KeyError:
+            result = self._records[mem] = _AccessRecord()
+            return result
+
+    def _get_dependencies(self, reads, writes, wait_for):
+        result = []
+        if wait_for is not None:
+            result.extend(wait_for)
+
+        result.extend(cl_array._get_array_events(reads + writes) or [])
+
+        for mem in reads:
+            rec = self._get_record(_get_mem(mem))
+            if rec.write_event is not None:
+                result.append(rec.write_event)
+
+        for mem in writes:
+            rec = self._get_record(_get_mem(mem))
+            if rec.write_event is not None:
+                result.append(rec.write_event)
+            result.extend(rec.read_events)
+
+        return result
+
+    def _record(self, reads, writes, evt):
+        seen_arrays = set()
+        for ary in reads + writes:
+            if (isinstance(ary, cl_array.Array)
+                    and id(ary.events) not in seen_arrays):
+                seen_arrays.add(id(ary.events))
+                ary.add_event(evt)
+
+        for mem in reads:
+            rec = self._get_record(_get_mem(mem))
+            rec.read_events.append(evt)
+
+            if len(rec.read_events) > 16:
+                # keep the list from growing without bound for memory
+                # that is read over and over but never written
+                complete = cl.command_execution_status.COMPLETE
+                rec.read_events = [e for e in rec.read_events
+                        if e.command_execution_status != complete]
+
+        for mem in writes:
+            rec = self._get_record(_get_mem(mem))
+            rec.write_event = evt
+            rec.read_events = []
+
+    # }}}
+
+    # {{{ commands
+
+    def copy_to_device(self, dest, host_ary, wait_for=None):
+        """Enqueue a non-blocking copy of the :class:`numpy.ndarray`
+        *host_ary* into *dest*, a :class:`pyopencl.Buffer` or
+        :class:`pyopencl.array.Array`. Return the
+        :class:`pyopencl.Event` of the copy.
+        """
+        deps = self._get_dependencies([], [dest], wait_for)
+        evt = cl.enqueue_copy(self.to_device_queue, _get_mem(dest), host_ary,
+                device_offset=_get_offset(dest), is_blocking=False,
+                wait_for=deps)
+        self._record([], [dest], evt)
+        return evt
+
+    def copy_to_host(self, host_ary, src, wait_for=None):
+        """Enqueue a non-blocking copy of *src*, a :class:`pyopencl.Buffer`
+        or :class:`pyopencl.array.Array`, into the :class:`numpy.ndarray`
+        *host_ary*. Return the :class:`pyopencl.Event` of the copy.
+        """
+        deps = self._get_dependencies([src], [], wait_for)
+        evt = cl.enqueue_copy(self.to_host_queue, host_ary, _get_mem(src),
+                device_offset=_get_offset(src), is_blocking=False,
+                wait_for=deps)
+        self._record([src], [], evt)
+        return evt
+
+    def copy(self, dest, src, byte_count=None, src_offset=0, dest_offset=0,
+            wait_for=None):
+        """Enqueue a device-to-device copy from *src* to *dest*, each a
+        :class:`pyopencl.Buffer` or :class:`pyopencl.array.Array`.
+        Return the :class:`pyopencl.Event` of the copy.
+        """
+        kwargs = dict(
+                src_offset=_get_offset(src) + src_offset,
+                dest_offset=_get_offset(dest) + dest_offset)
+        if byte_count is not None:
+            kwargs["byte_count"] = byte_count
+
+        deps = self._get_dependencies([src], [dest], wait_for)
+        evt = cl.enqueue_copy(self.compute_queue, _get_mem(dest), _get_mem(src),
+                wait_for=deps, **kwargs)
+        self._record([src], [dest], evt)
+        return evt
+
+    def kernel(self, kernel, global_size, local_size, *args, **kwargs):
+        """Enqueue *kernel*, a :class:`pyopencl.Kernel`, like
+        :meth:`pyopencl.Kernel.__call__`. :class:`pyopencl.array.Array`
+        instances among *args* are passed by their
+        :attr:`pyopencl.array.Array.data`.
+
+        The keyword arguments *reads* and *writes* may list the memory
+        objects the kernel reads and writes. If neither is given, all memory
+        objects among *args* are assumed to be both read and written.
+        *wait_for*, *global_offset* and *g_times_l* are also accepted.
+        Return the :class:`pyopencl.Event` of the launch.
+        """
+        reads, writes = _get_accesses(args, kwargs)
+        deps = self._get_dependencies(reads, writes, kwargs.pop("wait_for", None))
+
+        actual_args = [_get_kernel_arg(arg) for arg in args]
+        evt = kernel(self.compute_queue, global_size, local_size,
+                *actual_args, **dict(kwargs, wait_for=deps))
+        self._record(reads, writes, evt)
+        return evt
+
+    def elementwise(self, knl, *args, **kwargs):
+        """Enqueue the :class:`pyopencl.elementwise.ElementwiseKernel` *knl*.
+        *reads*, *writes* and *wait_for* are handled as in :meth:`kernel`,
+        all other keyword arguments are passed on to *knl*.
+        Return the :class:`pyopencl.Event` of the launch.
+        """
+        reads, writes = _get_accesses(args, kwargs)
+        deps = self._get_dependencies(reads, writes, kwargs.pop("wait_for", None))
+
+        evt = knl(*args, **dict(kwargs, queue=self.compute_queue, wait_for=deps))
+        self._record(reads, writes, evt)
+        return evt
+
+    def reduction(self, knl, *args, **kwargs):
+        """Enqueue the :class:`pyopencl.reduction.ReductionKernel` *knl*,
+        whose array arguments are only read. *wait_for* is handled as in
+        :meth:`kernel`. Return a tuple *(result, event)*, where *result* is
+        the on-device zero-dimensional :class:`pyopencl.array.Array` holding
+        the result.
+        """
+        reads = [arg for arg in args if _is_mem(arg)]
+        deps = self._get_dependencies(reads, [], kwargs.pop("wait_for", None))
+
+        result, evt = knl(*args, **dict(kwargs, queue=self.compute_queue,
+            wait_for=deps, return_event=True))
+        self._record(reads, [result], evt)
+        return result, evt
+
+    def finish(self):
+        """Wait for all commands in all queues to complete and forget about
+        the recorded accesses.
+        """
+        for queue in self.queues:
+            queue.finish()
+
+        self._records.clear()
+
+    # }}}
+
+
+def _is_mem(arg):
+    return isinstance(arg, (cl.MemoryObject, cl_array.Array))
+
+
+def _get_mem(arg):
+    if isinstance(arg, cl_array.Array):
+        return arg.base_data
+    else:
+        return arg
+
+
+def _get_offset(arg):
+    if isinstance(arg, cl_array.Array):
+        return arg.offset
+    else:
+        return 0
+
+
+def _get_kernel_arg(arg):
+    if isinstance(arg, cl_array.Array):
+        return arg.data
+    else:
+        return arg
+
+
+def _get_accesses(args, kwargs):
+    reads = kwargs.pop("reads", None)
+    writes = kwargs.pop("writes", None)
+
+    if reads is None and writes is None:
+        return [], [arg for arg in args if _is_mem(arg)]
+    else:
+        return list(reads or []), list(writes or [])
+
+# }}}
+
+# {{{ streaming
+
+@context_dependent_memoize
+def _get_partial_result_reduction_kernel(context, dtype_out, neutral,
+        reduce_expr, preamble, options):
+    from pyopencl.reduction import ReductionKernel
+    return ReductionKernel(context, dtype_out, neutral, reduce_expr,
+            arguments="__global const %s *in" % dtype_to_ctype(dtype_out),
+            preamble=preamble, options=list(options),
+            name="combine_partial_results")
+
+
+@context_dependent_memoize
+def _get_neutral_fill_kernel(context, dtype_out, neutral, preamble, options):
+    from pyopencl.elementwise import ElementwiseKernel
+    return ElementwiseKernel(context,
+            "%s *out" % dtype_to_ctype(dtype_out),
+            "out[i] = %s" % neutral,
+            preamble=preamble, options=list(options),
+            name="fill_neutral")
+
+
+def _normalize_options(options):
+    # same conventions as Program.build
+    if options is None:
+        return ()
+    if isinstance(options, str):
+        return (options,)
+    return tuple(options)
+
+
+def process_in_chunks(queues, kernel, args, chunk_size, outputs=(),
+        buffer_count=2, allocator=None):
+    """Apply *kernel* to host data too large to fit onto the device at once.
+
+    Every :class:`numpy.ndarray` (including :class:`numpy.memmap`) among
+    *args* is split into chunks of *chunk_size* entries along its first axis
+    and streamed through *buffer_count* device buffers, so that the transfer
+    of one chunk overlaps with the computation on another (see
+    :class:`CommandScheduler`, which also explains *queues*). All other
+    entries of *args* (scalars, :class:`pyopencl.array.Array` instances)
+    are passed unchanged with every chunk. The streamed arrays must be
+    C-contiguous and agree in the length of their first axis.
+
+    :arg kernel: one of
+
+        * a :class:`pyopencl.elementwise.ElementwiseKernel`, which is invoked
+          with :class:`pyopencl.array.Array` instances for the streamed
+          arguments.
+        * a :class:`pyopencl.reduction.ReductionKernel`. The partial results
+          of the chunks are combined on the device using the kernel's
+          reduction expression.
+        * a :class:`pyopencl.Kernel`, which is invoked with the
+          :class:`pyopencl.Buffer` holding the chunk for the streamed
+          arguments and a global size equal to the number of entries in
+          the chunk.
+
+    :arg outputs: indices into *args* of the host arrays that *kernel* writes.
+        These are copied back to the host after each chunk, and are not
+        copied onto the device. (Not allowed with reductions.)
+    :arg allocator: used to allocate the device buffers.
+    :returns: for reductions, a zero-dimensional :class:`pyopencl.array.Array`
+        holding the result (the reduction's neutral element if the host
+        arrays are empty). Otherwise *None*. All commands have completed
+        upon return.
+
+    .. versionadded:: 2013.1
+    """
+    import numpy as np
+    from pyopencl.reduction import ReductionKernel
+    from pyopencl.elementwise import ElementwiseKernel
+
+    sched = CommandScheduler(queues)
+    queue = sched.compute_queue
+
+    outputs = frozenset(outputs)
+    is_reduction = isinstance(kernel, ReductionKernel)
+    if is_reduction and outputs:
+        raise ValueError("reductions may not have outputs")
+
+    streamed = [i for i, arg in enumerate(args) if isinstance(arg, np.ndarray)]
+    if not streamed:
+        raise ValueError("no host arrays passed")
+
+    for i in outputs:
+        if i not in streamed:
+            raise ValueError("output argument %d is not a host array" % i)
+
+    from pytools import single_valued
+    n = single_valued(len(args[i]) for i in streamed)
+
+    for i in streamed:
+        if not args[i].flags.c_contiguous:
+            raise ValueError("host arrays must be C-contiguous")
+
+    if is_reduction:
+        options = _normalize_options(kernel.options)
+
+    if n == 0:
+        if is_reduction:
+            result = cl_array.empty(queue, (), kernel.dtype_out,
+                    allocator=allocator)
+            fill_knl = _get_neutral_fill_kernel(queue.context,
+                    kernel.dtype_out, kernel.neutral, kernel.preamble, options)
+            fill_knl(result, queue=queue)
+            queue.finish()
+            return result
+        return
+
+    if allocator is None:
+        def allocator(nbytes):
+            return cl.Buffer(queue.context, cl.mem_flags.READ_WRITE, nbytes)
+
+    buffers = {}
+    for i in streamed:
+        row_nbytes = args[i].nbytes // _builtin_max(n, 1)
+        buffers[i] = [allocator(_builtin_max(chunk_size*row_nbytes, 1))
+                for j in range(buffer_count)]
+
+    passed_mem = [arg for arg in args if _is_mem(arg)]
+
+    chunk_count = (n + chunk_size - 1) // chunk_size
+    if is_reduction:
+        partials = cl_array.empty(queue, (chunk_count,), kernel.dtype_out,
+                allocator=allocator)
+        itemsize = kernel.dtype_out.itemsize
+
+    from collections import deque
+    in_flight = deque()
+
+    for chunk_nr in xrange(chunk_count):
+        start = chunk_nr*chunk_size
+        stop = _builtin_min(start+chunk_size, n)
+
+        # Bound the number of chunks in flight. The device-side ordering
+        # does not need this, but the host should not run ahead by more
+        # than the available buffers.
+        if len(in_flight) >= buffer_count:
+            in_flight.popleft().wait()
+
+        chunk_args = []
+        reads = list(passed_mem)
+        writes = []
+        for i, arg in enumerate(args):
+            if i in buffers:
+                dev_ary = cl_array.Array(queue, (stop-start,) + arg.shape[1:],
+                        arg.dtype, data=buffers[i][chunk_nr % buffer_count])
+
+                if i in outputs:
+                    writes.append(dev_ary)
+                else:
+                    sched.copy_to_device(dev_ary, arg[start:stop])
+                    reads.append(dev_ary)
+
+                chunk_args.append(dev_ary)
+            else:
+                chunk_args.append(arg)
+
+        if is_reduction:
+            result, evt = sched.reduction(kernel, *chunk_args)
+            evt = sched.copy(partials, result, byte_count=itemsize,
+                    dest_offset=chunk_nr*itemsize)
+
+        elif isinstance(kernel, ElementwiseKernel):
+            evt = sched.elementwise(kernel, *chunk_args,
+                    **dict(reads=reads, writes=writes + passed_mem))
+
+        else:
+            evt = sched.kernel(kernel, (stop-start,), None,
+                    *chunk_args,
+                    **dict(reads=reads, writes=writes + passed_mem))
+
+        for i in outputs:
+            evt = sched.copy_to_host(args[i][start:stop], chunk_args[i])
+
+        in_flight.append(evt)
+
+    sched.finish()
+
+    if is_reduction:
+        combine_knl = _get_partial_result_reduction_kernel(
+                queue.context, kernel.dtype_out, kernel.neutral,
+                kernel.reduce_expr, kernel.preamble, options)
+        return combine_knl(partials, queue=queue)
+
+# }}}
+
+# vim: foldmethod=marker
@@ -33,10 +33,13 @@ None of the original source code remains.
 
 
 
+import os
+import sys
 import pyopencl as cl
 from pyopencl.tools import (
         context_dependent_memoize,
         dtype_to_ctype)
+from pytools import memoize_method
 import numpy as np
 import pyopencl._mymako as mako
 
@@ -48,11 +51,19 @@ KERNEL = """//CL//
     #define READ_AND_MAP(i) (${map_expr})
     #define REDUCE(a, b) (${reduce_expr})
 
+    % if vector_width:
+        #define READ_AND_MAP_VECTOR(i) (${vector_map_expr})
+    % endif
+
     % if double_support:
         #pragma OPENCL EXTENSION cl_khr_fp64: enable
         #define PYOPENCL_DEFINE_CDOUBLE
     % endif
 
+    % if single_pass:
+        #pragma OPENCL EXTENSION cl_khr_global_int32_base_atomics: enable
+    % endif
+
     #include <pyopencl-complex.h>
 
     ${preamble}
@@ -61,8 +72,15 @@ KERNEL = """//CL//
 
     __kernel void ${name}(
       __global out_type *out, ${arguments},
-      unsigned int seq_count, unsigned int n)
+      unsigned int seq_count, unsigned int n
+      % if single_pass:
+        , __global out_type *pyopencl_partials
+        , __global unsigned int *pyopencl_group_counter
+      % endif
+      )
     {
+        ${arg_prep}
+
         __local out_type ldata[GROUP_SIZE];
 
         unsigned int lid = get_local_id(0);
@@ -70,14 +88,38 @@ KERNEL = """//CL//
         unsigned int i = get_group_id(0)*GROUP_SIZE*seq_count + lid;
 
         out_type acc = ${neutral};
-        for (unsigned s = 0; s < seq_count; ++s)
-        {
-          if (i >= n)
-            break;
-          acc = REDUCE(acc, READ_AND_MAP(i));
 
-          i += GROUP_SIZE;
-        }
+        % if vector_width:
+            ## i counts vectors of ${vector_width} entries here. The entries
+            ## past the last full vector are picked up by a scalar loop.
+
+            unsigned int vector_count = n / ${vector_width};
+            for (unsigned s = 0; s < seq_count; ++s)
+            {
+              if (i >= vector_count)
+                break;
+              ${vector_type} pyopencl_vec = READ_AND_MAP_VECTOR(
+                  i*${vector_width});
+              % for j in range(vector_width):
+                  acc = REDUCE(acc, pyopencl_vec.s${"%x" % j});
+              % endfor
+
+              i += GROUP_SIZE;
+            }
+
+            for (unsigned int j = vector_count*${vector_width}
+                + get_global_id(0); j < n; j += get_global_size(0))
+              acc = REDUCE(acc, READ_AND_MAP(j));
+        % else:
+            for (unsigned s = 0; s < seq_count; ++s)
+            {
+              if (i >= n)
+                break;
+              acc = REDUCE(acc, READ_AND_MAP(i));
+
+              i += GROUP_SIZE;
+            }
+        % endif
 
         ldata[lid] = acc;
 
@@ -130,7 +172,50 @@ KERNEL = """//CL//
             }
         % endif
 
-        if (lid == 0) out[get_group_id(0)] = ldata[0];
+        % if single_pass:
+            ## Each group stores its partial result. The group that finishes
+            ## last reduces all partial results and resets the counter for
+            ## the next launch.
+
+            __local int is_last_group;
+
+            if (lid == 0)
+            {
+                pyopencl_partials[get_group_id(0)] = ldata[0];
+                mem_fence(CLK_GLOBAL_MEM_FENCE);
+
+                unsigned int finished_count = atom_inc(pyopencl_group_counter);
+                is_last_group = (finished_count == get_num_groups(0) - 1);
+            }
+
+            barrier(CLK_LOCAL_MEM_FENCE);
+
+            if (is_last_group)
+            {
+                __global volatile out_type *partials = pyopencl_partials;
+
+                out_type acc = ${neutral};
+                for (unsigned j = lid; j < get_num_groups(0); j += GROUP_SIZE)
+                  acc = REDUCE(acc, partials[j]);
+
+                ldata[lid] = acc;
+
+                for (unsigned int s = GROUP_SIZE/2; s > 0; s >>= 1)
+                {
+                    barrier(CLK_LOCAL_MEM_FENCE);
+                    if (lid < s)
+                        ldata[lid] = REDUCE(ldata[lid], ldata[lid + s]);
+                }
+
+                if (lid == 0)
+                {
+                    out[0] = ldata[0];
+                    *pyopencl_group_counter = 0;
+                }
+            }
+        % else:
+            if (lid == 0) out[get_group_id(0)] = ldata[0];
+        % endif
     }
     """
 
@@ -141,7 +226,8 @@ def  _get_reduction_source(
          ctx, out_type, out_type_size,
          neutral, reduce_expr, map_expr, parsed_args,
          name="reduce_kernel", preamble="",
-         device=None, max_group_size=None):
+         device=None, max_group_size=None, single_pass=False,
+         vector_width=None):
 
     if device is not None:
         devices = [device]
@@ -188,14 +274,30 @@ def  _get_reduction_source(
 
     no_sync_size = min(get_dev_no_sync_size(dev) for dev in devices)
 
+    # The synchronization-less part of the kernel starts from
+    # 2*no_sync_size entries, which must not exceed the group size.
+    no_sync_size = max(1, min(no_sync_size, group_size // 2))
+
     # }}}
 
+    vector_map_expr = vector_type = None
+    if vector_width is not None:
+        from pyopencl.elementwise import (_get_vectorizable_dtype,
+                _get_vector_base_type, _vectorize_expression)
+        dtype = _get_vectorizable_dtype(parsed_args)
+        vector_type = "%s%d" % (_get_vector_base_type(dtype), vector_width)
+        vector_map_expr = _vectorize_expression(
+                map_expr, parsed_args, dtype, vector_width)
+        assert vector_map_expr is not None
+
     from mako.template import Template
     from pytools import all
     from pyopencl.characterize import has_double_support
+    from pyopencl.tools import get_arg_offset_adjuster_code
     src = str(Template(KERNEL).render(
         out_type=out_type,
         arguments=", ".join(arg.declarator() for arg in parsed_args),
+        arg_prep=get_arg_offset_adjuster_code(parsed_args),
         group_size=group_size,
         no_sync_size=no_sync_size,
         neutral=neutral,
@@ -204,6 +306,10 @@ def  _get_reduction_source(
         name=name,
         preamble=preamble,
         double_support=all(has_double_support(dev) for dev in devices),
+        single_pass=single_pass,
+        vector_width=vector_width,
+        vector_map_expr=vector_map_expr,
+        vector_type=vector_type,
         ))
 
     from pytools import Record
@@ -213,7 +319,176 @@ def  _get_reduction_source(
     return ReductionInfo(
             context=ctx,
             source=src,
-            group_size=group_size)
+            group_size=group_size,
+            vector_width=vector_width)
+
+
+
+
+# {{{ segmented (axis-wise) reduction
+
+SEGMENTED_KERNEL = """//CL//
+    #define GROUP_SIZE ${group_size}
+    #define READ_AND_MAP(i) (${map_expr})
+    #define REDUCE(a, b) (${reduce_expr})
+
+    % if double_support:
+        #pragma OPENCL EXTENSION cl_khr_fp64: enable
+        #define PYOPENCL_DEFINE_CDOUBLE
+    % endif
+
+    #include <pyopencl-complex.h>
+
+    ${preamble}
+
+    typedef ${out_type} out_type;
+
+    ${index_functions}
+
+    #define ROW_INDEX(j) pyopencl_reduction_row_index((j), ${row_layout_args})
+    #define ELEM_INDEX(j) pyopencl_reduction_elem_index((j), ${elem_layout_args})
+
+    __kernel void ${name}(
+      __global out_type *out, ${arguments},
+      long row_count, long row_length,
+      ${layout_arguments})
+    {
+        ${arg_prep}
+
+        % if per_item:
+            long row = get_global_id(0);
+            if (row >= row_count)
+                return;
+
+            long row_base = ROW_INDEX(row);
+
+            out_type acc = ${neutral};
+            for (long j = 0; j < row_length; ++j)
+            {
+                long i = row_base + ELEM_INDEX(j);
+                acc = REDUCE(acc, READ_AND_MAP(i));
+            }
+
+            out[row] = acc;
+        % else:
+            __local out_type ldata[GROUP_SIZE];
+
+            unsigned int lid = get_local_id(0);
+            long row = get_group_id(0);
+            long row_base = ROW_INDEX(row);
+
+            out_type acc = ${neutral};
+            for (long j = lid; j < row_length; j += GROUP_SIZE)
+            {
+                long i = row_base + ELEM_INDEX(j);
+                acc = REDUCE(acc, READ_AND_MAP(i));
+            }
+
+            ldata[lid] = acc;
+
+            for (unsigned int s = GROUP_SIZE/2; s > 0; s >>= 1)
+            {
+                barrier(CLK_LOCAL_MEM_FENCE);
+                if (lid < s)
+                    ldata[lid] = REDUCE(ldata[lid], ldata[lid + s]);
+            }
+
+            if (lid == 0)
+                out[row] = ldata[0];
+        % endif
+    }
+    """
+
+# Rows shorter than this are reduced by a single work item each.
+SEGMENTED_PER_ITEM_MAX_ROW_LENGTH = 32
+
+
+
+
+def get_segmented_reduction_kernel(ctx, out_type, neutral, reduce_expr,
+        map_expr, arguments, row_ndim, elem_ndim, per_item, group_size,
+        name="reduce_kernel", preamble="", options=[]):
+    """Return a kernel that reduces each row of a matrix of array entries,
+    where the rows run over *row_ndim* array axes and the entries of a row
+    over *elem_ndim* others. The shapes and then the strides (in units of
+    the item size) of the row axes, followed by those of the entry axes,
+    are passed after the row count and length. With *per_item*, each row
+    is reduced by a single work item, otherwise by a work group of
+    *group_size*.
+    """
+    if map_expr is None:
+        map_expr = "in[i]"
+
+    from pyopencl.tools import (parse_arg_list, get_arg_list_scalar_arg_dtypes,
+            get_arg_offset_adjuster_code)
+    parsed_args = parse_arg_list(arguments, with_offset=True)
+
+    from pyopencl.elementwise import _get_generic_strided_index_function
+    index_functions = "\n\n".join([
+        _get_generic_strided_index_function(
+            "pyopencl_reduction_row_index", row_ndim),
+        _get_generic_strided_index_function(
+            "pyopencl_reduction_elem_index", elem_ndim),
+        ])
+
+    def get_layout_arg_names(prefix, ndim):
+        return (["%s_shape%d" % (prefix, i) for i in range(ndim)]
+                + ["%s_stride%d" % (prefix, i) for i in range(ndim)])
+
+    row_layout_args = get_layout_arg_names("pyopencl_row", row_ndim)
+    elem_layout_args = get_layout_arg_names("pyopencl_elem", elem_ndim)
+
+    from mako.template import Template
+    from pytools import all
+    from pyopencl.characterize import has_double_support
+    src = str(Template(SEGMENTED_KERNEL).render(
+        out_type=out_type,
+        arguments=", ".join(arg.declarator() for arg in parsed_args),
+        arg_prep=get_arg_offset_adjuster_code(parsed_args),
+        index_functions=index_functions,
+        row_layout_args=", ".join(row_layout_args),
+        elem_layout_args=", ".join(elem_layout_args),
+        layout_arguments=", ".join(
+            "long %s" % arg_name
+            for arg_name in row_layout_args + elem_layout_args),
+        group_size=group_size,
+        per_item=per_item,
+        neutral=neutral,
+        reduce_expr=reduce_expr,
+        map_expr=map_expr,
+        name=name,
+        preamble=preamble,
+        double_support=all(has_double_support(dev) for dev in ctx.devices),
+        ))
+
+    prg = cl.Program(ctx, src).build(options)
+    knl = getattr(prg, name)
+    knl.set_scalar_arg_dtypes(
+            [None]
+            + get_arg_list_scalar_arg_dtypes(parsed_args)
+            + [np.int64]*(2 + 2*(row_ndim + elem_ndim)))
+
+    return knl, parsed_args
+
+
+def _normalize_axes(axis, ndim):
+    if isinstance(axis, (int, long, np.integer)):
+        axis = (axis,)
+
+    result = []
+    for ax in axis:
+        if ax < 0:
+            ax += ndim
+        if not 0 <= ax < ndim:
+            raise ValueError("axis %d out of range" % ax)
+        result.append(ax)
+
+    if len(set(result)) != len(result):
+        raise ValueError("repeated axis in reduction")
+
+    return tuple(sorted(result))
+
+# }}}
 
 
 
@@ -222,7 +497,17 @@ def get_reduction_kernel(stage,
          ctx, out_type, out_type_size,
          neutral, reduce_expr, map_expr=None, arguments=None,
          name="reduce_kernel", preamble="",
-         device=None, options=[], max_group_size=None):
+         device=None, options=[], max_group_size=None, single_pass=False,
+         vector_width=None):
+    """With *single_pass*, the stage 1 kernel takes two more arguments,
+    a buffer for one partial result per work group and a zero-initialized
+    *unsigned int* counter, and stores the full result in its first
+    argument by itself.
+
+    With *vector_width*, the kernel reads that many entries at a time
+    (see :meth:`ReductionKernel._get_vector_width`), and its launch
+    geometry is that of a reduction of *n // vector_width* entries.
+    """
     if map_expr is None:
         if stage == 2:
             map_expr = "pyopencl_reduction_inp[i]"
@@ -237,12 +522,13 @@ def get_reduction_kernel(stage,
             arguments = in_arg
 
     from pyopencl.tools import parse_arg_list, get_arg_list_scalar_arg_dtypes
-    parsed_args = parse_arg_list(arguments)
+    parsed_args = parse_arg_list(arguments, with_offset=True)
 
     inf = _get_reduction_source(
             ctx, out_type, out_type_size,
             neutral, reduce_expr, map_expr, parsed_args,
-            name, preamble, device, max_group_size)
+            name, preamble, device, max_group_size, single_pass,
+            vector_width)
 
     inf.program = cl.Program(ctx, inf.source)
     inf.program.build(options)
@@ -253,20 +539,296 @@ def get_reduction_kernel(stage,
     inf.kernel.set_scalar_arg_dtypes(
             [None]
             + get_arg_list_scalar_arg_dtypes(inf.arg_types)
-            + [np.uint32]*2)
+            + [np.uint32]*2
+            + [None]*2*single_pass)
 
     return inf
 
 
 
 
+# {{{ launch geometry
+
+DEFAULT_MAX_GROUP_COUNT = 1024
+DEFAULT_SMALL_SEQ_COUNT = 4
+
+def _get_reduction_geometry(group_size, sz,
+        max_group_count=DEFAULT_MAX_GROUP_COUNT,
+        small_seq_count=DEFAULT_SMALL_SEQ_COUNT):
+    """Return a tuple *(group_count, seq_count)* for a reduction stage
+    of *sz* entries with work groups of *group_size*. Each work item
+    reduces *small_seq_count* entries until *max_group_count* groups
+    are reached, and more beyond that.
+    """
+    if sz <= group_size*small_seq_count*max_group_count:
+        total_group_size = small_seq_count*group_size
+        group_count = (sz + total_group_size - 1) // total_group_size
+        seq_count = small_seq_count
+    else:
+        group_count = max_group_count
+        macrogroup_size = group_count*group_size
+        seq_count = (sz + macrogroup_size - 1) // macrogroup_size
+
+    return group_count, seq_count
+
+# }}}
+
+# {{{ single-pass reduction
+
+# Reductions of up to this many work groups are done in a single launch,
+# in which the work group that finishes last combines the partial results
+# of all groups. Larger reductions are bound by memory bandwidth rather
+# than by launch latency and use two stages.
+SINGLE_PASS_MAX_GROUP_COUNT = 256
+
+def _get_single_pass_scratch(queue, nbytes):
+    """Return a tuple *(partials, counter)* of buffers for single-pass
+    reductions on *queue*, with *partials* holding at least *nbytes*.
+
+    Kernels on an in-order queue do not run concurrently and the counter
+    is reset by each launch, so all reductions on *queue* share these.
+    """
+    try:
+        partials, counter = queue._pyopencl_reduction_scratch
+    except AttributeError:
+        partials = None
+        counter = cl.Buffer(queue.context,
+                cl.mem_flags.READ_WRITE | cl.mem_flags.COPY_HOST_PTR,
+                hostbuf=np.zeros(1, np.uint32))
+
+    if partials is None or partials.size < nbytes:
+        partials = cl.Buffer(queue.context, cl.mem_flags.READ_WRITE, nbytes)
+        queue._pyopencl_reduction_scratch = (partials, counter)
+
+    return partials, counter
+
+
+def _is_in_order_queue(queue):
+    try:
+        return queue._pyopencl_in_order
+    except AttributeError:
+        result = queue._pyopencl_in_order = not (queue.properties
+                & cl.command_queue_properties.OUT_OF_ORDER_EXEC_MODE_ENABLE)
+        return result
+
+# }}}
+
+# {{{ autotuning
+
+# Tuned launch parameters are kept in a JSON file in the compiler cache
+# directory. It maps a key made from the device, the reduction dtype and
+# a hash of the kernel's source (see ReductionKernel._get_tuning_id) to
+# a list of entries [log2(size), group_size, max_group_count,
+# small_seq_count], and reductions use the entry closest to their size.
+
+REDUCTION_TUNING_FILE_NAME = "reduction-tuning.json"
+REDUCTION_TUNING_VERSION = 2
+
+DEFAULT_TUNING_SIZES = [2**10, 2**14, 2**18, 2**22]
+
+_reduction_tuning_table = None
+_device_reduction_tuning = {}
+
+def get_reduction_tuning_file():
+    from os.path import join
+    from pyopencl.cache import get_default_cache_dir
+    return join(get_default_cache_dir(), REDUCTION_TUNING_FILE_NAME)
+
+
+def _get_reduction_tuning_key(device, dtype, kernel_id):
+    from pyopencl.cache import get_device_cache_id, new_hash, update_checksum
+    checksum = new_hash()
+    update_checksum(checksum, repr(get_device_cache_id(device)))
+    return "%s %s %s" % (checksum.hexdigest(), dtype.str, kernel_id)
+
+
+def _read_reduction_tuning_table(path):
+    import json
+
+    try:
+        inf = open(path, "r")
+    except IOError:
+        return {}
+
+    try:
+        try:
+            table = json.load(inf)
+        except ValueError:
+            # damaged file, start over
+            return {}
+    finally:
+        inf.close()
+
+    if (not isinstance(table, dict)
+            or table.get("version") != REDUCTION_TUNING_VERSION):
+        return {}
+
+    return table["entries"]
+
+
+def _get_reduction_tuning(queue, dtype, kernel_id, sz):
+    """Return a tuple *(group_size, max_group_count, small_seq_count)*
+    tuned for reductions of *sz* entries of *dtype* with the kernel
+    identified by *kernel_id* on *queue*, or *None*.
+    """
+    from pyopencl.array import _get_queue_device
+    dev = _get_queue_device(queue)
+
+    try:
+        entries = _device_reduction_tuning[dev, dtype, kernel_id]
+    except KeyError:
+        global _reduction_tuning_table
+        if _reduction_tuning_table is None:
+            _reduction_tuning_table = _read_reduction_tuning_table(
+                    get_reduction_tuning_file())
+
+        entries = _device_reduction_tuning[dev, dtype, kernel_id] = [
+                (entry[0], tuple(entry[1:]))
+                for entry in _reduction_tuning_table.get(
+                    _get_reduction_tuning_key(dev, dtype, kernel_id), [])]
+
+    if not entries:
+        return None
+
+    from pyopencl.tools import bitlog2
+    size_log2 = bitlog2(max(sz, 1))
+    return min(entries, key=lambda entry: abs(entry[0] - size_log2))[1]
+
+
+def _store_reduction_tuning(device, dtype, kernel_id, tuned):
+    import json
+    from pyopencl.tools import bitlog2
+    from pyopencl.cache import _write_atomically, _unlink_quietly
+
+    path = get_reduction_tuning_file()
+
+    from os.path import dirname
+    try:
+        os.mkdir(dirname(path))
+    except OSError, e:
+        from errno import EEXIST
+        if e.errno != EEXIST:
+            raise
+
+    # merge with what other processes may have stored in the meantime
+    table = _read_reduction_tuning_table(path)
+
+    key = _get_reduction_tuning_key(device, dtype, kernel_id)
+    entries = dict((entry[0], entry) for entry in table.get(key, []))
+    for size, params in tuned.iteritems():
+        size_log2 = bitlog2(size)
+        entries[size_log2] = [size_log2] + list(params)
+    table[key] = sorted(entries.itervalues())
+
+    if sys.platform == "win32":
+        # Windows cannot rename onto an existing file.
+        _unlink_quietly(path)
+
+    _write_atomically(path, json.dumps(
+        {"version": REDUCTION_TUNING_VERSION, "entries": table})
+        .encode("utf-8"))
+
+    global _reduction_tuning_table
+    _reduction_tuning_table = table
+    _device_reduction_tuning.clear()
+
+
+def _get_tuning_candidates(device, max_group_size):
+    if device.type & cl.device_type.CPU:
+        min_group_size = 1
+    else:
+        min_group_size = max(1, max_group_size // 8)
+
+    group_sizes = []
+    group_size = max_group_size
+    while group_size >= min_group_size:
+        group_sizes.append(group_size)
+        group_size //= 2
+
+    compute_units = device.max_compute_units
+    group_counts = sorted(set([compute_units, 4*compute_units,
+        16*compute_units, DEFAULT_MAX_GROUP_COUNT]))
+
+    return [(group_size, group_count, seq_count)
+            for group_size in group_sizes
+            for group_count in group_counts
+            for seq_count in [1, 4, 16, 64]]
+
+
+def autotune_reduction(queue, dtype, sizes=None, nruns=3, kernel=None):
+    """Benchmark launch parameters for *kernel* on the device of *queue*,
+    for inputs of each of *sizes* entries of *dtype*, and store the fastest
+    ones in the compiler cache directory. From then on, all instances of
+    :class:`ReductionKernel` generating the same code as *kernel* use them,
+    choosing those tuned for the size closest to that of their input.
+
+    :arg kernel: a :class:`ReductionKernel` taking a single vector of
+        *dtype* as its argument. Defaults to the kernel used by
+        :func:`pyopencl.array.sum` for *dtype*.
+
+    Return a :class:`dict` mapping each size to the chosen tuple
+    *(group_size, max_group_count, small_seq_count)*.
+    """
+    dtype = np.dtype(dtype)
+    if sizes is None:
+        sizes = DEFAULT_TUNING_SIZES
+
+    if kernel is None:
+        kernel = get_sum_kernel(queue.context, dtype, dtype)
+    krnl = kernel
+
+    candidates = _get_tuning_candidates(
+            queue.device, krnl.stage_1_inf.group_size)
+
+    from time import time
+    from pyopencl.array import zeros
+
+    tuned = {}
+    for size in sizes:
+        ary = zeros(queue, size, dtype)
+
+        best_time = None
+        for params in candidates:
+            # also builds the kernels
+            krnl(ary, queue=queue, tuning=params)
+            queue.finish()
+
+            start_time = time()
+            for i in xrange(nruns):
+                krnl(ary, queue=queue, tuning=params)
+            queue.finish()
+            elapsed = time() - start_time
+
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+                tuned[size] = params
+
+    _store_reduction_tuning(queue.device, krnl.dtype_out,
+            krnl._get_tuning_id(), tuned)
+    return tuned
+
+# }}}
+
+
+
+
 class ReductionKernel:
     def __init__(self, ctx, dtype_out,
             neutral, reduce_expr, map_expr=None, arguments=None,
-            name="reduce_kernel", options=[], preamble=""):
+            name="reduce_kernel", options=[], preamble="", vectorize=True):
 
         dtype_out = self.dtype_out = np.dtype(dtype_out)
 
+        self.context = ctx
+        self.neutral = neutral
+        self.reduce_expr = reduce_expr
+        self.map_expr = map_expr
+        self.arguments = arguments
+        self.name = name
+        self.options = options
+        self.preamble = preamble
+        self.vectorize = vectorize
+
         max_group_size = None
         trip_count = 0
 
@@ -295,6 +857,9 @@ class ReductionKernel:
                 name=name+"_stage2", options=options, preamble=preamble,
                 max_group_size=max_group_size)
 
+        self.stage_1_inf.stage = 1
+        self.stage_2_inf.stage = 2
+
         from pytools import any
         from pyopencl.tools import VectorArg
         assert any(
@@ -304,18 +869,30 @@ class ReductionKernel:
                 "vector argument"
 
     def __call__(self, *args, **kwargs):
-        MAX_GROUP_COUNT = 1024
-        SMALL_SEQ_COUNT = 4
-
         from pyopencl.array import empty
 
         stage_inf = self.stage_1_inf
 
         queue = kwargs.pop("queue", None)
+        wait_for = kwargs.pop("wait_for", None)
+        return_event = kwargs.pop("return_event", False)
+        axis = kwargs.pop("axis", None)
+        tuning = kwargs.pop("tuning", None)
 
         if kwargs:
             raise TypeError("invalid keyword argument to reduction kernel")
 
+        from pyopencl.array import _get_array_events, _add_array_event
+        wait_for = _get_array_events(args, wait_for)
+
+        if axis is not None:
+            result = self._reduce_along_axes(args, axis, queue, wait_for)
+            if result is not None:
+                if return_event:
+                    return result
+                else:
+                    return result[0]
+
         stage1_args = args
 
         while True:
@@ -330,7 +907,11 @@ class ReductionKernel:
                                 "deal with non-contiguous arrays")
 
                     vectors.append(arg)
-                    invocation_args.append(arg.data)
+                    if arg_tp.with_offset:
+                        invocation_args.append(arg.base_data)
+                        invocation_args.append(arg.offset)
+                    else:
+                        invocation_args.append(arg.data)
                 else:
                     invocation_args.append(arg)
 
@@ -342,14 +923,49 @@ class ReductionKernel:
             else:
                 use_queue = repr_vec.queue
 
-            if sz <= stage_inf.group_size*SMALL_SEQ_COUNT*MAX_GROUP_COUNT:
-                total_group_size = SMALL_SEQ_COUNT*stage_inf.group_size
-                group_count = (sz + total_group_size - 1) // total_group_size
-                seq_count = SMALL_SEQ_COUNT
-            else:
-                group_count = MAX_GROUP_COUNT
-                macrogroup_size = group_count*stage_inf.group_size
-                seq_count = (sz + macrogroup_size - 1) // macrogroup_size
+            geometry_limits = ()
+            if stage_inf is self.stage_1_inf:
+                group_size = stage_inf.group_size
+
+                if tuning is None:
+                    tuning = _get_reduction_tuning(
+                            use_queue, self.dtype_out, self._get_tuning_id(),
+                            sz)
+
+                if tuning is not None:
+                    group_size = tuning[0]
+                    geometry_limits = tuning[1:]
+
+                from pyopencl.elementwise import _can_load_vectors
+                vector_width = self._get_vector_width()
+                if (vector_width is not None
+                        and not _can_load_vectors(vectors, sz, vector_width)):
+                    vector_width = None
+
+                if tuning is not None or vector_width is not None:
+                    stage_inf = self._get_stage_1_inf(
+                            group_size, vector_width)
+
+            stage_sz = sz
+            if stage_inf.vector_width is not None:
+                stage_sz = sz // stage_inf.vector_width
+
+            group_count, seq_count = _get_reduction_geometry(
+                    stage_inf.group_size, stage_sz, *geometry_limits)
+
+            if (stage_inf.stage == 1
+                    and 1 < group_count <= SINGLE_PASS_MAX_GROUP_COUNT
+                    and _is_in_order_queue(use_queue)):
+                single_pass_inf = self._get_single_pass_inf(
+                        stage_inf.group_size, stage_inf.vector_width)
+                if single_pass_inf is not None:
+                    result, last_evt = self._call_single_pass(
+                            single_pass_inf, use_queue, repr_vec, vectors,
+                            invocation_args, wait_for, geometry_limits)
+                    if return_event:
+                        return result, last_evt
+                    else:
+                        return result
 
             if group_count == 1:
                 result = empty(use_queue,
@@ -360,18 +976,619 @@ class ReductionKernel:
                         (group_count,), self.dtype_out,
                         allocator=repr_vec.allocator)
 
-            stage_inf.kernel(
+            last_evt = stage_inf.kernel(
                     use_queue,
                     (group_count*stage_inf.group_size,),
                     (stage_inf.group_size,),
-                    *([result.data]+invocation_args+[seq_count, sz]))
+                    *([result.data]+invocation_args+[seq_count, sz]),
+                    **dict(wait_for=wait_for))
+            wait_for = [last_evt]
+
+            # record the read with every input, so that later writes
+            # to them wait for it
+            _add_array_event([result] + vectors, last_evt)
 
             if group_count == 1:
-                return result
+                if return_event:
+                    return result, last_evt
+                else:
+                    return result
             else:
                 stage_inf = self.stage_2_inf
                 args = (result,) + stage1_args
 
+    @memoize_method
+    def _get_tuning_id(self):
+        """Return a hash of the generated code, under which parameters
+        found by :func:`autotune_reduction` for this kernel are stored.
+        """
+        from pyopencl.cache import new_hash, update_checksum
+        checksum = new_hash()
+        update_checksum(checksum, self.stage_1_inf.source)
+        update_checksum(checksum, repr(self.options))
+        return checksum.hexdigest()
+
+    @memoize_method
+    def _get_vector_width(self):
+        """Return the number of entries the stage 1 kernel may read at a
+        time with vector loads, or *None* if its map expression does not
+        permit that.
+        """
+        if not self.vectorize or self.dtype_out.kind == "c":
+            return None
+
+        from pyopencl.elementwise import (VECTOR_LOAD_BYTES,
+                _get_vectorizable_dtype, _vectorize_expression)
+
+        parsed_args = self.stage_1_inf.arg_types
+        dtype = _get_vectorizable_dtype(parsed_args)
+        if dtype is None:
+            return None
+
+        map_expr = self.map_expr
+        if map_expr is None:
+            map_expr = "in[i]"
+
+        width = VECTOR_LOAD_BYTES // dtype.itemsize
+        if _vectorize_expression(map_expr, parsed_args, dtype, width) is None:
+            return None
+
+        return width
+
+    @memoize_method
+    def _get_stage_1_inf(self, group_size, vector_width=None):
+        """Return the kernel info of stage 1 for work groups of at most
+        *group_size*, reading *vector_width* entries at a time if given.
+        """
+        if vector_width is None and group_size >= self.stage_1_inf.group_size:
+            return self.stage_1_inf
+
+        while True:
+            inf = get_reduction_kernel(1, self.context,
+                    dtype_to_ctype(self.dtype_out), self.dtype_out.itemsize,
+                    self.neutral, self.reduce_expr, self.map_expr,
+                    self.arguments, name=self.name+"_stage1",
+                    options=self.options, preamble=self.preamble,
+                    max_group_size=group_size, vector_width=vector_width)
+
+            kernel_max_wg_size = min(
+                    inf.kernel.get_work_group_info(
+                        cl.kernel_work_group_info.WORK_GROUP_SIZE, dev)
+                    for dev in self.context.devices)
+
+            if inf.group_size <= kernel_max_wg_size:
+                break
+
+            from pyopencl.tools import bitlog2
+            group_size = 2**bitlog2(kernel_max_wg_size)
+
+        inf.stage = 1
+        return inf
+
+    @memoize_method
+    def _get_single_pass_inf(self, max_group_size, vector_width=None):
+        """Return the kernel info of a single-pass variant of stage 1 for
+        work groups of at most *max_group_size*, reading *vector_width*
+        entries at a time if given, or *None* if a device in the context
+        cannot run it.
+        """
+        from pytools import all
+        from pyopencl.characterize import has_global_int32_atomics
+        if not all(has_global_int32_atomics(dev)
+                for dev in self.context.devices):
+            return None
+
+        while True:
+            inf = get_reduction_kernel(1, self.context,
+                    dtype_to_ctype(self.dtype_out), self.dtype_out.itemsize,
+                    self.neutral, self.reduce_expr, self.map_expr,
+                    self.arguments, name=self.name+"_single_pass",
+                    options=self.options, preamble=self.preamble,
+                    max_group_size=max_group_size, single_pass=True,
+                    vector_width=vector_width)
+
+            kernel_max_wg_size = min(
+                    inf.kernel.get_work_group_info(
+                        cl.kernel_work_group_info.WORK_GROUP_SIZE, dev)
+                    for dev in self.context.devices)
+
+            if inf.group_size <= kernel_max_wg_size:
+                return inf
+
+            from pyopencl.tools import bitlog2
+            max_group_size = 2**bitlog2(kernel_max_wg_size)
+
+    def _call_single_pass(self, stage_inf, queue, repr_vec, vectors,
+            invocation_args, wait_for, geometry_limits=()):
+        from pyopencl.array import empty, _add_array_event
+
+        sz = repr_vec.size
+
+        stage_sz = sz
+        if stage_inf.vector_width is not None:
+            stage_sz = sz // stage_inf.vector_width
+
+        group_count, seq_count = _get_reduction_geometry(
+                stage_inf.group_size, stage_sz, *geometry_limits)
+
+        result = empty(queue, (), self.dtype_out,
+                allocator=repr_vec.allocator)
+        partials, counter = _get_single_pass_scratch(queue,
+                max(group_count, SINGLE_PASS_MAX_GROUP_COUNT)
+                * self.dtype_out.itemsize)
+
+        evt = stage_inf.kernel(
+                queue,
+                (group_count*stage_inf.group_size,),
+                (stage_inf.group_size,),
+                *([result.data] + invocation_args
+                    + [seq_count, sz, partials, counter]),
+                **dict(wait_for=wait_for))
+        _add_array_event([result] + vectors, evt)
+
+        return result, evt
+
+    @memoize_method
+    def _get_segmented_kernel(self, row_ndim, elem_ndim, per_item):
+        group_size = self.stage_1_inf.group_size
+
+        while True:
+            knl, arg_types = get_segmented_reduction_kernel(self.context,
+                    dtype_to_ctype(self.dtype_out), self.neutral,
+                    self.reduce_expr, self.map_expr, self.arguments,
+                    row_ndim, elem_ndim, per_item, group_size,
+                    name=self.name+"_segmented", preamble=self.preamble,
+                    options=self.options)
+
+            if per_item:
+                return knl, arg_types, group_size
+
+            kernel_max_wg_size = min(
+                    knl.get_work_group_info(
+                        cl.kernel_work_group_info.WORK_GROUP_SIZE, dev)
+                    for dev in self.context.devices)
+
+            if group_size <= kernel_max_wg_size:
+                return knl, arg_types, group_size
+
+            from pyopencl.tools import bitlog2
+            group_size = 2**bitlog2(kernel_max_wg_size)
+
+    def _reduce_along_axes(self, args, axis, queue, wait_for):
+        """Reduce the vector arguments along the axes in *axis*, which
+        must be the same for all of them. Return a tuple
+        *(result, event)*, or *None* if all axes are reduced.
+        """
+        from pyopencl.tools import VectorArg
+        vectors = [arg for arg, arg_tp in zip(args, self.stage_1_inf.arg_types)
+                if isinstance(arg_tp, VectorArg)]
+        repr_vec = vectors[0]
+
+        for vec in vectors[1:]:
+            if vec.shape != repr_vec.shape or vec.strides != repr_vec.strides:
+                raise ValueError("all vector arguments of a reduction along "
+                        "an axis must have the same shape and strides")
+
+        axes = _normalize_axes(axis, len(repr_vec.shape))
+        kept_axes = [ax for ax in range(len(repr_vec.shape)) if ax not in axes]
+        if not kept_axes:
+            return None
+
+        itemsize = repr_vec.dtype.itemsize
+        for stride in repr_vec.strides:
+            if stride % itemsize:
+                raise ValueError("strides must be a multiple of the item size")
+
+        def get_layout(axes):
+            return (
+                    tuple(repr_vec.shape[ax] for ax in axes),
+                    tuple(repr_vec.strides[ax] // itemsize for ax in axes))
+
+        row_layout = get_layout(kept_axes)
+        elem_layout = get_layout(axes)
+
+        from pytools import product
+        row_count = product(row_layout[0])
+        row_length = product(elem_layout[0])
+
+        per_item = row_length < SEGMENTED_PER_ITEM_MAX_ROW_LENGTH
+        knl, arg_types, group_size = self._get_segmented_kernel(
+                len(kept_axes), len(axes), per_item)
+
+        if queue is None:
+            queue = repr_vec.queue
+
+        from pyopencl.array import empty, _add_array_event
+        result = empty(queue, row_layout[0], self.dtype_out,
+                allocator=repr_vec.allocator)
+
+        if not row_count:
+            return result, None
+
+        from pyopencl.tools import get_arg_invocation_values
+        invocation_args = get_arg_invocation_values(arg_types, args)
+
+        if per_item:
+            from pyopencl.array import splay
+            gs, ls = splay(queue, row_count)
+        else:
+            gs, ls = (row_count*group_size,), (group_size,)
+
+        evt = knl(queue, gs, ls,
+                *([result.data] + invocation_args + [row_count, row_length]
+                    + list(row_layout[0]) + list(row_layout[1])
+                    + list(elem_layout[0]) + list(elem_layout[1])),
+                **dict(wait_for=wait_for))
+        _add_array_event([result] + vectors, evt)
+
+        return result, evt
+
+
+
+
+# {{{ multi-output reduction
+
+@context_dependent_memoize
+def _get_multi_reduction_dtype(context, fields):
+    """Return a tuple *(dtype, c_name, c_decl)* for a struct with the
+    *(name, dtype)* pairs in *fields* as its members. If a struct of the
+    same layout is registered already, its name is used, and *c_decl*
+    declares it under that name.
+    """
+    dtype = np.dtype([(field_name, np.dtype(field_dtype))
+        for field_name, field_dtype in fields])
+
+    # Structs with equal layout must get the same name, since the type
+    # registry maps each dtype to one C name.
+    from pyopencl.cache import new_hash, update_checksum
+    checksum = new_hash()
+    update_checksum(checksum, repr(dtype.descr))
+    name = "pyopencl_multi_reduce_%s" % checksum.hexdigest()[:16]
+
+    from pyopencl.tools import (match_dtype_to_c_struct, get_or_register_dtype,
+            dtype_to_c_struct)
+    device = context.devices[0]
+    dtype, c_decl = match_dtype_to_c_struct(device, name, dtype)
+
+    try:
+        c_name = dtype_to_ctype(dtype)
+    except ValueError:
+        dtype = get_or_register_dtype(name, dtype)
+        c_name = name
+
+    if c_name != name:
+        c_decl = dtype_to_c_struct(device, dtype)
+
+    return dtype, c_name, c_decl
+
+
+MULTI_REDUCTION_PREAMBLE = """//CL//
+    ${c_decl}
+
+    ${out_type} ${name}_neutral()
+    {
+        ${out_type} result;
+        % for field_name, field_ctype, neutral, reduce_expr in fields:
+            result.${field_name} = ${neutral};
+        % endfor
+        return result;
+    }
+
+    ${out_type} ${name}_reduce(${out_type} pyopencl_a, ${out_type} pyopencl_b)
+    {
+        ${out_type} result;
+        % for field_name, field_ctype, neutral, reduce_expr in fields:
+        {
+            ${field_ctype} a = pyopencl_a.${field_name};
+            ${field_ctype} b = pyopencl_b.${field_name};
+            result.${field_name} = ${reduce_expr};
+        }
+        % endfor
+        return result;
+    }
+
+    ${out_type} ${name}_make(${make_args})
+    {
+        ${out_type} result;
+        % for i, field in enumerate(fields):
+            result.${field[0]} = pyopencl_value_${i};
+        % endfor
+        return result;
+    }
+    """
+
+
+class MultiReductionKernel:
+    """Computes several reductions of the same arguments in one pass over
+    the data. *reductions* is a sequence of tuples
+    *(name, dtype, neutral, reduce_expr, map_expr)*, each describing one
+    reduction in the same way as the arguments of :class:`ReductionKernel`.
+    The results are gathered in a struct with one field per reduction.
+    """
+
+    def __init__(self, ctx, reductions, arguments,
+            name="multi_reduce_kernel", options=[], preamble=""):
+        reductions = list(reductions)
+        if not reductions:
+            raise ValueError("need at least one reduction")
+
+        field_names = [red[0] for red in reductions]
+        if len(set(field_names)) != len(field_names):
+            raise ValueError("repeated reduction name")
+
+        dtype_out, out_type, c_decl = _get_multi_reduction_dtype(
+                ctx, tuple(
+                    (field_name, np.dtype(field_dtype))
+                    for field_name, field_dtype, _, _, _ in reductions))
+
+        self.context = ctx
+        self.dtype_out = dtype_out
+        self.field_names = field_names
+
+        fields = [
+                (field_name, dtype_to_ctype(field_dtype), neutral, reduce_expr)
+                for field_name, field_dtype, neutral, reduce_expr, _
+                in reductions]
+
+        from mako.template import Template
+        preamble = preamble + str(Template(MULTI_REDUCTION_PREAMBLE).render(
+            c_decl=c_decl,
+            out_type=out_type,
+            name=name,
+            fields=fields,
+            make_args=", ".join(
+                "%s pyopencl_value_%d" % (field_ctype, i)
+                for i, (_, field_ctype, _, _) in enumerate(fields))))
+
+        self.kernel = ReductionKernel(ctx, dtype_out,
+                neutral="%s_neutral()" % name,
+                reduce_expr="%s_reduce(a, b)" % name,
+                map_expr="%s_make(%s)" % (name, ", ".join(
+                    "(%s)" % map_expr for _, _, _, _, map_expr in reductions)),
+                arguments=arguments, name=name, options=options,
+                preamble=preamble)
+
+    def __call__(self, *args, **kwargs):
+        """Take the same arguments as :meth:`ReductionKernel.__call__`.
+        Return a zero-dimensional :class:`pyopencl.array.Array` of
+        :attr:`dtype_out`, whose fields hold the results of the
+        reductions.
+        """
+        return self.kernel(*args, **kwargs)
+
+# }}}
+
+# {{{ reduction of contiguous segments
+
+SEGMENT_STARTS_KERNEL = """//CL//
+    #define GROUP_SIZE ${group_size}
+    #define READ_AND_MAP(i) (${map_expr})
+    #define REDUCE(a, b) (${reduce_expr})
+
+    % if double_support:
+        #pragma OPENCL EXTENSION cl_khr_fp64: enable
+        #define PYOPENCL_DEFINE_CDOUBLE
+    % endif
+
+    #include <pyopencl-complex.h>
+
+    ${preamble}
+
+    typedef ${out_type} out_type;
+    typedef ${index_type} index_type;
+
+    __kernel void ${name}(
+      __global out_type *out, ${arguments},
+      long segment_count)
+    {
+        ${arg_prep}
+
+        % if per_item:
+            long segment = get_global_id(0);
+            if (segment >= segment_count)
+                return;
+
+            index_type segment_end = segment_starts[segment+1];
+
+            out_type acc = ${neutral};
+            for (index_type i = segment_starts[segment]; i < segment_end; ++i)
+                acc = REDUCE(acc, READ_AND_MAP(i));
+
+            out[segment] = acc;
+        % else:
+            __local out_type ldata[GROUP_SIZE];
+
+            unsigned int lid = get_local_id(0);
+            long segment = get_group_id(0);
+
+            index_type segment_end = segment_starts[segment+1];
+
+            out_type acc = ${neutral};
+            for (index_type i = segment_starts[segment] + lid; i < segment_end;
+                    i += GROUP_SIZE)
+                acc = REDUCE(acc, READ_AND_MAP(i));
+
+            ldata[lid] = acc;
+
+            for (unsigned int s = GROUP_SIZE/2; s > 0; s >>= 1)
+            {
+                barrier(CLK_LOCAL_MEM_FENCE);
+                if (lid < s)
+                    ldata[lid] = REDUCE(ldata[lid], ldata[lid + s]);
+            }
+
+            if (lid == 0)
+                out[segment] = ldata[0];
+        % endif
+    }
+    """
+
+
+class SegmentedReductionKernel:
+    """Reduces each of a number of contiguous segments of its vector
+    arguments, as described by an array *starts* of segment boundaries,
+    such as the one returned by :class:`pyopencl.algorithm.KeyValueSorter`
+    or found in the :class:`pyopencl.algorithm.BuiltList` instances
+    returned by :class:`pyopencl.algorithm.ListOfListsBuilder`.
+
+    The arguments other than *starts* have the same meaning as for
+    :class:`ReductionKernel`.
+    """
+
+    def __init__(self, ctx, dtype_out,
+            neutral, reduce_expr, map_expr=None, arguments=None,
+            name="segmented_reduce_kernel", options=[], preamble=""):
+        self.context = ctx
+        self.dtype_out = np.dtype(dtype_out)
+        self.neutral = neutral
+        self.reduce_expr = reduce_expr
+
+        if map_expr is None:
+            map_expr = "in[i]"
+        self.map_expr = map_expr
+
+        self.arguments = arguments
+        self.name = name
+        self.options = options
+        self.preamble = preamble
+
+    @memoize_method
+    def get_kernel(self, index_dtype, per_item):
+        from pyopencl.tools import (parse_arg_list,
+                get_arg_list_scalar_arg_dtypes, get_arg_offset_adjuster_code,
+                bitlog2)
+        arguments = "const %s *segment_starts" % dtype_to_ctype(index_dtype)
+        if self.arguments:
+            arguments += ", " + self.arguments
+        parsed_args = parse_arg_list(arguments, with_offset=True)
+
+        from pyopencl.characterize import usable_local_mem_size
+        group_size = min(
+                min(dev.max_work_group_size,
+                    usable_local_mem_size(dev) // (2*self.dtype_out.itemsize))
+                for dev in self.context.devices)
+        group_size = 2**bitlog2(group_size)
+
+        from mako.template import Template
+        from pytools import all
+        from pyopencl.characterize import has_double_support
+
+        while True:
+            src = str(Template(SEGMENT_STARTS_KERNEL).render(
+                out_type=dtype_to_ctype(self.dtype_out),
+                index_type=dtype_to_ctype(index_dtype),
+                arguments=", ".join(arg.declarator() for arg in parsed_args),
+                arg_prep=get_arg_offset_adjuster_code(parsed_args),
+                group_size=group_size,
+                per_item=per_item,
+                neutral=self.neutral,
+                reduce_expr=self.reduce_expr,
+                map_expr=self.map_expr,
+                name=self.name,
+                preamble=self.preamble,
+                double_support=all(
+                    has_double_support(dev) for dev in self.context.devices),
+                ))
+
+            prg = cl.Program(self.context, src).build(self.options)
+            knl = getattr(prg, self.name)
+            knl.set_scalar_arg_dtypes(
+                    [None]
+                    + get_arg_list_scalar_arg_dtypes(parsed_args)
+                    + [np.int64])
+
+            if per_item:
+                return knl, parsed_args, group_size
+
+            kernel_max_wg_size = min(
+                    knl.get_work_group_info(
+                        cl.kernel_work_group_info.WORK_GROUP_SIZE, dev)
+                    for dev in self.context.devices)
+
+            if group_size <= kernel_max_wg_size:
+                return knl, parsed_args, group_size
+
+            group_size = 2**bitlog2(kernel_max_wg_size)
+
+    def __call__(self, starts, *args, **kwargs):
+        """Return an array holding the reduction of each segment.
+        The *i*'th segment covers the indices *i* in *map_expr* from
+        *starts[i]* up to (but not including) *starts[i+1]*, so that
+        *starts* has one more entry than there are segments.
+
+        *starts* may also be a :class:`pyopencl.algorithm.BuiltList`.
+        Segments whose average length is short are reduced by one work item
+        each, longer ones by a whole work group each.
+
+        :arg queue: the queue on which to run the reduction.
+        :arg wait_for: a list of events to wait for in addition to the
+            :attr:`pyopencl.array.Array.events` of the arguments.
+        :arg return_event: if *True*, return a tuple of the result and
+            the :class:`pyopencl.Event` of the reduction.
+        :arg allocator: the allocator for the result.
+        """
+        queue = kwargs.pop("queue", None)
+        wait_for = kwargs.pop("wait_for", None)
+        return_event = kwargs.pop("return_event", False)
+        allocator = kwargs.pop("allocator", None)
+
+        if kwargs:
+            raise TypeError("invalid keyword argument to segmented "
+                    "reduction kernel")
+
+        from pyopencl.algorithm import BuiltList
+        total_count = None
+        if isinstance(starts, BuiltList):
+            total_count = starts.count
+            starts = starts.starts
+
+        if queue is None:
+            queue = starts.queue
+        if allocator is None:
+            allocator = starts.allocator
+
+        segment_count = starts.size - 1
+
+        from pyopencl.array import empty, _get_array_events, _add_array_event
+        result = empty(queue, (segment_count,), self.dtype_out,
+                allocator=allocator)
+
+        if segment_count <= 0:
+            if return_event:
+                return result, None
+            else:
+                return result
+
+        if total_count is None:
+            total_count = int(starts[segment_count:].get(queue=queue)[0])
+
+        per_item = (total_count
+                < SEGMENTED_PER_ITEM_MAX_ROW_LENGTH * segment_count)
+        knl, arg_types, group_size = self.get_kernel(starts.dtype, per_item)
+
+        from pyopencl.tools import get_arg_invocation_values
+        invocation_args = get_arg_invocation_values(
+                arg_types, (starts,) + args)
+
+        if per_item:
+            from pyopencl.array import splay
+            gs, ls = splay(queue, segment_count)
+        else:
+            gs, ls = (segment_count*group_size,), (group_size,)
+
+        arrays = [starts] + list(args)
+        evt = knl(queue, gs, ls,
+                *([result.data] + invocation_args + [segment_count]),
+                **dict(wait_for=_get_array_events(arrays, wait_for)))
+        _add_array_event([result] + arrays, evt)
+
+        if return_event:
+            return result, evt
+        else:
+            return result
+
+# }}}
+
 
 
 
@@ -35,7 +35,8 @@ import pyopencl as cl
 import pyopencl.array
 from pyopencl.tools import (dtype_to_ctype, bitlog2,
         KernelTemplateBase, _process_code_for_macro,
-        get_arg_list_scalar_arg_dtypes)
+        get_arg_list_scalar_arg_dtypes, get_arg_offset_adjuster_code,
+        get_arg_invocation_values)
 import pyopencl._mymako as mako
 from pyopencl._cluda import CLUDA_PREAMBLE
 
@@ -144,6 +145,8 @@ void ${name_prefix}_scan_intervals(
     %endif
     )
 {
+    ${arg_offset_adjustment}
+
     // index K in first dimension used for carry storage
     %if scan_dtype.itemsize > 4 and scan_dtype.itemsize % 8 == 0 and is_gpu:
         // Avoid bank conflicts by adding a single 32-bit value to the size of
@@ -601,6 +604,8 @@ void ${name_prefix}_final_update(
     %endif
     )
 {
+    ${arg_offset_adjustment}
+
     %if use_lookbehind_update:
         LOCAL_MEM scan_type ldata[WG_SIZE];
     %endif
@@ -959,7 +964,7 @@ class _GenericScanKernelBase(object):
         self.options = options
 
         from pyopencl.tools import parse_arg_list
-        self.parsed_args = parse_arg_list(arguments)
+        self.parsed_args = parse_arg_list(arguments, with_offset=True)
         from pyopencl.tools import VectorArg
         self.first_array_idx = [
                 i for i, arg in enumerate(self.parsed_args)
@@ -1165,6 +1170,7 @@ class GenericScanKernel(_GenericScanKernelBase):
             wg_size=self.update_wg_size,
             output_statement=self.output_statement,
             argument_signature=", ".join(arg.declarator() for arg in self.parsed_args),
+            arg_offset_adjustment=get_arg_offset_adjuster_code(self.parsed_args),
             is_segment_start_expr=self.is_segment_start_expr,
             input_expr=_process_code_for_macro(self.input_expr),
             use_lookbehind_update=use_lookbehind_update,
@@ -1227,6 +1233,7 @@ class GenericScanKernel(_GenericScanKernelBase):
             input_expr=input_expr,
             k_group_size=k_group_size,
             argument_signature=", ".join(arg.declarator() for arg in arguments),
+            arg_offset_adjustment=get_arg_offset_adjuster_code(arguments),
             is_segment_start_expr=is_segment_start_expr,
             input_fetch_exprs=input_fetch_exprs,
             is_first_level=is_first_level,
@@ -1260,6 +1267,7 @@ class GenericScanKernel(_GenericScanKernelBase):
         allocator = kwargs.get("allocator")
         queue = kwargs.get("queue")
         n = kwargs.get("size")
+        wait_for = kwargs.get("wait_for")
 
         if len(args) != len(self.parsed_args):
             raise TypeError("expected %d arguments, got %d" %
@@ -1272,13 +1280,7 @@ class GenericScanKernel(_GenericScanKernelBase):
         if n is None:
             n, = first_array.shape
 
-        data_args = []
-        from pyopencl.tools import VectorArg
-        for arg_descr, arg_val in zip(self.parsed_args, args):
-            if isinstance(arg_descr, VectorArg):
-                data_args.append(arg_val.data)
-            else:
-                data_args.append(arg_val)
+        data_args = get_arg_invocation_values(self.parsed_args, args)
 
         # }}}
 
@@ -1325,9 +1327,12 @@ class GenericScanKernel(_GenericScanKernelBase):
         if self.store_segment_start_flags:
             scan1_args.append(segment_start_flags.data)
 
-        l1_info.kernel(
+        from pyopencl.array import _get_array_events, _add_array_event
+        l1_evt = l1_info.kernel(
                 queue, (num_intervals,), (l1_info.wg_size,),
-                *scan1_args, **dict(g_times_l=True))
+                *scan1_args, **dict(
+                    g_times_l=True,
+                    wait_for=_get_array_events(args, wait_for)))
 
         # }}}
 
@@ -1345,9 +1350,9 @@ class GenericScanKernel(_GenericScanKernelBase):
                 interval_results.data, # partial_scan_buffer
                 num_intervals, interval_size]
 
-        l2_info.kernel(
+        l2_evt = l2_info.kernel(
                 queue, (1,), (l1_info.wg_size,),
-                *scan2_args, **dict(g_times_l=True))
+                *scan2_args, **dict(g_times_l=True, wait_for=[l1_evt]))
 
         # }}}
 
@@ -1360,12 +1365,15 @@ class GenericScanKernel(_GenericScanKernelBase):
         if self.store_segment_start_flags:
             upd_args.append(segment_start_flags.data)
 
-        self.final_update_knl(
+        evt = self.final_update_knl(
                 queue, (num_intervals,), (self.update_wg_size,),
-                *upd_args, **dict(g_times_l=True))
+                *upd_args, **dict(g_times_l=True, wait_for=[l2_evt]))
 
         # }}}
 
+        _add_array_event(args, evt)
+        return evt
+
 # }}}
 
 # {{{ debug kernel
@@ -1378,6 +1386,8 @@ void ${name_prefix}_debug_scan(
     ${argument_signature},
     const index_type N)
 {
+    ${arg_offset_adjustment}
+
     scan_type item = ${neutral};
     scan_type prev_item;
 
@@ -1421,6 +1431,7 @@ class GenericDebugScanKernel(_GenericScanKernelBase):
         scan_src = str(scan_tpl.render(
             output_statement=self.output_statement,
             argument_signature=", ".join(arg.declarator() for arg in self.parsed_args),
+            arg_offset_adjustment=get_arg_offset_adjuster_code(self.parsed_args),
             is_segment_start_expr=self.is_segment_start_expr,
             input_expr=_process_code_for_macro(self.input_expr),
             input_fetch_exprs=self.input_fetch_exprs,
@@ -1441,6 +1452,7 @@ class GenericDebugScanKernel(_GenericScanKernelBase):
         allocator = kwargs.get("allocator")
         queue = kwargs.get("queue")
         n = kwargs.get("size")
+        wait_for = kwargs.get("wait_for")
 
         if len(args) != len(self.parsed_args):
             raise TypeError("expected %d arguments, got %d" %
@@ -1453,17 +1465,15 @@ class GenericDebugScanKernel(_GenericScanKernelBase):
         if n is None:
             n, = first_array.shape
 
-        data_args = []
-        from pyopencl.tools import VectorArg
-        for arg_descr, arg_val in zip(self.parsed_args, args):
-            if isinstance(arg_descr, VectorArg):
-                data_args.append(arg_val.data)
-            else:
-                data_args.append(arg_val)
+        data_args = get_arg_invocation_values(self.parsed_args, args)
 
         # }}}
 
-        self.kernel(queue, (1,), (1,), *(data_args + [n]))
+        from pyopencl.array import _get_array_events, _add_array_event
+        evt = self.kernel(queue, (1,), (1,), *(data_args + [n]),
+                **dict(wait_for=_get_array_events(args, wait_for)))
+        _add_array_event(args, evt)
+        return evt
 
 # }}}
 
@@ -1484,7 +1494,8 @@ class _LegacyScanKernelBase(GenericScanKernel):
                 output_statement=self.ary_output_statement,
                 options=options, preamble=preamble, devices=devices)
 
-    def __call__(self, input_ary, output_ary=None, allocator=None, queue=None):
+    def __call__(self, input_ary, output_ary=None, allocator=None, queue=None,
+            wait_for=None):
         allocator = allocator or input_ary.allocator
         queue = queue or input_ary.queue or output_ary.queue
 
@@ -1507,7 +1518,8 @@ class _LegacyScanKernelBase(GenericScanKernel):
             return output_ary
 
         GenericScanKernel.__call__(self,
-                input_ary, output_ary, allocator=allocator, queue=queue)
+                input_ary, output_ary, allocator=allocator, queue=queue,
+                wait_for=wait_for)
 
         return output_ary
 
@@ -1544,7 +1556,8 @@ class ScanTemplate(KernelTemplateBase):
         renderer = self.get_renderer(type_values, var_values, context, options)
 
         return scan_cls(context, renderer.type_dict["scan_t"],
-            renderer.render_argument_list(self.arguments, more_arguments),
+            renderer.render_argument_list(self.arguments, more_arguments,
+                with_offset=True),
             renderer(self.input_expr), renderer(self.scan_expr), renderer(self.neutral),
             renderer(self.output_statement),
             is_segment_start_expr=renderer(self.is_segment_start_expr),
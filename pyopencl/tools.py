@@ -69,36 +69,849 @@ MemoryPool = cl.MemoryPool
 
 
 
+# {{{ pinned host memory pool
+
+class _PinnedHostBlock(object):
+    """Owns one mapped block of a :class:`PinnedHostPool` while an array
+    handed out by the pool (or any view of it) is alive. Arrays reference
+    this object as their base through the array interface below, and the
+    block goes back to the pool once the last of them is gone.
+    """
+
+    def __init__(self, pool, bin_nr, mapped, shape, dtype, strides):
+        self.pool = pool
+        self.bin_nr = bin_nr
+        self.mapped = mapped
+
+        self.__array_interface__ = {
+                "version": 3,
+                "shape": shape,
+                "typestr": dtype.str,
+                "descr": dtype.descr,
+                "strides": strides,
+                "data": (mapped.__array_interface__["data"][0], False),
+                }
+
+    def __del__(self):
+        self.pool._release(self.bin_nr, self.mapped)
+
+
+class PinnedHostPool(object):
+    """A pool of page-locked ('pinned') host memory for staging transfers
+    between host and device. Blocks are allocated as
+    :attr:`pyopencl.mem_flags.ALLOC_HOST_PTR` buffers which remain mapped into
+    the host address space for as long as the pool holds them. Transfers
+    from and to such memory avoid an intermediate copy in the OpenCL
+    implementation, and reusing the blocks avoids the cost of allocating
+    (and page-locking) host memory on every transfer.
+
+    Request sizes are grouped into the same bins as in
+    :class:`pyopencl.tools.MemoryPool`.
+
+    :arg queue: the queue used to map the blocks.
+    :arg max_held_bytes: if not *None*, blocks that are returned to the pool
+        while it already holds this many bytes are freed instead of held.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, queue, max_held_bytes=None):
+        self.queue = queue
+        self.max_held_bytes = max_held_bytes
+
+        self.bins = {}
+        self.held_blocks = 0
+        self.held_bytes = 0
+        self.active_blocks = 0
+
+    def empty(self, shape, dtype, order="C"):
+        """Return a :class:`numpy.ndarray` of the given *shape* and *dtype*
+        residing in pinned memory. The memory is returned to the pool when
+        the array and all views of it have been garbage-collected.
+        """
+        dtype = np.dtype(dtype)
+        try:
+            shape = tuple(shape)
+        except TypeError:
+            shape = (shape,)
+
+        from pytools import product
+        nbytes = product(shape) * dtype.itemsize
+
+        bin_nr = MemoryPool.bin_number(max(nbytes, 1))
+        bin_list = self.bins.get(bin_nr)
+
+        if bin_list:
+            mapped = bin_list.pop()
+            self.held_blocks -= 1
+            self.held_bytes -= mapped.nbytes
+        else:
+            mapped = self._allocate(MemoryPool.alloc_size(bin_nr))
+
+        self.active_blocks += 1
+
+        from pyopencl.compyte.array import (
+                f_contiguous_strides, c_contiguous_strides)
+        if order == "F":
+            strides = f_contiguous_strides(dtype.itemsize, shape)
+        elif order == "C":
+            strides = c_contiguous_strides(dtype.itemsize, shape)
+        else:
+            raise ValueError("invalid order: %s" % order)
+
+        return np.asarray(_PinnedHostBlock(
+            self, bin_nr, mapped, shape, dtype, strides))
+
+    def _allocate(self, nbytes):
+        mf = cl.mem_flags
+        buf = cl.Buffer(self.queue.context,
+                mf.READ_WRITE | mf.ALLOC_HOST_PTR, nbytes)
+        mapped, evt = cl.enqueue_map_buffer(self.queue, buf,
+                cl.map_flags.READ | cl.map_flags.WRITE, 0,
+                (nbytes,), np.uint8, is_blocking=True)
+        return mapped
+
+    def _release(self, bin_nr, mapped):
+        self.active_blocks -= 1
+
+        if (self.max_held_bytes is not None
+                and self.held_bytes + mapped.nbytes > self.max_held_bytes):
+            # dropping the mapped array unmaps and releases the buffer
+            return
+
+        self.bins.setdefault(bin_nr, []).append(mapped)
+        self.held_blocks += 1
+        self.held_bytes += mapped.nbytes
+
+    def free_held(self):
+        """Free all blocks held by the pool but not in use."""
+        self.bins.clear()
+        self.held_blocks = 0
+        self.held_bytes = 0
+
+# }}}
+
+
+
+
+# {{{ arena allocator
+
+class _Arena(object):
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+        self.live_count = 0
+
+
+class ArenaAllocator(object):
+    """An allocator that carves small allocations out of a few large
+    buffers ('arenas') as sub-buffers, avoiding the per-buffer overhead
+    of the OpenCL implementation and the rounding of
+    :class:`MemoryPool`. It may be passed as the *allocator* argument
+    of :class:`pyopencl.array.Array` and friends.
+
+    Allocations are handed out consecutively from the current arena,
+    each starting at a multiple of the largest
+    :attr:`pyopencl.device_info.MEM_BASE_ADDR_ALIGN` among the devices in
+    the context. Once all sub-buffers of an arena have been
+    garbage-collected, the arena is reused from its beginning.
+    Allocations larger than *max_sub_size* are passed on to *allocator*
+    unchanged.
+
+    Like :class:`MemoryPool`, this allocator assumes that memory that
+    is no longer referenced from Python is no longer in use by any
+    pending command, which holds as long as all work on the
+    allocations is submitted to a single in-order queue.
+
+    Sub-buffers require OpenCL 1.1.
+
+    :arg context: a :class:`pyopencl.Context`.
+    :arg arena_size: the size of each arena in bytes.
+    :arg max_sub_size: the largest allocation that is served from an
+        arena. Defaults to an eighth of *arena_size*.
+    :arg allocator: the allocator used for the arenas and for large
+        allocations. Defaults to a :class:`DeferredAllocator`.
+    :arg max_held_arenas: the number of arenas without live allocations
+        that are kept around for reuse.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, context, arena_size=1 << 20, max_sub_size=None,
+            allocator=None, max_held_arenas=2):
+        if max_sub_size is None:
+            max_sub_size = arena_size // 8
+        if max_sub_size > arena_size:
+            raise ValueError("max_sub_size may not exceed arena_size")
+
+        if allocator is None:
+            allocator = DeferredAllocator(context)
+
+        self.context = context
+        self.arena_size = arena_size
+        self.max_sub_size = max_sub_size
+        self.allocator = allocator
+        self.max_held_arenas = max_held_arenas
+
+        self.alignment = max(
+                dev.mem_base_addr_align // 8 for dev in context.devices)
+
+        self.current_arena = None
+        self.held_arenas = []
+        self.arena_count = 0
+        self.active_allocations = 0
+
+        # keeps the weak references (and thereby their callbacks) alive
+        self._weakrefs = set()
+
+    def __call__(self, size):
+        if size > self.max_sub_size:
+            return self.allocator(size)
+
+        align = self.alignment
+        aligned_size = (size + align - 1) // align * align
+
+        arena = self.current_arena
+        if arena is None or arena.offset + aligned_size > self.arena_size:
+            arena = self.current_arena = self._get_arena()
+
+        buf = arena.buffer.get_sub_region(arena.offset, size)
+        arena.offset += aligned_size
+        arena.live_count += 1
+        self.active_allocations += 1
+
+        from weakref import ref
+
+        def release(wr):
+            self._weakrefs.discard(wr)
+            self._release(arena)
+
+        self._weakrefs.add(ref(buf, release))
+
+        return buf
+
+    def _get_arena(self):
+        if self.held_arenas:
+            return self.held_arenas.pop()
+
+        self.arena_count += 1
+        return _Arena(self.allocator(self.arena_size))
+
+    def _release(self, arena):
+        arena.live_count -= 1
+        self.active_allocations -= 1
+
+        if arena.live_count:
+            return
+
+        arena.offset = 0
+        if arena is not self.current_arena:
+            if len(self.held_arenas) < self.max_held_arenas:
+                self.held_arenas.append(arena)
+            else:
+                self.arena_count -= 1
+
+    def free_held(self):
+        """Release the arenas that do not contain live allocations."""
+        self.arena_count -= len(self.held_arenas)
+        del self.held_arenas[:]
+
+        arena = self.current_arena
+        if arena is not None and not arena.live_count:
+            self.current_arena = None
+            self.arena_count -= 1
+
+# }}}
+
+
+# {{{ parallel building
+
+def _build_lazy_kernel(obj):
+    # ElementwiseKernel builds on its first call. Build the kernel for
+    # the common case right away instead.
+    from pyopencl.elementwise import ElementwiseKernel
+    if isinstance(obj, ElementwiseKernel):
+        obj.get_kernel(False)
+
+
+class BuildFuture(object):
+    """The pending result of a job submitted to a :class:`BuildPool`."""
+
+    def __init__(self):
+        import threading
+        self._condition = threading.Condition()
+        self._is_done = False
+        self._result = None
+        self._exc_info = None
+
+    def _set_result(self, result, exc_info=None):
+        self._condition.acquire()
+        try:
+            self._result = result
+            self._exc_info = exc_info
+            self._is_done = True
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def done(self):
+        """Return *True* if the job has finished, successfully or not."""
+        return self._is_done
+
+    def _wait(self, timeout):
+        self._condition.acquire()
+        try:
+            if not self._is_done:
+                self._condition.wait(timeout)
+            if not self._is_done:
+                raise RuntimeError("timed out waiting for build")
+        finally:
+            self._condition.release()
+
+    def result(self, timeout=None):
+        """Wait for the job to finish and return its result, or re-raise
+        the exception it raised.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            exc_type, exc_value, exc_tb = self._exc_info
+            raise exc_type, exc_value, exc_tb
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the job to finish and return the exception it raised,
+        or *None*.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+
+class BuildPool(object):
+    """Build programs and kernels concurrently in a pool of threads.
+    :meth:`pyopencl.Program.build` releases the interpreter lock while
+    the OpenCL compiler runs, so that many builds can proceed at once,
+    e.g. while an application initializes::
+
+        pool = BuildPool()
+        futures = [pool.submit(ReductionKernel, ctx, ...), ...]
+        kernels = [f.result() for f in futures]
+        pool.shutdown()
+
+    *max_workers* defaults to the number of processors.
+    A :class:`BuildPool` may be used as a context manager, which
+    calls :meth:`shutdown` on exit.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            from multiprocessing import cpu_count
+            max_workers = cpu_count()
+
+        from Queue import Queue
+        self._jobs = Queue()
+
+        import threading
+        self._threads = []
+        for i in xrange(max_workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        self._is_shut_down = False
+
+    def _work(self):
+        import sys
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            future, func, args, kwargs = job
+            try:
+                result = func(*args, **kwargs)
+                _build_lazy_kernel(result)
+            except:
+                future._set_result(None, sys.exc_info())
+            else:
+                future._set_result(result)
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule *func(\*args, \*\*kwargs)* to run in a worker thread
+        and return a :class:`BuildFuture` for its result. *func* is
+        typically the constructor of a kernel class such as
+        :class:`pyopencl.elementwise.ElementwiseKernel`,
+        :class:`pyopencl.reduction.ReductionKernel` or
+        :class:`pyopencl.scan.GenericScanKernel`.
+        """
+        if self._is_shut_down:
+            raise RuntimeError("cannot submit to a BuildPool that was shut down")
+
+        future = BuildFuture()
+        self._jobs.put((future, func, args, kwargs))
+        return future
+
+    def build_program(self, context, src, options=[], devices=None):
+        """Return a :class:`BuildFuture` for a :class:`pyopencl.Program`
+        created from *src* and built with *options* for *devices*.
+        """
+        def build():
+            return cl.Program(context, src).build(options, devices)
+
+        return self.submit(build)
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once all submitted jobs are done.
+        If *wait* is *True*, return only after that.
+        """
+        if not self._is_shut_down:
+            self._is_shut_down = True
+            for thread in self._threads:
+                self._jobs.put(None)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+# }}}
+
+
+
+
+# {{{ kernel manifests
+
+class KernelManifestRecorder(object):
+    """Record the calls of kernel getters memoized with
+    :func:`context_dependent_memoize` (such as those used by
+    :class:`pyopencl.array.Array` arithmetic and reductions) while
+    recording is active, so that the kernels can be built ahead of time
+    with :func:`warm_up_kernels`. May be used as a context manager::
+
+        with KernelManifestRecorder("kernels.json"):
+            run_representative_workload()
+
+    Calls whose arguments are not plain numbers, strings, tuples or
+    non-structured :class:`numpy.dtype` instances are not recorded.
+    Kernels that are constructed directly rather than by a memoized
+    getter are not recorded either.
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = []
+        self._entry_keys = set()
+
+    def record(self, func, args):
+        try:
+            encoded_args = [_encode_manifest_arg(arg) for arg in args]
+        except TypeError:
+            return
+
+        self.record_entry({
+                "module": func.__module__,
+                "function": func.__name__,
+                "args": encoded_args,
+                })
+
+    def record_entry(self, entry):
+        import json
+        key = json.dumps(entry, sort_keys=True)
+        if key not in self._entry_keys:
+            self._entry_keys.add(key)
+            self.entries.append(entry)
+
+    def start(self):
+        global _kernel_manifest_recorder
+        _kernel_manifest_recorder = self
+
+    def stop(self):
+        """Stop recording and, if a *filename* was given, :meth:`save`
+        to it.
+        """
+        global _kernel_manifest_recorder
+        if _kernel_manifest_recorder is self:
+            _kernel_manifest_recorder = None
+
+        if self.filename is not None:
+            self.save(self.filename)
+
+    def save(self, filename):
+        """Write the recorded calls to *filename*, merged with those
+        already listed in it.
+        """
+        from os.path import exists
+        if exists(filename):
+            for entry in read_kernel_manifest(filename):
+                self.record_entry(entry)
+
+        import json
+        outf = open(filename, "wt")
+        try:
+            json.dump({"version": 1, "kernels": self.entries}, outf, indent=1)
+        finally:
+            outf.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+_kernel_manifest_recorder = None
+
+def _start_recording_from_environment():
+    import os
+    filename = os.environ.get("PYOPENCL_RECORD_KERNEL_MANIFEST")
+    if filename:
+        recorder = KernelManifestRecorder(filename)
+        recorder.start()
+
+        import atexit
+        atexit.register(recorder.stop)
+
+
+def _encode_manifest_arg(arg):
+    if arg is None or isinstance(arg, (bool, int, long, float, str, unicode)):
+        return arg
+    elif isinstance(arg, tuple):
+        return {"tuple": [_encode_manifest_arg(sub_arg) for sub_arg in arg]}
+    elif isinstance(arg, np.dtype) and arg.fields is None:
+        return {"dtype": arg.str}
+    else:
+        raise TypeError("cannot record argument of type '%s'"
+                % type(arg).__name__)
+
+
+def _decode_manifest_arg(arg):
+    if isinstance(arg, unicode):
+        try:
+            return str(arg)
+        except UnicodeEncodeError:
+            return arg
+    elif isinstance(arg, dict):
+        if "tuple" in arg:
+            return tuple(_decode_manifest_arg(sub_arg)
+                    for sub_arg in arg["tuple"])
+        elif "dtype" in arg:
+            return np.dtype(str(arg["dtype"]))
+        else:
+            raise ValueError("invalid argument in kernel manifest")
+    else:
+        return arg
+
+
+def read_kernel_manifest(filename):
+    import json
+    inf = open(filename, "rt")
+    try:
+        manifest = json.load(inf)
+    finally:
+        inf.close()
+
+    if manifest.get("version") != 1:
+        raise ValueError("unsupported kernel manifest version")
+
+    return manifest["kernels"]
+
+
+def warm_up_kernels(context, filename, pool=None):
+    """Build the kernels recorded by a :class:`KernelManifestRecorder` in
+    *filename* for *context*, so that they are present in the
+    compiler cache and in memory before their first use. If *pool* is a
+    :class:`BuildPool`, build concurrently. Entries whose getter no longer
+    exists or fails are skipped with a warning. Return the number of
+    kernels built.
+
+    .. versionadded:: 2013.1
+    """
+    from warnings import warn
+
+    calls = []
+    for entry in read_kernel_manifest(filename):
+        try:
+            module = __import__(str(entry["module"]), {}, {},
+                    [str(entry["function"])])
+            func = getattr(module, str(entry["function"]))
+            args = [_decode_manifest_arg(arg) for arg in entry["args"]]
+        except Exception, e:
+            warn("skipping kernel manifest entry %s.%s: %s"
+                    % (entry["module"], entry["function"], e))
+            continue
+
+        calls.append((entry, func, args))
+
+    def build(func, args):
+        _build_lazy_kernel(func(context, *args))
+
+    if pool is not None:
+        futures = [(entry, pool.submit(build, func, args))
+                for entry, func, args in calls]
+        results = [(entry, future.exception()) for entry, future in futures]
+    else:
+        results = []
+        for entry, func, args in calls:
+            try:
+                build(func, args)
+            except Exception, e:
+                results.append((entry, e))
+            else:
+                results.append((entry, None))
+
+    built_count = 0
+    for entry, exc in results:
+        if exc is None:
+            built_count += 1
+        else:
+            warn("skipping kernel manifest entry %s.%s: %s"
+                    % (entry["module"], entry["function"], exc))
+
+    return built_count
+
+_start_recording_from_environment()
+
+# }}}
+
+
+
+
+# {{{ first-argument-dependent memoization
+
 _first_arg_dependent_caches = []
 
+import threading
+_first_arg_cache_lock = threading.Lock()
+
+# The number of results each memoized function keeps per first argument
+# unless given otherwise.
+DEFAULT_FIRST_ARG_CACHE_SIZE = 256
+
+# Getting e.g. the context of a queue or buffer creates a new wrapper
+# object each time. All wrappers of the same OpenCL object share one
+# dictionary of caches in their instance dictionaries. This maps
+# *(type, obj_ptr)* of each such object to a WeakValueDictionary of its
+# live wrappers, through which a new wrapper finds that dictionary.
+_first_arg_wrappers = {}
 
 
+def _get_first_arg_caches(cl_object, create):
+    """Return the dictionary of caches shared by all wrappers of the same
+    OpenCL object as *cl_object*, or *None* if there is none yet (and
+    *create* is false) or *cl_object* takes no attributes.
+    """
+    try:
+        return cl_object._pyopencl_first_arg_caches
+    except AttributeError:
+        pass
+
+    try:
+        key = type(cl_object), cl_object.obj_ptr
+    except AttributeError:
+        return None
+
+    obj_caches = None
+    wrappers = _first_arg_wrappers.get(key)
+    if wrappers is not None:
+        for wrapper_ref in wrappers.valuerefs():
+            wrapper = wrapper_ref()
+            if wrapper is not None:
+                obj_caches = wrapper._pyopencl_first_arg_caches
+                break
+
+    if obj_caches is None:
+        if not create:
+            return None
+        obj_caches = {}
+
+    try:
+        cl_object._pyopencl_first_arg_caches = obj_caches
+    except (AttributeError, TypeError):
+        return None
+
+    if wrappers is None:
+        # forget objects all of whose wrappers have died
+        for dead_key in [other_key
+                for other_key, other_wrappers in _first_arg_wrappers.items()
+                if not len(other_wrappers)]:
+            del _first_arg_wrappers[dead_key]
+
+        import weakref
+        wrappers = _first_arg_wrappers[key] = weakref.WeakValueDictionary()
+
+    wrappers[id(cl_object)] = cl_object
+    return obj_caches
+
+
+def _get_all_first_arg_caches():
+    result = []
+    for wrappers in _first_arg_wrappers.values():
+        for wrapper_ref in wrappers.valuerefs():
+            wrapper = wrapper_ref()
+            if wrapper is not None:
+                result.append(wrapper._pyopencl_first_arg_caches)
+                break
+
+    return result
+
+
+class FirstArgDependentCache(object):
+    """The cache behind one function decorated with
+    :func:`first_arg_dependent_memoize`, available as the attribute
+    *first_arg_cache* of the decorated function.
+
+    Results are kept per OpenCL object, so that all Python wrappers of,
+    say, the same :class:`pyopencl.Context` (such as those returned by
+    :attr:`pyopencl.CommandQueue.context` and
+    :attr:`pyopencl.array.Array.context`) share them. They are stored in
+    the instance dictionaries of these wrappers, not in a global table.
+    Cached kernels and programs that refer back to their context therefore
+    only form a reference cycle with it, which the garbage collector
+    releases once no wrapper of the context is otherwise in use. First
+    arguments that do not accept attributes fall back to a global table.
+
+    .. attribute:: name
+    .. attribute:: max_size
+
+        The number of results kept per first argument, or *None* for
+        no bound. The least recently used results are dropped first.
+
+    .. attribute:: hits
+    .. attribute:: misses
+
+    .. versionadded:: 2013.1
+    """
+
+    def __init__(self, func, max_size):
+        self.name = "%s.%s" % (func.__module__, func.__name__)
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._strong_entries = {}
+        self._use_count = 0
+
+    def _get_entries(self, cl_object, create):
+        obj_caches = _get_first_arg_caches(cl_object, create)
+        if obj_caches is None:
+            if not create:
+                return self._strong_entries.get(cl_object)
+            return self._strong_entries.setdefault(cl_object, {})
+
+        try:
+            return obj_caches[self]
+        except KeyError:
+            if not create:
+                return None
+
+            entries = obj_caches[self] = {}
+            return entries
+
+    def _trim(self, entries):
+        if self.max_size is None:
+            return
 
-@decorator
-def first_arg_dependent_memoize(func, cl_object, *args):
+        while len(entries) > self.max_size:
+            lru_key = min(entries, key=lambda key: entries[key][0])
+            del entries[lru_key]
+
+    def __call__(self, func, cl_object, args):
+        _first_arg_cache_lock.acquire()
+        try:
+            entries = self._get_entries(cl_object, create=True)
+            try:
+                entry = entries[args]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._use_count += 1
+                entry[0] = self._use_count
+                return entry[1]
+        finally:
+            _first_arg_cache_lock.release()
+
+        # Call outside the lock, builds may take a while and may
+        # use other memoized functions.
+        result = func(cl_object, *args)
+
+        _first_arg_cache_lock.acquire()
+        try:
+            self._use_count += 1
+            entries[args] = [self._use_count, result]
+            self._trim(entries)
+        finally:
+            _first_arg_cache_lock.release()
+
+        if (_kernel_manifest_recorder is not None
+                and isinstance(cl_object, cl.Context)):
+            _kernel_manifest_recorder.record(func, args)
+
+        return result
+
+    def __len__(self):
+        result = sum(len(entries)
+                for entries in self._strong_entries.itervalues())
+        for obj_caches in _get_all_first_arg_caches():
+            result += len(obj_caches.get(self, ()))
+
+        return result
+
+    def clear(self):
+        _first_arg_cache_lock.acquire()
+        try:
+            for obj_caches in _get_all_first_arg_caches():
+                obj_caches.pop(self, None)
+
+            self._strong_entries.clear()
+        finally:
+            _first_arg_cache_lock.release()
+
+
+def first_arg_dependent_memoize(func=None, max_size=DEFAULT_FIRST_ARG_CACHE_SIZE):
     """Provides memoization for things that get created inside
     a context, i.e. mainly programs and kernels. Assumes that
     the first argument of the decorated function is an OpenCL
     object that might go away, such as a context or a queue,
     and based on which we might want to clear the cache.
 
+    May be used as ``@first_arg_dependent_memoize`` or as
+    ``@first_arg_dependent_memoize(max_size=...)``. See
+    :class:`FirstArgDependentCache` for how results are kept.
+
     .. versionadded:: 2011.2
+
+    .. versionchanged:: 2013.1
+        Cached results no longer keep their first argument alive, and
+        are bounded in number by *max_size*.
     """
-    try:
-        ctx_dict = func._pyopencl_first_arg_dep_memoize_dic
-    except AttributeError:
-        # FIXME: This may keep contexts alive longer than desired.
-        # But I guess since the memory in them is freed, who cares.
-        ctx_dict = func._pyopencl_first_arg_dep_memoize_dic = {}
+    if func is None:
+        def decorate(func):
+            return first_arg_dependent_memoize(func, max_size)
+        return decorate
 
-    try:
-        return ctx_dict[cl_object][args]
-    except KeyError:
-        _first_arg_dependent_caches.append(ctx_dict)
-        arg_dict = ctx_dict.setdefault(cl_object, {})
-        result = func(cl_object, *args)
-        arg_dict[args] = result
-        return result
+    cache = FirstArgDependentCache(func, max_size)
+    _first_arg_dependent_caches.append(cache)
+
+    def call_through_cache(func, cl_object, *args):
+        return cache(func, cl_object, args)
+
+    result = decorator(call_through_cache, func)
+    result.first_arg_cache = cache
+    return result
 
 context_dependent_memoize = first_arg_dependent_memoize
 
@@ -116,9 +929,25 @@ def clear_first_arg_caches():
     for cache in _first_arg_dependent_caches:
         cache.clear()
 
+
+def get_first_arg_cache_stats():
+    """Return a :class:`list` of :class:`dict` instances with the keys
+    ``name``, ``size``, ``max_size``, ``hits`` and ``misses``, one for
+    each function decorated with :func:`first_arg_dependent_memoize`.
+
+    .. versionadded:: 2013.1
+    """
+    return [
+            dict(name=cache.name, size=len(cache), max_size=cache.max_size,
+                hits=cache.hits, misses=cache.misses)
+            for cache in _first_arg_dependent_caches
+            if isinstance(cache, FirstArgDependentCache)]
+
 import atexit
 atexit.register(clear_first_arg_caches)
 
+# }}}
+
 
 
 
@@ -251,8 +1080,17 @@ class DtypedArgument(Argument):
                 self.dtype)
 
 class VectorArg(DtypedArgument):
+    def __init__(self, dtype, name, with_offset=False):
+        DtypedArgument.__init__(self, dtype, name)
+        self.with_offset = with_offset
+
     def declarator(self):
-        return "__global %s *%s" % (dtype_to_ctype(self.dtype), self.name)
+        if self.with_offset:
+            # Two underscores -> less likelihood of a name clash.
+            return "__global %s *%s__base, long %s__offset" % (
+                    dtype_to_ctype(self.dtype), self.name, self.name)
+        else:
+            return "__global %s *%s" % (dtype_to_ctype(self.dtype), self.name)
 
 class ScalarArg(DtypedArgument):
     def declarator(self):
@@ -270,7 +1108,7 @@ class OtherArg(Argument):
 
 
 
-def parse_c_arg(c_arg):
+def parse_c_arg(c_arg, with_offset=False):
     for aspace in ["__local", "__constant"]:
         if aspace in c_arg:
             raise RuntimeError("cannot deal with local or constant "
@@ -279,12 +1117,21 @@ def parse_c_arg(c_arg):
     c_arg = c_arg.replace("__global", "")
 
     from pyopencl.compyte.dtypes import parse_c_arg_backend
-    return parse_c_arg_backend(c_arg, ScalarArg, VectorArg)
+    result = parse_c_arg_backend(c_arg, ScalarArg, VectorArg)
 
-def parse_arg_list(arguments):
+    if with_offset and isinstance(result, VectorArg):
+        result.with_offset = True
+
+    return result
+
+def parse_arg_list(arguments, with_offset=False):
     """Parse a list of kernel arguments. *arguments* may be a comma-separate list
     of C declarators in a string, a list of strings representing C declarators,
     or :class:`Argument` objects.
+
+    If *with_offset* is *True*, vector arguments given as strings are passed
+    to the kernel as a buffer and a byte offset into it.
+    See :func:`get_arg_offset_adjuster_code`.
     """
 
     if isinstance(arguments, str):
@@ -293,7 +1140,7 @@ def parse_arg_list(arguments):
     def parse_single_arg(obj):
         if isinstance(obj, str):
             from pyopencl.tools import parse_c_arg
-            return parse_c_arg(obj)
+            return parse_c_arg(obj, with_offset=with_offset)
         else:
             return obj
 
@@ -306,11 +1153,52 @@ def get_arg_list_scalar_arg_dtypes(arg_types):
     for arg_type in arg_types:
         if isinstance(arg_type, ScalarArg):
             result.append(arg_type.dtype)
+        elif isinstance(arg_type, VectorArg):
+            result.append(None)
+            if arg_type.with_offset:
+                result.append(np.int64)
         else:
             result.append(None)
 
     return result
 
+def get_arg_offset_adjuster_code(arg_types):
+    """Return C statements that declare, for each :class:`VectorArg` in
+    *arg_types* that was declared *with_offset*, a pointer of the argument's
+    name that points to the offset start of its data.
+    """
+    result = []
+
+    for arg_type in arg_types:
+        if isinstance(arg_type, VectorArg) and arg_type.with_offset:
+            result.append("__global %(type)s *%(name)s = "
+                    "(__global %(type)s *) "
+                    "((__global char *) %(name)s__base + %(name)s__offset);"
+                    % dict(
+                        type=dtype_to_ctype(arg_type.dtype),
+                        name=arg_type.name))
+
+    return "\n".join(result)
+
+def get_arg_invocation_values(arg_types, args):
+    """Return the list of values to pass to a kernel with arguments
+    *arg_types* for the (:class:`pyopencl.array.Array` or scalar)
+    values *args*.
+    """
+    result = []
+
+    for arg_type, arg in zip(arg_types, args):
+        if isinstance(arg_type, VectorArg):
+            if arg_type.with_offset:
+                result.append(arg.base_data)
+                result.append(arg.offset)
+            else:
+                result.append(arg.data)
+        else:
+            result.append(arg)
+
+    return result
+
 # }}}
 
 
@@ -657,7 +1545,11 @@ class _TemplateRenderer(object):
 
     _C_COMMENT_FINDER = re.compile(r"/\*.*?\*/")
 
-    def render_argument_list(self, *arg_lists):
+    def render_argument_list(self, *arg_lists, **kwargs):
+        with_offset = kwargs.pop("with_offset", False)
+        if kwargs:
+            raise TypeError("unrecognized kwargs: " + ", ".join(kwargs))
+
         all_args = []
 
         for arg_list in arg_lists:
@@ -684,6 +1576,9 @@ class _TemplateRenderer(object):
                         name_to_dtype=lambda x: x)
                 parsed_arg = self.render_arg(ph)
 
+                if with_offset and isinstance(parsed_arg, VectorArg):
+                    parsed_arg.with_offset = True
+
             elif isinstance(arg, Argument):
                 parsed_arg = arg
             elif isinstance(arg, tuple):
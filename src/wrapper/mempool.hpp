@@ -12,6 +12,9 @@
 #include <boost/ptr_container/ptr_map.hpp>
 #include <boost/foreach.hpp>
 #include <boost/format.hpp>
+#include <deque>
+#include <map>
+#include <limits>
 #include "bitlog.hpp"
 
 
@@ -49,15 +52,42 @@ namespace PYGPU_PACKAGE
     public:
       typedef typename Allocator::pointer_type pointer_type;
       typedef typename Allocator::size_type size_type;
+      typedef boost::uint32_t bin_nr_t;
+
+      struct bin_stats
+      {
+        // allocations served from held blocks/by the allocator
+        unsigned long hits, misses;
+        unsigned held_blocks, active_blocks, peak_active_blocks;
+
+        bin_stats()
+          : hits(0), misses(0),
+          held_blocks(0), active_blocks(0), peak_active_blocks(0)
+        { }
+      };
+
+      typedef std::map<bin_nr_t, bin_stats> bin_stats_container_t;
 
     private:
-      typedef boost::uint32_t bin_nr_t;
-      typedef std::vector<pointer_type> bin_t;
+      struct held_block
+      {
+        pointer_type ptr;
+
+        // value of m_release_count when the block was returned to the
+        // pool, used to find the least recently returned block
+        unsigned long stamp;
+      };
+
+      // Blocks are pushed at the back, so the front of each bin holds its
+      // least recently returned block.
+      typedef std::deque<held_block> bin_t;
 
       typedef boost::ptr_map<bin_nr_t, bin_t > container_t;
       container_t m_container;
       typedef typename container_t::value_type bin_pair_t;
 
+      bin_stats_container_t m_bin_stats;
+
       std::auto_ptr<Allocator> m_allocator;
 
       // A held block is one that's been released by the application, but that
@@ -67,13 +97,28 @@ namespace PYGPU_PACKAGE
       // An active block is one that is in use by the application.
       unsigned m_active_blocks;
 
+      size_type m_held_bytes;
+      size_type m_active_bytes;
+      size_type m_peak_held_bytes;
+      size_type m_peak_active_bytes;
+
+      // Held blocks beyond this are freed, least recently returned first.
+      size_type m_max_held_bytes;
+
+      unsigned long m_release_count;
+
       bool m_stop_holding;
       int m_trace;
 
     public:
       memory_pool(Allocator const &alloc=Allocator())
         : m_allocator(alloc.copy()),
-        m_held_blocks(0), m_active_blocks(0), m_stop_holding(false),
+        m_held_blocks(0), m_active_blocks(0),
+        m_held_bytes(0), m_active_bytes(0),
+        m_peak_held_bytes(0), m_peak_active_bytes(0),
+        m_max_held_bytes(std::numeric_limits<size_type>::max()),
+        m_release_count(0),
+        m_stop_holding(false),
         m_trace(false)
       {
         if (m_allocator->is_deferred())
@@ -85,7 +130,7 @@ namespace PYGPU_PACKAGE
         }
       }
 
-      ~memory_pool()
+      virtual ~memory_pool()
       { free_held(); }
 
       static const unsigned mantissa_bits = 2;
@@ -141,26 +186,61 @@ namespace PYGPU_PACKAGE
           return *it->second;
       }
 
-      void inc_held_blocks()
+      void inc_held_blocks(bin_nr_t bin_nr)
       {
         if (m_held_blocks == 0)
           start_holding_blocks();
         ++m_held_blocks;
+
+        ++m_bin_stats[bin_nr].held_blocks;
+        m_held_bytes += alloc_size(bin_nr);
+        if (m_held_bytes > m_peak_held_bytes)
+          m_peak_held_bytes = m_held_bytes;
       }
 
-      void dec_held_blocks()
+      void dec_held_blocks(bin_nr_t bin_nr)
       {
+        --m_bin_stats[bin_nr].held_blocks;
+        m_held_bytes -= alloc_size(bin_nr);
+
         --m_held_blocks;
         if (m_held_blocks == 0)
           stop_holding_blocks();
       }
 
+      void inc_active_blocks(bin_nr_t bin_nr)
+      {
+        ++m_active_blocks;
+
+        bin_stats &stats = m_bin_stats[bin_nr];
+        ++stats.active_blocks;
+        if (stats.active_blocks > stats.peak_active_blocks)
+          stats.peak_active_blocks = stats.active_blocks;
+
+        m_active_bytes += alloc_size(bin_nr);
+        if (m_active_bytes > m_peak_active_bytes)
+          m_peak_active_bytes = m_active_bytes;
+      }
+
+      void dec_active_blocks(bin_nr_t bin_nr)
+      {
+        --m_active_blocks;
+        --m_bin_stats[bin_nr].active_blocks;
+        m_active_bytes -= alloc_size(bin_nr);
+      }
+
       virtual void start_holding_blocks()
       { }
 
       virtual void stop_holding_blocks()
       { }
 
+      // Called when an allocation of *size* bytes has failed even after
+      // all held blocks have been freed. If this returns true, the
+      // allocation is attempted once more.
+      virtual bool handle_out_of_memory(size_type size)
+      { return false; }
+
     public:
       pointer_type allocate(size_type size)
       {
@@ -173,9 +253,12 @@ namespace PYGPU_PACKAGE
             std::cout
               << "[pool] allocation of size " << size << " served from bin " << bin_nr
               << " which contained " << bin.size() << " entries" << std::endl;
-          return pop_block_from_bin(bin, size);
+          ++m_bin_stats[bin_nr].hits;
+          return pop_block_from_bin(bin, bin_nr);
         }
 
+        ++m_bin_stats[bin_nr].misses;
+
         size_type alloc_sz = alloc_size(bin_nr);
 
         assert(bin_number(alloc_sz) == bin_nr);
@@ -183,7 +266,7 @@ namespace PYGPU_PACKAGE
         if (m_trace)
           std::cout << "[pool] allocation of size " << size << " required new memory" << std::endl;
 
-        try { return get_from_allocator(alloc_sz); }
+        try { return get_from_allocator(bin_nr); }
         catch (PYGPU_PACKAGE::error &e)
         {
           if (!e.is_out_of_memory())
@@ -195,14 +278,27 @@ namespace PYGPU_PACKAGE
 
         m_allocator->try_release_blocks();
         if (bin.size())
-          return pop_block_from_bin(bin, size);
+          return pop_block_from_bin(bin, bin_nr);
 
         if (m_trace)
           std::cout << "[pool] allocation still OOM after GC" << std::endl;
 
         while (try_to_free_memory())
         {
-          try { return get_from_allocator(alloc_sz); }
+          try { return get_from_allocator(bin_nr); }
+          catch (PYGPU_PACKAGE::error &e)
+          {
+            if (!e.is_out_of_memory())
+              throw;
+          }
+        }
+
+        if (handle_out_of_memory(alloc_sz))
+        {
+          if (m_trace)
+            std::cout << "[pool] retrying allocation after OOM handler" << std::endl;
+
+          try { return get_from_allocator(bin_nr); }
           catch (PYGPU_PACKAGE::error &e)
           {
             if (!e.is_out_of_memory())
@@ -223,13 +319,23 @@ namespace PYGPU_PACKAGE
 
       void free(pointer_type p, size_type size)
       {
-        --m_active_blocks;
         bin_nr_t bin_nr = bin_number(size);
+        dec_active_blocks(bin_nr);
+
+        size_type alloc_sz = alloc_size(bin_nr);
 
-        if (!m_stop_holding)
+        if (!m_stop_holding && alloc_sz <= m_max_held_bytes)
         {
-          inc_held_blocks();
-          get_bin(bin_nr).push_back(p);
+          while (m_held_bytes + alloc_sz > m_max_held_bytes)
+            if (!free_least_recently_held())
+              break;
+
+          held_block block;
+          block.ptr = p;
+          block.stamp = m_release_count++;
+
+          get_bin(bin_nr).push_back(block);
+          inc_held_blocks(bin_nr);
 
           if (m_trace)
             std::cout << "[pool] block of size " << size << " returned to bin "
@@ -248,16 +354,66 @@ namespace PYGPU_PACKAGE
 
           while (bin.size())
           {
-            m_allocator->free(bin.back());
+            m_allocator->free(bin.back().ptr);
             bin.pop_back();
 
-            dec_held_blocks();
+            dec_held_blocks(bin_pair.first);
           }
         }
 
         assert(m_held_blocks == 0);
       }
 
+      // Free the held block that was returned to the pool longest ago.
+      bool free_least_recently_held()
+      {
+        bin_t *oldest_bin = 0;
+        bin_nr_t oldest_bin_nr = 0;
+
+        BOOST_FOREACH(bin_pair_t bin_pair, m_container)
+        {
+          bin_t &bin = *bin_pair.second;
+
+          if (bin.size() && (oldest_bin == 0
+                || bin.front().stamp < oldest_bin->front().stamp))
+          {
+            oldest_bin = &bin;
+            oldest_bin_nr = bin_pair.first;
+          }
+        }
+
+        if (oldest_bin == 0)
+          return false;
+
+        if (m_trace)
+          std::cout << "[pool] evicting held block from bin "
+            << oldest_bin_nr << std::endl;
+
+        m_allocator->free(oldest_bin->front().ptr);
+        oldest_bin->pop_front();
+        dec_held_blocks(oldest_bin_nr);
+
+        return true;
+      }
+
+      size_type max_held_bytes() const
+      { return m_max_held_bytes; }
+
+      void set_max_held_bytes(size_type max_held_bytes)
+      {
+        m_max_held_bytes = max_held_bytes;
+
+        while (m_held_bytes > m_max_held_bytes)
+          if (!free_least_recently_held())
+            break;
+      }
+
+      bool has_max_held_bytes() const
+      { return m_max_held_bytes != std::numeric_limits<size_type>::max(); }
+
+      void clear_max_held_bytes()
+      { m_max_held_bytes = std::numeric_limits<size_type>::max(); }
+
       void stop_holding()
       {
         m_stop_holding = true;
@@ -270,6 +426,38 @@ namespace PYGPU_PACKAGE
       unsigned held_blocks()
       { return m_held_blocks; }
 
+      size_type held_bytes() const
+      { return m_held_bytes; }
+
+      size_type active_bytes() const
+      { return m_active_bytes; }
+
+      size_type peak_held_bytes() const
+      { return m_peak_held_bytes; }
+
+      size_type peak_active_bytes() const
+      { return m_peak_active_bytes; }
+
+      bin_stats_container_t const &get_bin_stats() const
+      { return m_bin_stats; }
+
+      // Zero the hit and miss counts and reset the peaks to the current
+      // values.
+      void reset_stats()
+      {
+        BOOST_FOREACH(typename bin_stats_container_t::value_type &stats_pair,
+            m_bin_stats)
+        {
+          bin_stats &stats = stats_pair.second;
+          stats.hits = 0;
+          stats.misses = 0;
+          stats.peak_active_blocks = stats.active_blocks;
+        }
+
+        m_peak_held_bytes = m_held_bytes;
+        m_peak_active_bytes = m_active_bytes;
+      }
+
       bool try_to_free_memory()
       {
         BOOST_FOREACH(bin_pair_t bin_pair,
@@ -280,10 +468,10 @@ namespace PYGPU_PACKAGE
 
           if (bin.size())
           {
-            m_allocator->free(bin.back());
+            m_allocator->free(bin.back().ptr);
             bin.pop_back();
 
-            dec_held_blocks();
+            dec_held_blocks(bin_pair.first);
 
             return true;
           }
@@ -293,21 +481,21 @@ namespace PYGPU_PACKAGE
       }
 
     private:
-      pointer_type get_from_allocator(size_type alloc_sz)
+      pointer_type get_from_allocator(bin_nr_t bin_nr)
       {
-        pointer_type result = m_allocator->allocate(alloc_sz);
-        ++m_active_blocks;
+        pointer_type result = m_allocator->allocate(alloc_size(bin_nr));
+        inc_active_blocks(bin_nr);
 
         return result;
       }
 
-      pointer_type pop_block_from_bin(bin_t &bin, size_type size)
+      pointer_type pop_block_from_bin(bin_t &bin, bin_nr_t bin_nr)
       {
-        pointer_type result = bin.back();
+        pointer_type result = bin.back().ptr;
         bin.pop_back();
 
-        dec_held_blocks();
-        ++m_active_blocks;
+        dec_held_blocks(bin_nr);
+        inc_active_blocks(bin_nr);
 
         return result;
       }
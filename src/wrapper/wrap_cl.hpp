@@ -48,6 +48,8 @@
 #include <vector>
 #include <utility>
 #include <numeric>
+#include <limits>
+#include <cstring>
 #include <boost/python/slice.hpp>
 #include <boost/foreach.hpp>
 #include <boost/scoped_array.hpp>
@@ -3228,20 +3230,151 @@ namespace pyopencl
 
 
 
+  // {{{ scalar argument conversion
+
+  template <class T>
+  inline T scalar_arg_to_integer(PyObject *obj)
+  {
+    if (PyFloat_Check(obj))
+      throw error("Kernel.set_args", CL_INVALID_VALUE,
+          "integer kernel argument expected, got float");
+
+    PyObject *index = PyNumber_Index(obj);
+    if (!index)
+      throw py::error_already_set();
+    py::handle<> index_handle(index);
+
+    if (std::numeric_limits<T>::is_signed)
+    {
+      PY_LONG_LONG value = PyLong_AsLongLong(index);
+      if (value == -1 && PyErr_Occurred())
+        throw py::error_already_set();
+
+      if (value < (PY_LONG_LONG) std::numeric_limits<T>::min()
+          || value > (PY_LONG_LONG) std::numeric_limits<T>::max())
+        throw error("Kernel.set_args", CL_INVALID_VALUE,
+            "integer kernel argument out of range");
+
+      return (T) value;
+    }
+    else
+    {
+      unsigned PY_LONG_LONG value = PyLong_AsUnsignedLongLong(index);
+      if (value == (unsigned PY_LONG_LONG) -1 && PyErr_Occurred())
+        throw py::error_already_set();
+
+      if (value > (unsigned PY_LONG_LONG) std::numeric_limits<T>::max())
+        throw error("Kernel.set_args", CL_INVALID_VALUE,
+            "integer kernel argument out of range");
+
+      return (T) value;
+    }
+  }
+
+
+
+
+  inline double scalar_arg_to_double(PyObject *obj)
+  {
+    double value = PyFloat_AsDouble(obj);
+    if (value == -1 && PyErr_Occurred())
+      throw py::error_already_set();
+    return value;
+  }
+
+
+
+
+  inline Py_complex scalar_arg_to_complex(PyObject *obj)
+  {
+    Py_complex value = PyComplex_AsCComplex(obj);
+    if (value.real == -1 && PyErr_Occurred())
+      throw py::error_already_set();
+    return value;
+  }
+
+  // }}}
+
+
+
+
   class kernel : boost::noncopyable
   {
     private:
       cl_kernel m_kernel;
 
+      // {{{ argument state
+
+      // numpy type characters of scalar arguments, as given to
+      // set_arg_type_chars, with 0 for non-scalar arguments.
+      std::vector<char> m_arg_type_chars;
+
+      // The last by-value or local memory argument set for each argument,
+      // so that setting the same value again can be skipped. Encoded as a
+      // kind byte, the size and (if any) the value bytes. Empty if unknown
+      // or if a memory object or sampler was set.
+      std::vector<std::vector<char> > m_arg_values;
+
+      int m_num_args;
+
+      enum arg_kind { ARG_VALUE = 'v', ARG_LOCAL = 'l' };
+
+      void set_arg_cached(cl_uint arg_index, arg_kind kind,
+          size_t size, const void *value)
+      {
+        const size_t encoded_size = 1 + sizeof(size_t) + (value ? size : 0);
+
+        if (arg_index < m_arg_values.size())
+        {
+          std::vector<char> const &cached = m_arg_values[arg_index];
+          if (cached.size() == encoded_size
+              && cached[0] == (char) kind
+              && memcmp(&cached[1], &size, sizeof(size_t)) == 0
+              && (!value
+                || memcmp(&cached[1+sizeof(size_t)], value, size) == 0))
+            return;
+        }
+        else
+          m_arg_values.resize(arg_index+1);
+
+        std::vector<char> &cached = m_arg_values[arg_index];
+        cached.clear();
+
+        PYOPENCL_CALL_GUARDED(clSetKernelArg,
+            (m_kernel, arg_index, size, value));
+
+        cached.resize(encoded_size);
+        cached[0] = (char) kind;
+        memcpy(&cached[1], &size, sizeof(size_t));
+        if (value)
+          memcpy(&cached[1+sizeof(size_t)], value, size);
+      }
+
+      void set_arg_uncached(cl_uint arg_index, size_t size, const void *value)
+      {
+        // Handles of memory objects and samplers are always set again.
+        // Once an object is released, a new one may get the same handle,
+        // and skipping the call would leave the kernel bound to the old
+        // one.
+        if (arg_index < m_arg_values.size())
+          m_arg_values[arg_index].clear();
+
+        PYOPENCL_CALL_GUARDED(clSetKernelArg,
+            (m_kernel, arg_index, size, value));
+      }
+
+      // }}}
+
     public:
       kernel(cl_kernel knl, bool retain)
-        : m_kernel(knl)
+        : m_kernel(knl), m_num_args(-1)
       {
         if (retain)
           PYOPENCL_CALL_GUARDED(clRetainKernel, (knl));
       }
 
       kernel(program const &prg, std::string const &kernel_name)
+        : m_num_args(-1)
       {
         cl_int status_code;
 
@@ -3272,28 +3405,24 @@ namespace pyopencl
       void set_arg_null(cl_uint arg_index)
       {
         cl_mem m = 0;
-        PYOPENCL_CALL_GUARDED(clSetKernelArg, (m_kernel, arg_index,
-              sizeof(cl_mem), &m));
+        set_arg_cached(arg_index, ARG_VALUE, sizeof(cl_mem), &m);
       }
 
       void set_arg_mem(cl_uint arg_index, memory_object_holder &moh)
       {
         cl_mem m = moh.data();
-        PYOPENCL_CALL_GUARDED(clSetKernelArg,
-            (m_kernel, arg_index, sizeof(cl_mem), &m));
+        set_arg_uncached(arg_index, sizeof(cl_mem), &m);
       }
 
       void set_arg_local(cl_uint arg_index, local_memory const &loc)
       {
-        PYOPENCL_CALL_GUARDED(clSetKernelArg,
-            (m_kernel, arg_index, loc.size(), 0));
+        set_arg_cached(arg_index, ARG_LOCAL, loc.size(), 0);
       }
 
       void set_arg_sampler(cl_uint arg_index, sampler const &smp)
       {
         cl_sampler s = smp.data();
-        PYOPENCL_CALL_GUARDED(clSetKernelArg,
-            (m_kernel, arg_index, sizeof(cl_sampler), &s));
+        set_arg_uncached(arg_index, sizeof(cl_sampler), &s);
       }
 
       void set_arg_buf(cl_uint arg_index, py::object py_buffer)
@@ -3308,8 +3437,7 @@ namespace pyopencl
               "invalid kernel argument");
         }
 
-        PYOPENCL_CALL_GUARDED(clSetKernelArg,
-            (m_kernel, arg_index, len, buf));
+        set_arg_cached(arg_index, ARG_VALUE, len, buf);
       }
 
       void set_arg(cl_uint arg_index, py::object arg)
@@ -3344,6 +3472,142 @@ namespace pyopencl
         set_arg_buf(arg_index, arg);
       }
 
+      // {{{ fast argument setting
+
+      int num_args()
+      {
+        if (m_num_args < 0)
+        {
+          cl_uint result;
+          PYOPENCL_CALL_GUARDED(clGetKernelInfo,
+              (m_kernel, CL_KERNEL_NUM_ARGS, sizeof(result), &result, 0));
+          m_num_args = result;
+        }
+        return m_num_args;
+      }
+
+      static bool is_supported_type_char(char c)
+      {
+        switch (c)
+        {
+          case 'b': case 'B': case 'h': case 'H': case 'i': case 'I':
+          case 'l': case 'L': case 'q': case 'Q':
+          case 'f': case 'd': case 'F': case 'D':
+            return true;
+          default:
+            return false;
+        }
+      }
+
+      bool set_arg_type_chars(py::object py_type_chars)
+      {
+        std::vector<char> type_chars;
+
+        PYTHON_FOREACH(py_type_char, py_type_chars)
+        {
+          if (py_type_char.ptr() == Py_None)
+            type_chars.push_back(0);
+          else
+          {
+            std::string type_char = py::extract<std::string>(py_type_char);
+            if (type_char.size() != 1)
+              throw error("Kernel.set_arg_type_chars", CL_INVALID_VALUE,
+                  "type characters must be strings of length one");
+
+            if (type_char[0] == 'V')
+              type_chars.push_back(0);
+            else if (is_supported_type_char(type_char[0]))
+              type_chars.push_back(type_char[0]);
+            else
+            {
+              m_arg_type_chars.clear();
+              return false;
+            }
+          }
+        }
+
+        m_arg_type_chars.swap(type_chars);
+        return true;
+      }
+
+      void set_scalar_arg(cl_uint arg_index, char type_char, PyObject *obj)
+      {
+        switch (type_char)
+        {
+#define PYOPENCL_SET_INTEGER_ARG(TYPE_CHAR, TYPE) \
+          case TYPE_CHAR: \
+            { \
+              TYPE value = scalar_arg_to_integer<TYPE>(obj); \
+              set_arg_cached(arg_index, ARG_VALUE, sizeof(value), &value); \
+              return; \
+            }
+
+          PYOPENCL_SET_INTEGER_ARG('b', signed char);
+          PYOPENCL_SET_INTEGER_ARG('B', unsigned char);
+          PYOPENCL_SET_INTEGER_ARG('h', short);
+          PYOPENCL_SET_INTEGER_ARG('H', unsigned short);
+          PYOPENCL_SET_INTEGER_ARG('i', int);
+          PYOPENCL_SET_INTEGER_ARG('I', unsigned int);
+          PYOPENCL_SET_INTEGER_ARG('l', long);
+          PYOPENCL_SET_INTEGER_ARG('L', unsigned long);
+          PYOPENCL_SET_INTEGER_ARG('q', PY_LONG_LONG);
+          PYOPENCL_SET_INTEGER_ARG('Q', unsigned PY_LONG_LONG);
+#undef PYOPENCL_SET_INTEGER_ARG
+
+          case 'f':
+            {
+              float value = (float) scalar_arg_to_double(obj);
+              set_arg_cached(arg_index, ARG_VALUE, sizeof(value), &value);
+              return;
+            }
+          case 'd':
+            {
+              double value = scalar_arg_to_double(obj);
+              set_arg_cached(arg_index, ARG_VALUE, sizeof(value), &value);
+              return;
+            }
+          case 'F':
+            {
+              Py_complex c = scalar_arg_to_complex(obj);
+              float value[2] = { (float) c.real, (float) c.imag };
+              set_arg_cached(arg_index, ARG_VALUE, sizeof(value), value);
+              return;
+            }
+          case 'D':
+            {
+              Py_complex c = scalar_arg_to_complex(obj);
+              double value[2] = { c.real, c.imag };
+              set_arg_cached(arg_index, ARG_VALUE, sizeof(value), value);
+              return;
+            }
+          default:
+            throw error("Kernel.set_args", CL_INVALID_VALUE,
+                "unsupported scalar argument type");
+        }
+      }
+
+      void set_args(py::object py_args)
+      {
+        const Py_ssize_t arg_count = py::len(py_args);
+
+        if (arg_count != num_args())
+          throw error("Kernel.set_args", CL_INVALID_VALUE,
+              "length of argument list and CL-generated number of "
+              "arguments do not agree");
+
+        for (Py_ssize_t i = 0; i < arg_count; ++i)
+        {
+          py::object arg = py_args[i];
+
+          if (size_t(i) < m_arg_type_chars.size() && m_arg_type_chars[i])
+            set_scalar_arg(i, m_arg_type_chars[i], arg.ptr());
+          else
+            set_arg(i, arg);
+        }
+      }
+
+      // }}}
+
       py::object get_info(cl_kernel_info param_name) const
       {
         switch (param_name)
@@ -3542,6 +3806,44 @@ namespace pyopencl
 
 
 
+  inline
+  py::list enqueue_nd_range_kernels(
+      command_queue &cq,
+      py::object py_launches,
+      py::object py_events)
+  {
+    // Events are appended as soon as their launch is enqueued, so that a
+    // caller-supplied list holds those of the launches enqueued before
+    // an error.
+    py::list result;
+    if (py_events.ptr() != Py_None)
+      result = py::extract<py::list>(py_events);
+
+    PYTHON_FOREACH(py_launch, py_launches)
+    {
+      if (py::len(py_launch) != 5)
+        throw error("enqueue_nd_range_kernels", CL_INVALID_VALUE,
+            "each launch must be a tuple "
+            "(kernel, global_size, local_size, args, wait_for)");
+
+      kernel &knl = py::extract<kernel &>(py_launch[0]);
+
+      py::object py_args = py_launch[3];
+      if (py_args.ptr() != Py_None)
+        knl.set_args(py_args);
+
+      result.append(handle_from_new_ptr(
+            enqueue_nd_range_kernel(cq, knl,
+              py_launch[1], py_launch[2], py::object(), py_launch[4],
+              /* g_times_l */ false)));
+    }
+
+    return result;
+  }
+
+
+
+
 
 
   inline
@@ -247,6 +247,8 @@ void pyopencl_expose_part_2()
       .DEF_SIMPLE_METHOD(get_info)
       .DEF_SIMPLE_METHOD(get_work_group_info)
       .DEF_SIMPLE_METHOD(set_arg)
+      .def("_set_arg_type_chars", &cls::set_arg_type_chars)
+      .def("_set_args", &cls::set_args)
 #if PYOPENCL_CL_VERSION >= 0x1020
       .DEF_SIMPLE_METHOD(get_arg_info)
 #endif
@@ -275,6 +277,9 @@ void pyopencl_expose_part_2()
       py::arg("g_times_l")=false
       ),
       py::return_value_policy<py::manage_new_object>());
+  py::def("enqueue_nd_range_kernels", enqueue_nd_range_kernels,
+      (py::args("queue", "launches"),
+       py::arg("events")=py::object()));
   py::def("enqueue_task", enqueue_task,
       (py::args("queue", "kernel"),
       py::arg("wait_for")=py::object()
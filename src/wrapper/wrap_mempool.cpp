@@ -179,6 +179,37 @@ namespace
 
 
 
+  class cl_memory_pool : public pyopencl::memory_pool<cl_allocator_base>
+  {
+    private:
+      typedef pyopencl::memory_pool<cl_allocator_base> super;
+
+      py::object m_out_of_memory_callback;
+
+    public:
+      cl_memory_pool(cl_allocator_base const &alloc)
+        : super(alloc)
+      { }
+
+      py::object get_out_of_memory_callback() const
+      { return m_out_of_memory_callback; }
+
+      void set_out_of_memory_callback(py::object callback)
+      { m_out_of_memory_callback = callback; }
+
+    protected:
+      bool handle_out_of_memory(size_type size)
+      {
+        if (m_out_of_memory_callback.ptr() == Py_None)
+          return false;
+
+        return py::extract<bool>(m_out_of_memory_callback(size));
+      }
+  };
+
+
+
+
   class pooled_buffer
     : public pyopencl::pooled_allocation<pyopencl::memory_pool<cl_allocator_base> >,
     public pyopencl::memory_object_holder
@@ -202,8 +233,8 @@ namespace
 
 
   pooled_buffer *device_pool_allocate(
-      boost::shared_ptr<pyopencl::memory_pool<cl_allocator_base> > pool,
-      pyopencl::memory_pool<cl_allocator_base>::size_type sz)
+      boost::shared_ptr<cl_memory_pool> pool,
+      cl_memory_pool::size_type sz)
   {
     return new pooled_buffer(pool, sz);
   }
@@ -211,6 +242,62 @@ namespace
 
 
 
+  template<class Pool>
+  py::object pool_get_max_held_bytes(Pool const &pool)
+  {
+    if (pool.has_max_held_bytes())
+      return py::object(pool.max_held_bytes());
+    else
+      return py::object();
+  }
+
+
+
+
+  template<class Pool>
+  void pool_set_max_held_bytes(Pool &pool, py::object max_held_bytes)
+  {
+    if (max_held_bytes.ptr() == Py_None)
+      pool.clear_max_held_bytes();
+    else
+      pool.set_max_held_bytes(
+          py::extract<typename Pool::size_type>(max_held_bytes));
+  }
+
+
+
+
+  template<class Pool>
+  py::dict pool_get_bin_stats(Pool const &pool)
+  {
+    py::dict result;
+
+    typedef typename Pool::bin_stats_container_t container_t;
+    BOOST_FOREACH(typename container_t::value_type const &stats_pair,
+        pool.get_bin_stats())
+    {
+      typename Pool::bin_stats const &stats = stats_pair.second;
+      typename Pool::size_type alloc_sz = Pool::alloc_size(stats_pair.first);
+
+      py::dict bin_dict;
+      bin_dict["hits"] = stats.hits;
+      bin_dict["misses"] = stats.misses;
+      bin_dict["held_blocks"] = stats.held_blocks;
+      bin_dict["held_bytes"] = stats.held_blocks*alloc_sz;
+      bin_dict["active_blocks"] = stats.active_blocks;
+      bin_dict["active_bytes"] = stats.active_blocks*alloc_sz;
+      bin_dict["peak_active_blocks"] = stats.peak_active_blocks;
+      bin_dict["peak_active_bytes"] = stats.peak_active_blocks*alloc_sz;
+
+      result[alloc_sz] = bin_dict;
+    }
+
+    return result;
+  }
+
+
+
+
   template<class Wrapper>
   void expose_memory_pool(Wrapper &wrapper)
   {
@@ -218,6 +305,15 @@ namespace
     wrapper
       .add_property("held_blocks", &cls::held_blocks)
       .add_property("active_blocks", &cls::active_blocks)
+      .add_property("held_bytes", &cls::held_bytes)
+      .add_property("active_bytes", &cls::active_bytes)
+      .add_property("peak_held_bytes", &cls::peak_held_bytes)
+      .add_property("peak_active_bytes", &cls::peak_active_bytes)
+      .add_property("max_held_bytes",
+          pool_get_max_held_bytes<cls>,
+          pool_set_max_held_bytes<cls>)
+      .def("get_bin_stats", pool_get_bin_stats<cls>)
+      .DEF_SIMPLE_METHOD(reset_stats)
       .DEF_SIMPLE_METHOD(bin_number)
       .DEF_SIMPLE_METHOD(alloc_size)
       .DEF_SIMPLE_METHOD(free_held)
@@ -260,7 +356,7 @@ void pyopencl_expose_mempool()
   }
 
   {
-    typedef pyopencl::memory_pool<cl_allocator_base> cls;
+    typedef cl_memory_pool cls;
 
     py::class_<
       cls, boost::noncopyable,
@@ -272,6 +368,9 @@ void pyopencl_expose_mempool()
           py::return_value_policy<py::manage_new_object>())
       .def("__call__", device_pool_allocate,
           py::return_value_policy<py::manage_new_object>())
+      .add_property("out_of_memory_callback",
+          &cls::get_out_of_memory_callback,
+          &cls::set_out_of_memory_callback)
       // undoc for now
       .DEF_SIMPLE_METHOD(set_trace)
       ;
@@ -419,6 +419,108 @@ def test_struct_reduce(ctx_factory):
     assert abs(minmax["cur_min"] - np.min(a)) < 1e-5
     assert abs(minmax["cur_max"] - np.max(a)) < 1e-5
 
+@pytools.test.mark_test.opencl
+def test_reduction_autotuning(ctx_factory):
+    from pytest import importorskip
+    importorskip("mako")
+
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    import os
+    import pyopencl.reduction as red
+    tuning_file = red.get_reduction_tuning_file()
+    if os.path.exists(tuning_file):
+        saved_tuning = open(tuning_file, "rb").read()
+    else:
+        saved_tuning = None
+
+    try:
+        sizes = [1000, 100000]
+        tuned = red.autotune_reduction(queue, np.float32, sizes, nruns=1)
+        assert sorted(tuned) == sizes
+
+        # the file is read back in the same way by other processes
+        red._reduction_tuning_table = None
+        krnl = red.get_sum_kernel(context, np.float32, np.float32)
+        for size in sizes:
+            assert red._get_reduction_tuning(
+                    queue, np.dtype(np.float32), krnl._get_tuning_id(),
+                    size) == tuned[size]
+
+        # other kernels of the same dtype are not affected
+        max_krnl = red.ReductionKernel(context, np.float32, neutral="-INFINITY",
+                reduce_expr="max(a, b)", arguments="__global float *in")
+        assert max_krnl._get_tuning_id() != krnl._get_tuning_id()
+        assert red._get_reduction_tuning(queue, np.dtype(np.float32),
+                max_krnl._get_tuning_id(), sizes[0]) is None
+
+        a = np.random.rand(10**5).astype(np.float32)
+        a_gpu = cl_array.to_device(queue, a)
+        assert abs(cl_array.sum(a_gpu).get() - a.sum()) / a.sum() < 1e-4
+
+        for params in red._get_tuning_candidates(
+                queue.device, krnl.stage_1_inf.group_size):
+            result = krnl(a_gpu, tuning=params).get()
+            assert abs(result - a.sum()) / a.sum() < 1e-4
+    finally:
+        if saved_tuning is None:
+            os.unlink(tuning_file)
+        else:
+            outf = open(tuning_file, "wb")
+            outf.write(saved_tuning)
+            outf.close()
+
+        red._reduction_tuning_table = None
+        red._device_reduction_tuning.clear()
+
+
+@pytools.test.mark_test.opencl
+def test_multi_reduction(ctx_factory):
+    from pytest import importorskip
+    importorskip("mako")
+
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.reduction import MultiReductionKernel
+    stats = MultiReductionKernel(context, [
+        ("sum", np.float32, "0", "a+b", "x[i]"),
+        ("sum_sq", np.float32, "0", "a+b", "x[i]*x[i]"),
+        ("min", np.float32, "INFINITY", "fmin(a, b)", "x[i]"),
+        ("max", np.float32, "-INFINITY", "fmax(a, b)", "x[i]"),
+        ("count", np.int32, "0", "a+b", "x[i] > 0.5f"),
+        ], arguments="__global float *x")
+
+    for n in [1, 1000, 100000, 10**6]:
+        a = np.random.rand(n).astype(np.float32)
+        a_gpu = cl_array.to_device(queue, a)
+
+        result = stats(a_gpu).get()
+        assert abs(result["sum"] - a.sum()) / a.sum() < 1e-4
+        assert abs(result["sum_sq"] - (a*a).sum()) / (a*a).sum() < 1e-4
+        assert result["min"] == a.min()
+        assert result["max"] == a.max()
+        assert result["count"] == (a > 0.5).sum()
+
+    # a struct of the same layout registered elsewhere is used, and
+    # declared by the kernel under its registered name
+    from pyopencl.tools import match_dtype_to_c_struct, get_or_register_dtype
+    range_dtype, _ = match_dtype_to_c_struct(context.devices[0],
+            "user_range", np.dtype([("min", np.float32), ("max", np.float32)]))
+    range_dtype = get_or_register_dtype("user_range", range_dtype)
+
+    min_max = MultiReductionKernel(context, [
+        ("min", np.float32, "INFINITY", "fmin(a, b)", "x[i]"),
+        ("max", np.float32, "-INFINITY", "fmax(a, b)", "x[i]"),
+        ], arguments="__global float *x")
+    assert min_max.dtype_out == range_dtype
+
+    a = np.random.rand(1000).astype(np.float32)
+    result = min_max(cl_array.to_device(queue, a)).get()
+    assert result["min"] == a.min()
+    assert result["max"] == a.max()
+
 # }}}
 
 # {{{ scan-related
@@ -826,6 +928,48 @@ def test_key_value_sorter(ctx_factory):
         start, end = starts[i:i+2]
         assert sorted(mydict[i]) == sorted(lists[start:end])
 
+@pytools.test.mark_test.opencl
+def test_segmented_reduction(ctx_factory):
+    from pytest import importorskip
+    importorskip("mako")
+
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.reduction import SegmentedReductionKernel
+    seg_sum = SegmentedReductionKernel(context, np.int64, "0", "a+b",
+            arguments="const long *in")
+
+    # short segments (one work item each) from a list builder
+    from pyopencl.algorithm import ListOfListsBuilder
+    builder = ListOfListsBuilder(context, [("mylist", np.int64)], """//CL//
+            void generate(LIST_ARG_DECL USER_ARG_DECL index_type i)
+            {
+                for (int j = 0; j < i % 7; ++j)
+                    APPEND_mylist(i+j);
+            }
+            """, arg_decls=[])
+
+    inf = builder(queue, 2000)["mylist"]
+    sums = seg_sum(inf, inf.lists).get()
+    assert (sums == [sum(i+j for j in range(i % 7)) for i in range(2000)]).all()
+
+    # long segments (one work group each) from a key-value sorter
+    n = 10**5
+    nkeys = 100
+    from pyopencl.clrandom import rand as clrand
+    keys = clrand(queue, n, np.int32, b=nkeys)
+    values = clrand(queue, n, np.int32, b=n).astype(np.int64)
+
+    from pyopencl.algorithm import KeyValueSorter
+    starts, lists = KeyValueSorter(context)(
+            queue, keys, values, nkeys, starts_dtype=np.int32)
+
+    sums = seg_sum(starts, lists).get()
+    keys = keys.get()
+    values = values.get()
+    assert (sums == [values[keys == i].sum() for i in range(nkeys)]).all()
+
 # }}}
 
 
@@ -511,6 +511,356 @@ def test_mem_pool_with_arrays(ctx_factory):
     assert a_dev.allocator is mem_pool
     assert b_dev.allocator is mem_pool
 
+@pytools.test.mark_test.opencl
+def test_pinned_staging_pool(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    pool = cl_tools.PinnedHostPool(queue, max_held_bytes=1 << 20)
+
+    a = np.random.rand(1000).astype(np.float32)
+    a_dev = cl_array.to_device(queue, a, staging_pool=pool)
+
+    for i in range(5):
+        result = a_dev.get(staging_pool=pool)
+        assert (result == a).all()
+        assert pool.active_blocks == 1
+
+    del result
+    assert pool.active_blocks == 0
+    # one block for the result being replaced, one for its replacement
+    assert pool.held_blocks == 2
+
+    pool.free_held()
+    assert pool.held_blocks == 0 and pool.held_bytes == 0
+
+@pytools.test.mark_test.opencl
+def test_elwise_kernel_noncontiguous(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.elementwise import ElementwiseKernel
+    knl = ElementwiseKernel(context,
+            "float *z, float *x, float *y",
+            "z[i] = 2*x[i] + y[i]")
+
+    a = np.random.rand(30, 40).astype(np.float32)
+    b = np.random.rand(40, 30).astype(np.float32)
+    a_gpu = cl_array.to_device(queue, a)
+    b_gpu = cl_array.to_device(queue, b)
+
+    # a transposed view from as_strided
+    b_t_gpu = cl_array.as_strided(b_gpu, (30, 40), b_gpu.strides[::-1])
+    assert not b_t_gpu.flags.forc
+
+    z_gpu = cl_array.empty_like(a_gpu)
+    knl(z_gpu, a_gpu, b_t_gpu)
+    assert la.norm(z_gpu.get() - (2*a + b.T)) < 1e-5
+
+    # strided slices, written through as well as read
+    z_gpu = cl_array.zeros(queue, (30, 80), np.float32)
+    knl(z_gpu[:, ::2], a_gpu, b_t_gpu)
+    z = z_gpu.get()
+    assert la.norm(z[:, ::2] - (2*a + b.T)) < 1e-5
+    assert (z[:, 1::2] == 0).all()
+
+    # non-contiguous transfers and copies
+    assert (z_gpu[:, ::2].get() == z[:, ::2]).all()
+    assert (b_t_gpu.copy().get() == b.T).all()
+
+    a_gpu[::3].set(np.zeros((10, 40), np.float32))
+    a[::3] = 0
+    assert (a_gpu.get() == a).all()
+
+    # arrays of other shapes and strides reuse the same kernel
+    from pyopencl.elementwise import _get_stride_pattern
+    c = np.random.rand(50, 20).astype(np.float32)
+    c_gpu = cl_array.to_device(queue, c)
+    c_t_gpu = cl_array.as_strided(c_gpu, (20, 50), c_gpu.strides[::-1])
+    d_gpu = cl_array.to_device(queue, np.ones((20, 50), np.float32))
+    z_gpu = cl_array.empty_like(d_gpu)
+
+    assert (_get_stride_pattern([z_gpu, d_gpu, c_t_gpu])
+            == _get_stride_pattern([z_gpu, a_gpu, b_t_gpu]))
+    knl(z_gpu, d_gpu, c_t_gpu)
+    assert la.norm(z_gpu.get() - (2 + c.T)) < 1e-5
+
+@pytools.test.mark_test.opencl
+def test_axis_reductions(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    a = np.random.rand(7, 300, 5).astype(np.float32)
+    b = np.random.rand(7, 300, 5).astype(np.float32)
+    a_gpu = cl_array.to_device(queue, a)
+    b_gpu = cl_array.to_device(queue, b)
+
+    # short rows use one work item per row, long ones a work group
+    for axis in [0, 1, 2, -1, (0, 2), (1, 2)]:
+        result = cl_array.sum(a_gpu, axis=axis).get()
+        assert la.norm(result - a.sum(axis=axis)) < 1e-3
+
+        result = cl_array.dot(a_gpu, b_gpu, axis=axis).get()
+        assert la.norm(result - (a*b).sum(axis=axis)) < 1e-3
+
+        for what in ["min", "max"]:
+            result = getattr(cl_array, what)(a_gpu, axis=axis).get()
+            assert (result == getattr(a, what)(axis=axis)).all()
+
+    # reducing over all axes is an ordinary reduction
+    result = cl_array.sum(a_gpu, axis=(0, 1, 2)).get()
+    assert abs(result - a.sum()) / a.sum() < 1e-4
+
+    # non-contiguous input
+    a_t_gpu = cl_array.as_strided(
+            a_gpu, (5, 300, 7), a_gpu.strides[::-1])
+    result = cl_array.sum(a_t_gpu, axis=1).get()
+    assert la.norm(result - a.T.sum(axis=1)) < 1e-3
+
+    # other shapes of the same number of dimensions reuse the kernels
+    c = np.random.rand(3, 200, 9).astype(np.float32)
+    c_gpu = cl_array.to_device(queue, c)
+    for axis in [1, (0, 2)]:
+        result = cl_array.sum(c_gpu, axis=axis).get()
+        assert la.norm(result - c.sum(axis=axis)) < 1e-3
+
+
+@pytools.test.mark_test.opencl
+def test_single_pass_reduction(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.reduction import get_sum_kernel
+    krnl = get_sum_kernel(context, np.int32, np.int32)
+
+    # spans single-group, single-pass and two-stage reductions; repeated
+    # reductions check that the group counter gets reset
+    for n in [1, 1000, 5000, 100000, 10**6, 10**7, 5000, 1000]:
+        a = np.random.randint(0, 100, n).astype(np.int32)
+        a_gpu = cl_array.to_device(queue, a)
+
+        assert krnl(a_gpu).get() == a.sum()
+        assert cl_array.max(a_gpu).get() == a.max()
+        assert cl_array.min(a_gpu).get() == a.min()
+
+
+@pytools.test.mark_test.opencl
+def test_vectorized_kernels(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.elementwise import ElementwiseKernel, _get_vectorized_kernel
+    lin_comb = ElementwiseKernel(context,
+            "float a, float *x, float b, float *y, float *z",
+            "z[i] = a*x[i] + b*y[i]",
+            "linear_combination")
+    reverse = ElementwiseKernel(context,
+            "float *x, float *z",
+            "z[i] = x[n-1-i]",
+            "reverse")
+
+    knl = lin_comb.get_kernel(False)[0]
+
+    # sizes around the vector width, with and without a scalar tail
+    for n in [1, 3, 4, 5, 1001, 100003]:
+        a = np.random.randn(n+1).astype(np.float32)
+        b = np.random.randn(n+1).astype(np.float32)
+        a_gpu = cl_array.to_device(queue, a)
+        b_gpu = cl_array.to_device(queue, b)
+
+        # aligned arrays use the vectorized kernel, the shifted ones don't
+        for sl in [slice(0, n), slice(1, n+1)]:
+            x_gpu = a_gpu[sl]
+            y_gpu = b_gpu[sl]
+            z_gpu = cl_array.empty_like(x_gpu)
+
+            assert ((_get_vectorized_kernel(knl, [x_gpu, y_gpu, z_gpu], n)
+                    is not None) == (sl.start == 0 and n >= 4))
+
+            lin_comb(5, x_gpu, 6, y_gpu, z_gpu)
+            assert la.norm(z_gpu.get() - (5*a[sl] + 6*b[sl])) < 1e-4*n
+
+            assert la.norm((x_gpu + y_gpu).get() - (a[sl] + b[sl])) < 1e-4*n
+
+            reverse(x_gpu, z_gpu)
+            assert (z_gpu.get() == a[sl][::-1]).all()
+
+            assert abs(cl_array.sum(x_gpu).get() - a[sl].sum()) < 1e-3*n
+            assert abs(cl_array.dot(x_gpu, y_gpu).get()
+                    - np.dot(a[sl], b[sl])) < 1e-3*n
+
+    assert not hasattr(reverse.get_kernel(False)[0], "_pyopencl_vectorization")
+
+    # integer types of every width
+    for dtype in [np.int8, np.uint16, np.int32, np.int64]:
+        a = np.random.randint(0, 100, 1003).astype(dtype)
+        a_gpu = cl_array.to_device(queue, a)
+
+        assert cl_array.sum(a_gpu, dtype=dtype).get() == a.sum(dtype=dtype)
+        assert ((a_gpu + a_gpu).get() == a + a).all()
+
+
+@pytools.test.mark_test.opencl
+def test_launch_geometry_cache(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.array import splay, _get_kernel_work_group_size
+    from pyopencl.elementwise import get_fill_kernel
+
+    knl = get_fill_kernel(context, np.float32)
+    wg_size = knl.get_work_group_info(
+            cl.kernel_work_group_info.WORK_GROUP_SIZE, queue.device)
+    assert _get_kernel_work_group_size(knl, queue) == wg_size
+    assert _get_kernel_work_group_size(knl, queue) == wg_size
+
+    for n in [1, 31, 1000, 10**7]:
+        gs, ls = splay(queue, n, wg_size)
+        assert (gs, ls) == splay(queue, n, wg_size)
+        assert gs[0] % ls[0] == 0
+        assert ls[0] <= wg_size
+
+    # the device limits are queried once, the geometry fits the exact size
+    from pyopencl.array import _get_device_launch_limits, _splay
+    launch_limits = _get_device_launch_limits(queue.device)
+    assert launch_limits == (queue.device.max_work_group_size,
+            queue.device.max_compute_units)
+    for n in range(1020, 1030):
+        assert splay(queue, n, wg_size) == _splay(launch_limits, n, wg_size)
+
+    # cached geometry must still produce correct results
+    for n in [17, 1000, 17, 1000, 1025, 2047]:
+        a_gpu = cl_array.empty(queue, n, np.float32)
+        a_gpu.fill(3)
+        assert (a_gpu.get() == 3).all()
+        assert cl_array.sum(a_gpu).get() == 3*n
+
+
+@pytools.test.mark_test.opencl
+def test_kernel_launch_batch(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.array import KernelLaunchBatch
+    from pyopencl.elementwise import ElementwiseKernel
+
+    n = 1000
+    a = np.random.rand(n).astype(np.float32)
+    b = np.random.rand(n).astype(np.float32)
+    a_gpu = cl_array.to_device(queue, a)
+    b_gpu = cl_array.to_device(queue, b)
+
+    lin_comb = ElementwiseKernel(context,
+            "float a, float *x, float b, float *y, float *z",
+            "z[i] = a*x[i] + b*y[i]")
+
+    batch = KernelLaunchBatch(queue)
+    z_gpu = cl_array.empty_like(a_gpu)
+    assert lin_comb(2, a_gpu, 3, b_gpu, z_gpu, batch=batch) is None
+    assert lin_comb(1, z_gpu, 1, z_gpu, z_gpu, batch=batch) is None
+    assert len(batch) == 2
+
+    events = batch.flush()
+    assert len(events) == 2
+    assert len(batch) == 0
+    assert la.norm(z_gpu.get() - 2*(2*a + 3*b)) < 1e-5
+
+    # array operators collect their launches in an active batch, and
+    # transfers enqueue pending launches first
+    with KernelLaunchBatch(queue) as batch:
+        c_gpu = 2*a_gpu + b_gpu
+        d_gpu = c_gpu*c_gpu
+        assert len(batch) == 3
+        assert la.norm(c_gpu.get() - (2*a + b)) < 1e-5
+        assert len(batch) == 0
+        e_gpu = d_gpu - c_gpu
+
+    assert len(batch) == 0
+    assert la.norm(e_gpu.get() - ((2*a + b)**2 - (2*a + b))) < 1e-4
+
+    # a failing launch leaves those before it recorded with their arrays
+    from pyopencl.array import splay
+    from pyopencl.elementwise import get_fill_kernel
+    fill = get_fill_kernel(context, np.float32)
+    f_gpu = cl_array.empty(queue, n, np.float32)
+    fill_args = [f_gpu.base_data, f_gpu.offset, 5, n]
+
+    gs, ls = splay(queue, n)
+
+    batch = KernelLaunchBatch(queue)
+    batch.add(fill, gs, ls, args=fill_args, arrays=[f_gpu])
+    # local size does not divide global size
+    batch.add(fill, (3,), (2,), args=fill_args, arrays=[f_gpu])
+    try:
+        batch.flush()
+    except cl.LogicError, e:
+        assert len(e.events) == 1
+        assert e.events[0] in f_gpu.events
+    else:
+        assert False, "invalid launch was not reported"
+
+    assert len(batch) == 0
+    assert (f_gpu.get() == 5).all()
+
+
+@pytools.test.mark_test.opencl
+def test_arena_allocator(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    alloc = cl_tools.ArenaAllocator(context, arena_size=1 << 16)
+
+    arrays = [cl_array.empty(queue, 10+i, np.int32, allocator=alloc)
+            for i in range(50)]
+    for i, ary in enumerate(arrays):
+        ary.fill(i)
+    for i, ary in enumerate(arrays):
+        assert (ary.get() == i).all()
+
+    assert alloc.arena_count == 1
+    assert alloc.active_allocations == 50
+
+    # too large for an arena
+    big = cl_array.empty(queue, 1 << 14, np.float32, allocator=alloc)
+    assert alloc.active_allocations == 50
+    del big
+
+    del ary
+    del arrays
+    assert alloc.active_allocations == 0
+    assert alloc.current_arena.offset == 0
+
+    alloc.free_held()
+    assert alloc.arena_count == 0
+
+@pytools.test.mark_test.opencl
+def test_event_management(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    x = cl_array.arange(queue, 1000, dtype=np.float32)
+    assert len(x.events) == 1
+
+    y = x + x
+    assert len(y.events) == 1
+    assert len(x.events) == 2
+    assert y.events[0] is x.events[1]
+
+    # views share their events
+    assert x.reshape(10, 100).events is x.events
+
+    for i in range(40):
+        x += 1
+        assert len(x.events) <= 12
+
+    x.finish()
+    assert not x.events
+
+    x += 1
+    result = x.get()
+    assert not x.events
+    assert (result == np.arange(1000, dtype=np.float32) + 41).all()
+
 @pytools.test.mark_test.opencl
 def test_view(ctx_factory):
     context = ctx_factory()
@@ -531,6 +881,95 @@ def test_view(ctx_factory):
     view = a_dev.view(np.int16)
     assert view.shape == (8, 32) and view.dtype == np.int16
 
+@pytools.test.mark_test.opencl
+def test_slice(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.clrandom import rand as clrand
+
+    a_gpu = clrand(queue, (1000,), dtype=np.float32)
+    b_gpu = clrand(queue, (1000,), dtype=np.float32)
+    a = a_gpu.get()
+    b = b_gpu.get()
+
+    start, stop = 37, 589
+    a_slice = a_gpu[start:stop]
+    assert a_slice.offset == start*a.itemsize
+    assert a_slice.base_data is a_gpu.base_data
+    assert (a_slice.get() == a[start:stop]).all()
+
+    # elementwise, reduction and scan kernels honor the offset
+    assert la.norm((a_slice + b_gpu[start:stop]).get()
+            - (a[start:stop] + b[start:stop])) < 1e-5
+    assert abs(cl_array.sum(a_slice).get() - np.sum(a[start:stop])) < 1e-2
+
+    from pyopencl.scan import InclusiveScanKernel
+    knl = InclusiveScanKernel(context, np.float32, "a+b", "0")
+    c_gpu = b_gpu.copy()
+    knl(c_gpu[start:stop])
+    c = c_gpu.get()
+    assert la.norm(c[start:stop] - np.cumsum(b[start:stop])) < 1e-2
+    assert (c[:start] == b[:start]).all()
+
+    # writes through a view land in the original array
+    a_gpu[start:stop].fill(17)
+    assert (a_gpu.get()[start:stop] == 17).all()
+
+    # strided views and rows of 2D arrays
+    assert (a_gpu[::7].get() == a_gpu.get()[::7]).all()
+
+    m_gpu = a_gpu[:600].reshape(20, 30)
+    m = m_gpu.get()
+    assert (m_gpu[3].get() == m[3]).all()
+    assert (m_gpu[3:7].get() == m[3:7]).all()
+    assert (m_gpu[..., 2].get() == m[..., 2]).all()
+
+    try:
+        a_slice.data
+    except cl_array.ArrayHasOffsetError:
+        pass
+    else:
+        assert False
+
+# }}}
+
+# {{{ deferred evaluation
+
+@pytools.test.mark_test.opencl
+def test_deferred_expression(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.clrandom import rand as clrand
+    from pyopencl.deferred import defer, DeferredArray, get_fused_kernel
+    import pyopencl.clmath as clmath
+
+    l = 20000
+    x_gpu = clrand(queue, (l,), dtype=np.float32)
+    y_gpu = clrand(queue, (l,), dtype=np.float32)
+    z_gpu = clrand(queue, (l,), dtype=np.float32)
+    x, y, z = x_gpu.get(), y_gpu.get(), z_gpu.get()
+
+    a, b = 3, 2.5
+
+    expr = a*defer(x_gpu) + b*defer(y_gpu)**2 + clmath.sin(defer(z_gpu))
+    assert isinstance(expr, DeferredArray)
+
+    # the whole expression is evaluated by a single fused kernel
+    get_fused_kernel.first_arg_cache.clear()
+    result = expr.get()
+    assert len(get_fused_kernel.first_arg_cache) == 1
+    ref = a*x + b*y**2 + np.sin(z)
+    assert la.norm(result - ref) / la.norm(ref) < 1e-5
+
+    # forcing twice must not recompute
+    assert expr.force() is expr.force()
+
+    w_gpu = x_gpu.copy()
+    w_gpu += defer(y_gpu) - 1
+    assert la.norm(w_gpu.get() - (x + y - 1)) / la.norm(x) < 1e-5
+
 # }}}
 
 @pytools.test.mark_test.opencl
@@ -236,6 +236,59 @@ def test_that_python_args_fail(ctx_factory):
     a_result = np.empty_like(a)
     cl.enqueue_read_buffer(queue, a_buf, a_result).wait()
 
+@pytools.test.mark_test.opencl
+def test_fast_set_args(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    prg = cl.Program(context, """
+        __kernel void axpb(__global float *out, __global const float *x,
+            float a, long b, uchar c)
+        { int i = get_global_id(0); out[i] = a*x[i] + b + c; }
+        """).build()
+
+    knl = prg.axpb
+    knl.set_scalar_arg_dtypes([None, None, np.float32, np.int64, np.uint8])
+
+    x = np.arange(100, dtype=np.float32)
+    x_gpu = cl_array.to_device(queue, x)
+    out_gpu = cl_array.empty_like(x_gpu)
+    out2_gpu = cl_array.empty_like(x_gpu)
+
+    # alternate changed and unchanged arguments, of Python and numpy types
+    for out, a, b, c in [
+            (out_gpu, 2, 3, 1),
+            (out_gpu, 2, 3, 1),
+            (out2_gpu, np.float32(2), np.int64(3), 1),
+            (out_gpu, 0.5, -(2**40), np.uint8(7)),
+            ]:
+        knl(queue, x.shape, None, out.data, x_gpu.data, a, b, c)
+        assert la.norm(out.get() - (np.float32(a)*x + b + c)) < 1e-3 * abs(b)
+
+    # a new buffer may get the handle of a released one, and must still
+    # be set as the argument
+    for i in range(3):
+        out_buf = cl.Buffer(context, cl.mem_flags.READ_WRITE, x.nbytes)
+        knl(queue, x.shape, None, out_buf, x_gpu.data, 1, 0, 0)
+
+        result = np.empty_like(x)
+        cl.enqueue_copy(queue, result, out_buf)
+        assert (result == x).all()
+
+        out_buf.release()
+
+    try:
+        knl(queue, x.shape, None, out_gpu.data, x_gpu.data, 1, 2, 256)
+        assert False, "out-of-range argument should be rejected"
+    except Exception:
+        pass
+
+    try:
+        knl(queue, x.shape, None, out_gpu.data, x_gpu.data, 1, 2)
+        assert False, "missing argument should be rejected"
+    except Exception:
+        pass
+
 @pytools.test.mark_test.opencl
 def test_image_2d(ctx_factory):
     context = ctx_factory()
@@ -431,6 +484,49 @@ def test_mempool_2():
         assert MemoryPool.bin_number(asize) == bin_nr, s
         assert asize < asize*(1+1/8)
 
+@pytools.test.mark_test.opencl
+def test_mempool_stats(ctx_factory):
+    from pyopencl.tools import MemoryPool, ImmediateAllocator
+
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    pool = MemoryPool(ImmediateAllocator(queue))
+    asize = MemoryPool.alloc_size(MemoryPool.bin_number(1 << 12))
+
+    bufs = [pool.allocate(1 << 12) for i in range(3)]
+    assert pool.active_bytes == 3*asize
+    assert pool.held_bytes == 0
+
+    del bufs
+    assert pool.active_bytes == 0
+    assert pool.held_bytes == 3*asize
+    assert pool.peak_active_bytes == 3*asize
+
+    buf = pool.allocate(1 << 12)
+    stats = pool.get_bin_stats()[asize]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["active_blocks"] == 1
+    assert stats["held_blocks"] == 2
+    del buf
+
+    assert pool.max_held_bytes is None
+    pool.max_held_bytes = asize
+    assert pool.max_held_bytes == asize
+    assert pool.held_blocks == 1
+    assert pool.held_bytes <= asize
+
+    pool.reset_stats()
+    stats = pool.get_bin_stats()[asize]
+    assert stats["hits"] == 0
+    assert stats["misses"] == 0
+    assert pool.peak_active_bytes == 0
+
+    pool.max_held_bytes = None
+    pool.out_of_memory_callback = lambda size: False
+    pool.stop_holding()
+
 @pytools.test.mark_test.opencl
 def test_vector_args(ctx_factory):
     context = ctx_factory()
@@ -472,6 +568,212 @@ def test_header_dep_handling(ctx_factory):
     cl.Program(context, kernel_src).build(["-I", os.getcwd()])
     cl.Program(context, kernel_src).build(["-I", os.getcwd()])
 
+@pytools.test.mark_test.opencl
+def test_in_memory_program_cache(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.cache import program_cache
+
+    kernel_src = """
+    kernel void zonk(global int *a)
+    {
+      *a = 7;
+    }
+    """
+
+    cl.Program(context, kernel_src).build()
+    hits = program_cache.hits
+    prg = cl.Program(context, kernel_src).build()
+    assert program_cache.hits == hits + 1
+
+    a_buf = cl.Buffer(context, cl.mem_flags.READ_WRITE, 4)
+    prg.zonk(queue, (1,), None, a_buf)
+    a = np.empty(1, np.int32)
+    cl.enqueue_copy(queue, a, a_buf)
+    assert a[0] == 7
+
+    # different options mean a different program
+    misses = program_cache.misses
+    cl.Program(context, kernel_src).build(["-DZONK"])
+    assert program_cache.misses == misses + 1
+
+    # distinct wrappers of the same context share entries, even once the
+    # one the program was built with is gone
+    cl.Program(queue.get_info(cl.command_queue_info.CONTEXT),
+            kernel_src).build(["-DWRAPPER"])
+    hits = program_cache.hits
+    cl.Program(queue.get_info(cl.command_queue_info.CONTEXT),
+            kernel_src).build(["-DWRAPPER"])
+    assert program_cache.hits == hits + 1
+
+    old_max_size = program_cache.max_size
+    try:
+        program_cache.max_size = 1
+        assert len(program_cache) <= 1
+    finally:
+        program_cache.max_size = old_max_size
+
+@pytools.test.mark_test.opencl
+def test_invalid_cache_entry():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join, exists
+    from pyopencl.cache import retrieve_from_cache
+
+    cache_dir = mkdtemp()
+    try:
+        entry_path = join(cache_dir, "0123abcd")
+        outf = open(entry_path, "wb")
+        outf.write("not a pickle")
+        outf.close()
+
+        assert retrieve_from_cache(cache_dir, "0123abcd") is None
+        assert not exists(entry_path)
+
+        assert retrieve_from_cache(cache_dir, "nonexistent") is None
+    finally:
+        rmtree(cache_dir)
+
+@pytools.test.mark_test.opencl
+def test_cache_eviction():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os import listdir
+    from os.path import join
+    from pyopencl.cache import (_write_atomically, _record_access,
+            read_index, evict)
+
+    cache_dir = mkdtemp()
+    try:
+        from time import sleep, time
+
+        keys = ["%032x" % i for i in range(5)]
+        for key in keys:
+            _write_atomically(join(cache_dir, key), 1000*"x")
+            _record_access(cache_dir, key, 1000)
+            sleep(0.01)
+
+        # touch the first entry, which makes the second one the oldest
+        _record_access(cache_dir, keys[0], 1000)
+
+        index, _ = read_index(cache_dir)
+        assert sorted(index) == keys
+
+        assert evict(cache_dir, 3500) == (2, 2000)
+        assert sorted(listdir(cache_dir)) == sorted(
+                [keys[0], keys[3], keys[4], "index"])
+        assert sorted(read_index(cache_dir)[0]) == [keys[0], keys[3], keys[4]]
+
+        # repeated hits do not grow the index without bound
+        from pyopencl.cache import INDEX_COMPACTION_INTERVAL
+        line_length = len("%s %d %.3f\n" % (keys[0], 1000, time()))
+        for i in xrange(2*INDEX_COMPACTION_INTERVAL // line_length):
+            _record_access(cache_dir, keys[0], 1000)
+
+        index, line_count = read_index(cache_dir)
+        assert sorted(index) == [keys[0], keys[3], keys[4]]
+        assert line_count * line_length <= INDEX_COMPACTION_INTERVAL
+    finally:
+        rmtree(cache_dir)
+
+@pytools.test.mark_test.opencl
+def test_dependency_scan_memoization():
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join, realpath
+    from pyopencl.cache import get_dependencies, check_dependencies
+
+    assert get_dependencies("kernel void f() {}", ["."]) == []
+
+    include_dir = mkdtemp()
+    try:
+        def write_header(name, contents):
+            outf = open(join(include_dir, name), "wt")
+            outf.write(contents)
+            outf.close()
+
+        write_header("a.h", "#include <b.h>\n#define A 1\n")
+        write_header("b.h", "#define B 1\n")
+
+        src = "#include <a.h>\nkernel void f() {}"
+        deps = get_dependencies(src, [include_dir])
+        assert [name for name, mtime, digest in deps] == [
+                realpath(join(include_dir, "a.h")),
+                realpath(join(include_dir, "b.h"))]
+        assert check_dependencies(deps)
+        assert get_dependencies(src, [include_dir]) == deps
+
+        # a change of size must be noticed even within the same second
+        write_header("b.h", "#define B 22\n")
+        assert not check_dependencies(deps)
+        assert get_dependencies(src, [include_dir]) != deps
+    finally:
+        rmtree(include_dir)
+
+@pytools.test.mark_test.opencl
+def test_build_pool(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.tools import BuildPool
+    from pyopencl.elementwise import ElementwiseKernel
+    from pyopencl.reduction import ReductionKernel
+
+    with BuildPool(max_workers=4) as pool:
+        elwise_futures = [
+                pool.submit(ElementwiseKernel, context,
+                    "float *x", "x[i] = %d" % i)
+                for i in range(4)]
+        red_future = pool.submit(ReductionKernel, context, np.float32,
+                neutral="0", reduce_expr="a+b", map_expr="x[i]*x[i]",
+                arguments="__global float *x")
+        prg_future = pool.build_program(context, "kernel void f() {}")
+        bad_future = pool.build_program(context, "kernel void f() { syntax error }")
+
+    a_gpu = cl_array.empty(queue, 100, np.float32)
+    for i, future in enumerate(elwise_futures):
+        assert future.done()
+        future.result()(a_gpu)
+        assert (a_gpu.get() == i).all()
+
+    assert red_future.result()(a_gpu).get() == 100*9
+    prg_future.result().f(queue, (1,), None)
+
+    assert bad_future.exception() is not None
+
+@pytools.test.mark_test.opencl
+def test_kernel_manifest(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join
+    from pyopencl.tools import (KernelManifestRecorder, warm_up_kernels,
+            read_kernel_manifest, clear_first_arg_caches)
+
+    tmp_dir = mkdtemp()
+    try:
+        manifest_name = join(tmp_dir, "kernels.json")
+
+        clear_first_arg_caches()
+        with KernelManifestRecorder(manifest_name):
+            a_gpu = cl_array.arange(queue, 100, dtype=np.float32)
+            (2*a_gpu + a_gpu).get()
+            cl_array.sum(a_gpu).get()
+
+        functions = set(entry["function"]
+                for entry in read_kernel_manifest(manifest_name))
+        assert "get_sum_kernel" in functions
+        assert "get_axpbyz_kernel" in functions
+
+        clear_first_arg_caches()
+        assert warm_up_kernels(context, manifest_name) == len(
+                read_kernel_manifest(manifest_name))
+    finally:
+        rmtree(tmp_dir)
+
 @pytools.test.mark_test.opencl
 def test_context_dep_memoize(ctx_factory):
     context = ctx_factory()
@@ -489,6 +791,80 @@ def test_context_dep_memoize(ctx_factory):
 
     assert counter[0] == 1
 
+
+@pytools.test.mark_test.opencl
+def test_context_dep_memoize_release(ctx_factory):
+    context = ctx_factory()
+
+    from pyopencl.tools import first_arg_dependent_memoize
+
+    @first_arg_dependent_memoize(max_size=2)
+    def get_program(ctx, value):
+        return cl.Program(ctx, "kernel void f() { int a = %d; }" % value).build()
+
+    cache = get_program.first_arg_cache
+
+    for value in range(3):
+        get_program(context, value)
+    assert len(cache) == 2
+    assert cache.misses == 3
+
+    # the least recently used value was dropped
+    get_program(context, 2)
+    assert cache.hits == 1
+    get_program(context, 0)
+    assert cache.misses == 4
+
+    # a context that is no longer used releases its cached results
+    import gc
+    import weakref
+    other_context = cl.Context(context.devices)
+    get_program(other_context, 0)
+    assert len(cache) == 3
+
+    context_ref = weakref.ref(other_context)
+    del other_context
+    gc.collect()
+
+    assert context_ref() is None
+    assert len(cache) == 2
+
+
+@pytools.test.mark_test.opencl
+def test_context_dep_memoize_wrappers(ctx_factory):
+    context = ctx_factory()
+    queue = cl.CommandQueue(context)
+
+    from pyopencl.tools import first_arg_dependent_memoize
+
+    @first_arg_dependent_memoize
+    def get_program(ctx):
+        return cl.Program(ctx, "kernel void f() { }").build()
+
+    cache = get_program.first_arg_cache
+
+    # every query returns a distinct wrapper of the same context
+    wrappers = [queue.get_info(cl.command_queue_info.CONTEXT)
+            for i in range(2)]
+    assert wrappers[0] is not wrappers[1]
+
+    for ctx in wrappers + [queue.context, queue.context, context]:
+        get_program(ctx)
+    assert cache.misses == 1
+    assert cache.hits == 4
+
+    a_gpu = cl_array.empty(queue, 10, np.float32)
+    b_gpu = cl_array.empty(queue, 10, np.float32)
+    get_program(a_gpu.context)
+    get_program(b_gpu.context)
+    assert cache.misses == 1
+    assert len(cache) == 1
+
+    # results outlive transient wrappers while others are alive
+    del wrappers
+    get_program(queue.get_info(cl.command_queue_info.CONTEXT))
+    assert cache.misses == 1
+
 @pytools.test.mark_test.opencl
 def test_can_build_binary(ctx_factory):
     ctx = ctx_factory()
@@ -505,6 +881,76 @@ def test_can_build_binary(ctx_factory):
     foo = cl.Program(ctx, [device], [binary])
     foo.build()
 
+@pytools.test.mark_test.opencl
+def test_command_scheduler(ctx_factory):
+    context = ctx_factory()
+    queues = [cl.CommandQueue(context) for i in range(3)]
+
+    from pyopencl.pipeline import CommandScheduler
+    sched = CommandScheduler(queues)
+
+    prg = cl.Program(context, """
+        __kernel void twice(__global float *a)
+        { a[get_global_id(0)] *= 2; }
+        """).build()
+
+    n = 10000
+    chunks = [np.random.rand(n).astype(np.float32) for i in range(6)]
+    results = [np.empty_like(c) for c in chunks]
+    bufs = [cl.Buffer(context, cl.mem_flags.READ_WRITE, chunks[0].nbytes)
+            for i in range(2)]
+
+    for i, (chunk, result) in enumerate(zip(chunks, results)):
+        buf = bufs[i % 2]
+        sched.copy_to_device(buf, chunk)
+        sched.kernel(prg.twice, (n,), None, buf)
+        sched.copy_to_host(result, buf)
+
+    sched.finish()
+
+    for chunk, result in zip(chunks, results):
+        assert la.norm(result - 2*chunk) == 0
+
+@pytools.test.mark_test.opencl
+def test_process_in_chunks(ctx_factory):
+    context = ctx_factory()
+    queues = [cl.CommandQueue(context) for i in range(3)]
+
+    from pyopencl.pipeline import process_in_chunks
+    from pyopencl.elementwise import ElementwiseKernel
+    from pyopencl.reduction import ReductionKernel
+
+    n = 100003
+    x = np.random.rand(n).astype(np.float32)
+    y = np.random.rand(n).astype(np.float32)
+    z = np.empty_like(x)
+
+    lin_comb = ElementwiseKernel(context,
+            "float a, float *x, float *y, float *z",
+            "z[i] = a*x[i] + y[i]")
+    process_in_chunks(queues, lin_comb, (np.float32(3), x, y, z),
+            chunk_size=7000, outputs=[3], buffer_count=3)
+    assert la.norm(z - (3*x + y)) / la.norm(z) < 1e-6
+
+    dot = ReductionKernel(context, np.float32, neutral="0",
+            reduce_expr="a+b", map_expr="x[i]*y[i]",
+            arguments="__global float *x, __global float *y")
+    result = process_in_chunks(queues, dot, (x, y), chunk_size=7000)
+    assert abs(result.get() - np.dot(x, y)) / np.dot(x, y) < 1e-4
+
+    dot_opt = ReductionKernel(context, np.float32, neutral="0",
+            reduce_expr="a+b", map_expr="x[i]*y[i]",
+            arguments="__global float *x, __global float *y",
+            options="-cl-mad-enable")
+    result = process_in_chunks(queues, dot_opt, (x, y), chunk_size=7000)
+    assert abs(result.get() - np.dot(x, y)) / np.dot(x, y) < 1e-4
+
+    empty = np.empty(0, dtype=np.float32)
+    result = process_in_chunks(queues, dot, (empty, empty), chunk_size=7000)
+    assert result.get() == 0
+    process_in_chunks(queues, lin_comb, (np.float32(3), empty, empty, empty),
+            chunk_size=7000, outputs=[3])
+
 
 
 